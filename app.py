@@ -1,14 +1,53 @@
 from flask import Flask
+from werkzeug.serving import is_running_from_reloader
 from config import Config
-from models import db
+from models import db, create_indexes
+from cache import itinerary_cache, destination_cache
+from jobs import job_pool
+from limiter import admission
+from llm import llm
+from metrics import metrics
+from timing import server_timing
+from profiling import profiler
+from tracing import tracer
+from prewarm import prewarmer
+from itinerary_store import backfill_command, compress_command
+from search import create_search_index, index_command
 
 app = Flask(__name__)
 app.config.from_object(Config)
+app.logger.setLevel(app.config['LOG_LEVEL'])
 db.init_app(app)
+itinerary_cache.init_app(app)
+destination_cache.init_app(app)
+job_pool.init_app(app)
+admission.init_app(app)
+llm.init_app(app)
+metrics.init_app(app)
+server_timing.init_app(app)
+profiler.init_app(app)
+tracer.init_app(app)
+prewarmer.init_app(app)
+app.cli.add_command(backfill_command)
+app.cli.add_command(compress_command)
+app.cli.add_command(index_command)
 
 from routes import *
 
+
+def start_background_threads():
+    """Start the generation workers and the pre-warmer of a process that serves requests."""
+    job_pool.start()
+    prewarmer.start()
+
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        create_indexes(db.engine)
+        # Saving a trip indexes it, so the index has to exist before the first request
+        create_search_index(db.engine)
+    # Only in the process the reloader serves from, not in the one watching files
+    if is_running_from_reloader():
+        start_background_threads()
     app.run(debug=True)
@@ -0,0 +1,221 @@
+"""A local HTTP stand-in for the Gemini API, for load tests.
+
+    python -m benchmarks.fake_gemini --port 8081 --rpm 60 --outage-every 120 --outage-for 15
+    GEMINI_BASE_URL=http://127.0.0.1:8081 GEMINI_API_KEY=fake gunicorn app:app
+
+Serves generateContent and streamGenerateContent (server-sent events) with
+responses from the fake LLM backend, so the real google-genai client,
+retries, hedging and admission control are exercised end to end. Answers
+429 RESOURCE_EXHAUSTED above the per-model quota (--rpm) and at random
+(--429-rate), and 503 UNAVAILABLE at random (--503-rate) and for the
+whole of periodic outages. GET /stats returns what it has served.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from google.genai import errors
+
+from llm import FakeBackend
+
+_ROUTE = re.compile(r'^/[^/]+/models/([^/:]+):(generateContent|streamGenerateContent)$')
+
+
+def _error(code, status, message):
+    return code, {'error': {'code': code, 'status': status, 'message': message}}
+
+
+class FakeGeminiServer:
+    """Threaded HTTP server answering like the Gemini REST API."""
+
+    def __init__(self, host='127.0.0.1', port=0, backend=None, rpm=None, outage_every=0, outage_for=0):
+        self.backend = backend or FakeBackend()
+        self.rpm = rpm
+        self.outage_every = outage_every
+        self.outage_for = outage_for
+        self.started = time.monotonic()
+        self.stats = {'requests': 0, 'streams': 0, 'ok': 0, '429': 0, '503': 0, 'disconnected': 0,
+                      'in_flight': 0, 'peak_in_flight': 0}
+        self._quota = {}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-gemini', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self.stats[name] += delta
+            if name == 'in_flight':
+                self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.stats['in_flight'])
+
+    def _refused(self, model_name):
+        """(status, body) when quota or an outage refuses this call, else None."""
+        now = time.monotonic()
+        if self.outage_every and (now - self.started) % self.outage_every < self.outage_for:
+            return _error(503, 'UNAVAILABLE', 'The model is overloaded. Please try again later.')
+        if self.rpm:
+            with self._lock:
+                # Token bucket holding one minute of quota
+                tokens, updated = self._quota.get(model_name, (self.rpm, now))
+                tokens = min(self.rpm, tokens + (now - updated) * self.rpm / 60)
+                allowed = tokens >= 1
+                self._quota[model_name] = (tokens - 1 if allowed else tokens, now)
+            if not allowed:
+                return _error(429, 'RESOURCE_EXHAUSTED', 'Quota exceeded for requests per minute.')
+        return None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, code, body):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _refuse(self, code, body):
+                if str(code) in server.stats:
+                    server._count(str(code))
+                self._json(code, body)
+
+            def do_GET(self):
+                if self.path == '/stats':
+                    with server._lock:
+                        self._json(200, dict(server.stats))
+                else:
+                    self._json(*_error(404, 'NOT_FOUND', self.path))
+
+            def do_POST(self):
+                path = self.path.split('?', 1)[0]
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+                match = _ROUTE.match(path)
+                if match is None:
+                    self._json(*_error(404, 'NOT_FOUND', path))
+                    return
+                model_name, method = match.groups()
+                prompt = ''.join(part.get('text', '') for content in body.get('contents', [])
+                                 for part in content.get('parts', []))
+                generation_config = body.get('generationConfig') or {}
+                config = SimpleNamespace(response_schema=generation_config.get('responseSchema'))
+                server._count('requests')
+                server._count('in_flight')
+                try:
+                    refused = server._refused(model_name)
+                    if refused is not None:
+                        self._refuse(*refused)
+                    elif method == 'streamGenerateContent':
+                        server._count('streams')
+                        self._stream(model_name, prompt, config)
+                    else:
+                        usage = {}
+                        text = server.backend.generate(model_name, prompt, config, usage)
+                        self._json(200, _response(model_name, text, usage, final=True))
+                        server._count('ok')
+                except errors.APIError as e:
+                    self._refuse(e.code, e.details)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on the call, e.g. a hedged request that lost
+                    server._count('disconnected')
+                    self.close_connection = True
+                finally:
+                    server._count('in_flight', -1)
+
+            def _stream(self, model_name, prompt, config):
+                usage = {}
+                chunks = server.backend.stream(model_name, prompt, config, usage)
+                # Injected errors are raised before the first chunk, while a status can still be sent
+                first = next(chunks, None)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                # One chunk of lookahead so the last event carries the finish reason
+                previous = first
+                for chunk in chunks:
+                    self._event(_response(model_name, previous, usage))
+                    previous = chunk
+                if previous is not None:
+                    self._event(_response(model_name, previous, usage, final=True))
+                server._count('ok')
+
+            def _event(self, body):
+                self.wfile.write(b'data: ' + json.dumps(body).encode('utf-8') + b'\r\n\r\n')
+                self.wfile.flush()
+
+        return Handler
+
+
+def _response(model_name, text, usage, final=False):
+    candidate = {'content': {'parts': [{'text': text}], 'role': 'model'}, 'index': 0}
+    if final:
+        candidate['finishReason'] = 'STOP'
+    input_tokens = usage.get('input_tokens', 0)
+    output_tokens = usage.get('output_tokens', 0)
+    return {
+        'candidates': [candidate],
+        'usageMetadata': {'promptTokenCount': input_tokens, 'candidatesTokenCount': output_tokens,
+                          'totalTokenCount': input_tokens + output_tokens},
+        'modelVersion': model_name,
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency', default='lognormal:2,0.4', help='fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA')
+    parser.add_argument('--429-rate', dest='rate_limit_rate', type=float, default=0.0)
+    parser.add_argument('--503-rate', dest='unavailable_rate', type=float, default=0.0)
+    parser.add_argument('--rpm', type=float, help='per-model quota; calls beyond it get 429')
+    parser.add_argument('--outage-every', type=float, default=0, help='seconds between outages')
+    parser.add_argument('--outage-for', type=float, default=0, help='seconds each outage lasts')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def from_arguments(args, host='127.0.0.1', port=0):
+    backend = FakeBackend(latency=args.latency, rate_limit_rate=args.rate_limit_rate,
+                          unavailable_rate=args.unavailable_rate, seed=args.seed)
+    return FakeGeminiServer(host, port, backend, rpm=args.rpm,
+                            outage_every=args.outage_every, outage_for=args.outage_for)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    server = from_arguments(args, args.host, args.port)
+    print(f'Fake Gemini API on {server.url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""Load test: the app under gunicorn, Gemini replaced by a local fake server, mixed open-loop traffic.
+
+    python -m benchmarks.load --duration 60 --rates plan=0.5,view=5,export=1,list=0.5,delete=0.2
+    python -m benchmarks.load --steps 1,2,4,8 --rpm 60 --503-rate 0.05      # look for the saturation point
+    python -m benchmarks.load --url http://127.0.0.1:5000                   # an app that is already running
+
+Requests arrive as Poisson processes at the given rates whatever the
+state of earlier requests, and latency is measured from when a request
+was due, so a saturated server shows up as growing latency instead of
+fewer requests. 'plan' posts /generate; 'plan_done' is the time until its
+generation job finished. Fake server counters and the app's model attempt
+outcomes (from /metrics) are reported after each step.
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from benchmarks import fake_gemini
+from benchmarks.run import summarize
+from benchmarks.seed import DESTINATIONS, MOODS, seed
+
+OPERATIONS = ['plan', 'view', 'export', 'list', 'delete']
+DEFAULT_RATES = 'plan=0.5,view=5,export=1,list=0.5,delete=0.2'
+_ATTEMPTS = re.compile(r'^wandermate_llm_attempts_total\{model="([^"]+)",outcome="([^"]+)"\} ([0-9.e+]+)$', re.M)
+
+
+def parse_rates(spec):
+    rates = {}
+    for item in spec.split(','):
+        name, _, rate = item.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'unknown operation {name!r}; use {", ".join(OPERATIONS)}')
+        rates[name] = float(rate)
+    return rates
+
+
+def http(method, url, data=None, timeout=120):
+    """(status, body) of one request; connection failures count as status 0."""
+    body = urllib.parse.urlencode(data).encode('utf-8') if data is not None else None
+    request = urllib.request.Request(url, data=body, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except OSError as e:
+        return 0, str(e).encode('utf-8')
+
+
+class TripPool:
+    """Ids of trips that exist, shared by the view, export and delete operations."""
+
+    def __init__(self, ids):
+        self._ids = list(ids)
+        self._lock = threading.Lock()
+
+    def pick(self, rng):
+        with self._lock:
+            return rng.choice(self._ids) if self._ids else None
+
+    def take(self, rng):
+        with self._lock:
+            if not self._ids:
+                return None
+            index = rng.randrange(len(self._ids))
+            self._ids[index], self._ids[-1] = self._ids[-1], self._ids[index]
+            return self._ids.pop()
+
+    def add(self, trip_id):
+        with self._lock:
+            self._ids.append(trip_id)
+
+
+class Recorder:
+    def __init__(self):
+        self.results = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, latency, ok, status):
+        with self._lock:
+            result = self.results.setdefault(operation, {'latencies': [], 'errors': 0, 'statuses': {}})
+            result['latencies'].append(latency)
+            result['errors'] += 0 if ok else 1
+            result['statuses'][str(status)] = result['statuses'].get(str(status), 0) + 1
+
+
+class LoadRun:
+    """One step of traffic at fixed rates against base_url."""
+
+    def __init__(self, base_url, rates, duration, trips, concurrency=64, seed=0):
+        self.base_url = base_url.rstrip('/')
+        self.rates = rates
+        self.duration = duration
+        self.trips = trips
+        self.rng = random.Random(seed)
+        self.recorder = Recorder()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='load')
+        self._jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._done = threading.Event()
+
+    def run(self):
+        poller = threading.Thread(target=self._poll_jobs, name='job-poller', daemon=True)
+        poller.start()
+        started = time.monotonic()
+        # Next arrival of every operation, merged in time order
+        arrivals = [(started + self.rng.expovariate(rate), name) for name, rate in self.rates.items() if rate > 0]
+        heapq.heapify(arrivals)
+        while arrivals and arrivals[0][0] < started + self.duration:
+            due, name = heapq.heappop(arrivals)
+            time.sleep(max(0.0, due - time.monotonic()))
+            self.executor.submit(self._call, name, due)
+            heapq.heappush(arrivals, (due + self.rng.expovariate(self.rates[name]), name))
+        self.executor.shutdown(wait=True)
+        # Give queued generations a chance to finish before counting them as lost
+        deadline = time.monotonic() + 120
+        while self._jobs and time.monotonic() < deadline:
+            time.sleep(0.2)
+        self._done.set()
+        for job_id, due in self._jobs.items():
+            self.recorder.record('plan_done', time.monotonic() - due, False, 'unfinished')
+        return time.monotonic() - started
+
+    def _call(self, name, due):
+        rng = random.Random(self.rng.random())
+        url = self.base_url
+        if name == 'plan':
+            status, body = http('POST', f'{url}/generate', self._trip_form(rng))
+            self.recorder.record(name, time.monotonic() - due, status in (200, 202), status)
+            if status == 202:
+                with self._jobs_lock:
+                    self._jobs[json.loads(body)['job_id']] = due
+            elif status == 200:
+                self.recorder.record('plan_done', time.monotonic() - due, True, status)
+                self.trips.add(json.loads(body)['trip_id'])
+            return
+        if name == 'list':
+            status, _ = http('GET', f'{url}/trips')
+        else:
+            trip_id = self.trips.take(rng) if name == 'delete' else self.trips.pick(rng)
+            if trip_id is None:
+                return
+            path = {'view': f'/dashboard/{trip_id}', 'export': f'/export/{trip_id}',
+                    'delete': f'/delete_trip/{trip_id}'}[name]
+            status, _ = http('POST' if name == 'delete' else 'GET', url + path)
+        self.recorder.record(name, time.monotonic() - due, 200 <= status < 400, status)
+
+    def _trip_form(self, rng):
+        start = date.today() + timedelta(days=rng.randint(7, 180))
+        return {
+            'destination': rng.choice(DESTINATIONS),
+            'start_date': start.isoformat(),
+            'end_date': (start + timedelta(days=rng.randint(1, 9))).isoformat(),
+            'travelers': rng.randint(1, 4),
+            'budget': rng.choice([500, 1500, 4000]),
+            'mood': rng.choice(MOODS),
+            'preferences': rng.choice(['', 'street food', 'museums', 'hiking']),
+        }
+
+    def _poll_jobs(self):
+        while not self._done.is_set():
+            with self._jobs_lock:
+                pending = list(self._jobs.items())
+            for job_id, due in pending:
+                status, body = http('GET', f'{self.base_url}/jobs/{job_id}', timeout=30)
+                job = json.loads(body) if status == 200 else {}
+                if job.get('status') in ('done', 'failed'):
+                    with self._jobs_lock:
+                        self._jobs.pop(job_id, None)
+                    self.recorder.record('plan_done', time.monotonic() - due, job['status'] == 'done', job['status'])
+                    if job.get('trip_id'):
+                        self.trips.add(job['trip_id'])
+            time.sleep(0.5)
+
+    def summary(self, elapsed):
+        report = {}
+        for name, result in self.recorder.results.items():
+            report[name] = dict(summarize(result['latencies'], elapsed, result['errors']),
+                                statuses=result['statuses'])
+        return report
+
+
+def model_attempts(base_url):
+    """{'model outcome': count} of the app's model attempts so far, from /metrics."""
+    status, body = http('GET', f"{base_url.rstrip('/')}/metrics")
+    if status != 200:
+        return {}
+    attempts = {}
+    for model_name, outcome, value in _ATTEMPTS.findall(body.decode('utf-8')):
+        attempts[f'{model_name} {outcome}'] = attempts.get(f'{model_name} {outcome}', 0) + float(value)
+    return attempts
+
+
+def format_step(multiplier, rates, summary, gemini_stats, attempts):
+    offered = ', '.join(f'{name}={rate * multiplier:g}/s' for name, rate in rates.items())
+    lines = [f'step x{multiplier:g} ({offered})',
+             f"  {'operation':<10} {'requests':>8} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} "
+             f"{'p99 ms':>9}  statuses"]
+    for name in OPERATIONS[:1] + ['plan_done'] + OPERATIONS[1:]:
+        if name in summary:
+            s = summary[name]
+            error_rate = s['errors'] / s['requests'] if s['requests'] else 0
+            lines.append(f"  {name:<10} {s['requests']:>8} {error_rate:>7.1%} {s['rps']:>8} {s['p50_ms']:>9} "
+                         f"{s['p95_ms']:>9} {s['p99_ms']:>9}  {s['statuses']}")
+    if gemini_stats:
+        lines.append(f'  fake gemini: {gemini_stats}')
+    if attempts:
+        lines.append('  model attempts: ' + ', '.join(f'{key}={value:g}' for key, value in sorted(attempts.items())))
+    return '\n'.join(lines)
+
+
+def start_app(args, gemini_url, workdir):
+    """Seed a database and start the app under gunicorn; returns (process, base_url)."""
+    path = os.path.join(workdir, 'trips.db')
+    seed(path, args.trips)
+    metrics_dir = os.path.join(workdir, 'metrics')
+    os.makedirs(metrics_dir)
+    env = dict(os.environ,
+               DATABASE_URL=f'sqlite:///{path}',
+               LLM_BACKEND='gemini',
+               GEMINI_API_KEY='load-test',
+               GEMINI_BASE_URL=gemini_url,
+               PROMETHEUS_MULTIPROC_DIR=metrics_dir,
+               LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'))
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+               '--bind', f'127.0.0.1:{args.port}', '--timeout', '300', 'app:app']
+    process = subprocess.Popen(command, env=env)
+    base_url = f'http://127.0.0.1:{args.port}'
+    deadline = time.monotonic() + 30
+    while http('GET', f'{base_url}/', timeout=2)[0] != 200:
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.terminate()
+            raise SystemExit('The app did not start (is gunicorn installed? pip install -r requirements-dev.txt)')
+        time.sleep(0.2)
+    return process, base_url
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rates', type=parse_rates, default=parse_rates(DEFAULT_RATES),
+                        help=f'requests per second by operation (default {DEFAULT_RATES})')
+    parser.add_argument('--steps', default='1', help='comma-separated multipliers of the rates, run in turn')
+    parser.add_argument('--duration', type=float, default=60, help='seconds per step')
+    parser.add_argument('--concurrency', type=int, default=64, help='client threads')
+    parser.add_argument('--url', help='load an app that is already running instead of starting one')
+    parser.add_argument('--trips', type=int, default=1000, help='trips seeded before the run')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads per gunicorn worker')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    fake_gemini.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    gemini = None
+    app_process = None
+    with tempfile.TemporaryDirectory(prefix='wandermate-load-') as workdir:
+        try:
+            if args.url:
+                base_url = args.url
+            else:
+                gemini = fake_gemini.from_arguments(args).start()
+                app_process, base_url = start_app(args, gemini.url, workdir)
+            # Seeded trips have ids 1..trips; a running app is assumed to hold as many
+            trips = TripPool(range(1, args.trips + 1))
+            results = []
+            for n, multiplier in enumerate(float(step) for step in args.steps.split(',')):
+                rates = {name: rate * multiplier for name, rate in args.rates.items()}
+                before = model_attempts(base_url)
+                served = dict(gemini.stats) if gemini is not None else None
+                run = LoadRun(base_url, rates, args.duration, trips, args.concurrency, seed=n)
+                summary = run.summary(run.run())
+                attempts = {key: value - before.get(key, 0) for key, value in model_attempts(base_url).items()
+                            if value - before.get(key, 0)}
+                gemini_stats = None
+                if gemini is not None:
+                    gemini_stats = {key: value if key in ('in_flight', 'peak_in_flight') else value - served[key]
+                                    for key, value in gemini.stats.items()}
+                print(format_step(multiplier, args.rates, summary, gemini_stats, attempts), flush=True)
+                results.append({'multiplier': multiplier, 'rates': rates, 'operations': summary,
+                                'fake_gemini': gemini_stats, 'model_attempts': attempts})
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as f:
+                    json.dump(results, f, indent=2)
+        finally:
+            if app_process is not None:
+                app_process.terminate()
+                app_process.wait(timeout=30)
+            if gemini is not None:
+                gemini.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""End-to-end benchmarks of the trip endpoints on seeded databases.
+
+    python -m benchmarks.run                      # 10k and 100k trips, checked against budget.json
+    python -m benchmarks.run --sizes 1000000 --endpoints dashboard export delete_trip generate
+                                                  # the 1M trip database (about 13 GB)
+    python -m benchmarks.run --update-budget      # accept the measured numbers as the new budget
+
+Each size runs in its own process against a database seeded by
+benchmarks.seed, with the offline fake LLM backend. Latency is measured
+in-process through the Flask test client, so it is the server's own cost
+without any network. The run fails (exit status 1) when an endpoint's p95
+latency or throughput is worse than its budget by more than the tolerance,
+or when any request fails.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUDGET = os.path.join(HERE, 'budget.json')
+ENDPOINTS = ['trips', 'api_trips', 'search', 'dashboard', 'export', 'delete_trip', 'generate']
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """p50/p95/p99/mean latency in ms and requests per second for one endpoint."""
+    values = sorted(latency * 1000 for latency in latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'p50_ms': round(percentile(values, 50), 2),
+        'p95_ms': round(percentile(values, 95), 2),
+        'p99_ms': round(percentile(values, 99), 2),
+        'mean_ms': round(sum(values) / len(values), 2),
+        'rps': round(len(values) / elapsed, 2) if elapsed > 0 else None,
+    }
+
+
+def _timed(client, method, urls, warmup=0):
+    for url in urls[:warmup]:
+        client.open(url, method=method)
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for url in urls[warmup:]:
+        request_started = time.perf_counter()
+        response = client.open(url, method=method)
+        response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        if response.status_code >= 400:
+            errors += 1
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def _random_trip_ids(count, rng):
+    from models import Trip, db
+    low, high = db.session.query(db.func.min(Trip.id), db.func.max(Trip.id)).one()
+    ids = set()
+    while len(ids) < count:
+        found = (db.session.query(Trip.id).filter(Trip.id >= rng.randint(low, high))
+                 .order_by(Trip.id.asc()).limit(1).scalar())
+        if found is not None:
+            ids.add(found)
+    return list(ids)
+
+
+def _measure_generate(app, client, count):
+    """Submit count distinct trip requests at once and time each job until it is done."""
+    from models import GenerationJob, db
+    form = {'destination': 'Kyoto', 'start_date': '2031-04-01', 'end_date': '2031-04-05',
+            'travelers': '2', 'budget': '1500', 'mood': 'Relaxed'}
+    run = time.time_ns()
+    started = time.perf_counter()
+    job_ids = []
+    errors = 0
+    for n in range(count):
+        # Distinct preferences so no request is answered from the itinerary cache
+        response = client.post('/generate', data=dict(form, preferences=f'benchmark {run} {n}'))
+        if response.status_code == 202:
+            job_ids.append(response.get_json()['job_id'])
+        else:
+            errors += 1
+    deadline = time.monotonic() + 600
+    with app.app_context():
+        while time.monotonic() < deadline:
+            jobs = GenerationJob.query.filter(GenerationJob.id.in_(job_ids)).all()
+            if all(job.status in ('done', 'failed') for job in jobs):
+                break
+            db.session.rollback()
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        latencies = [(job.finished_at - job.created_at).total_seconds() for job in jobs if job.finished_at]
+        errors += sum(1 for job in jobs if job.status != 'done')
+    return summarize(latencies, elapsed, errors)
+
+
+def measure(requests, list_requests, generate_requests, endpoints=ENDPOINTS, seed=0):
+    """Benchmark endpoints of the app configured by the environment; returns {endpoint: summary}."""
+    from app import app
+    from benchmarks.seed import DESTINATIONS, PREFERENCES
+    from models import Trip, db
+
+    with app.app_context():
+        db.create_all()
+        rng = random.Random(seed)
+        view_ids = _random_trip_ids(requests, rng)
+        delete_ids = [trip_id for trip_id in _random_trip_ids(requests * 2, rng) if trip_id not in view_ids]
+        # Pages that start at random depths, in the cursor format of /api/trips
+        cursors = [f'{created_at.isoformat()}_{trip_id}' for trip_id, created_at in
+                   db.session.query(Trip.id, Trip.created_at).filter(Trip.id.in_(view_ids))]
+        searches = [urlencode({'q': f'{rng.choice(DESTINATIONS)} {rng.choice(PREFERENCES)}', 'page': rng.randint(1, 5)})
+                    for _ in range(requests)]
+    client = app.test_client()
+    runs = {
+        'trips': lambda: _timed(client, 'GET', ['/trips'] * (list_requests + 1), warmup=1),
+        'api_trips': lambda: _timed(client, 'GET', [f'/api/trips?cursor={cursor}' for cursor in cursors], warmup=2),
+        'search': lambda: _timed(client, 'GET', [f'/api/search?{query}' for query in searches], warmup=2),
+        'dashboard': lambda: _timed(client, 'GET', [f'/dashboard/{trip_id}' for trip_id in view_ids], warmup=2),
+        'export': lambda: _timed(client, 'GET', [f'/export/{trip_id}' for trip_id in view_ids], warmup=2),
+        'delete_trip': lambda: _timed(client, 'POST', [f'/delete_trip/{trip_id}' for trip_id in delete_ids[:requests]]),
+        'generate': lambda: _measure_generate(app, client, generate_requests),
+    }
+    return {endpoint: runs[endpoint]() for endpoint in ENDPOINTS if endpoint in endpoints}
+
+
+def run_size(size, args):
+    """Seed the database for size and benchmark it in a fresh process."""
+    from benchmarks.seed import seed
+    os.makedirs(args.data_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(args.data_dir, f'trips_{size}.db'))
+    seed(path, size, log=lambda message: print(message, file=sys.stderr))
+    env = dict(os.environ,
+               DATABASE_URL=f'sqlite:///{path}',
+               LLM_BACKEND='fake',
+               LLM_FAKE_LATENCY=args.llm_latency,
+               LLM_FAKE_429_RATE='0',
+               LLM_FAKE_503_RATE='0',
+               GEMINI_RPM='1000000',
+               GEMINI_BURST='1000',
+               LOG_LEVEL='WARNING')
+    command = [sys.executable, '-m', 'benchmarks.run', '--worker',
+               '--requests', str(args.requests), '--list-requests', str(args.list_requests),
+               '--generate-requests', str(args.generate_requests), '--endpoints', *args.endpoints]
+    print(f'benchmarking {size} trips...', file=sys.stderr)
+    output = subprocess.run(command, env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results, budget, tolerance):
+    """Rows of (size, endpoint, summary, verdict); verdict is 'ok', 'no budget' or why it regressed."""
+    rows = []
+    for size, endpoints in results.items():
+        for endpoint, summary in endpoints.items():
+            limit = budget.get('sizes', {}).get(size, {}).get(endpoint)
+            problems = []
+            if summary['errors']:
+                problems.append(f"{summary['errors']} failed")
+            if limit is None:
+                verdict = '; '.join(problems) or 'no budget'
+            else:
+                if summary['p95_ms'] > limit['p95_ms'] * (1 + tolerance):
+                    problems.append(f"p95 {summary['p95_ms']}ms > {limit['p95_ms']}ms")
+                if summary['rps'] is not None and summary['rps'] < limit['rps'] * (1 - tolerance):
+                    problems.append(f"{summary['rps']} req/s < {limit['rps']} req/s")
+                verdict = '; '.join(problems) or 'ok'
+            rows.append((size, endpoint, summary, verdict))
+    return rows
+
+
+def report(rows):
+    lines = [f"{'trips':>8} {'endpoint':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}  result"]
+    for size, endpoint, summary, verdict in rows:
+        lines.append(f"{size:>8} {endpoint:<12} {summary['p50_ms']:>9} {summary['p95_ms']:>9} "
+                     f"{summary['p99_ms']:>9} {summary['rps']:>9}  {verdict}")
+    return '\n'.join(lines)
+
+
+def load_budget(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'tolerance': 0.5, 'sizes': {}}
+
+
+def update_budget(path, budget, results):
+    for size, endpoints in results.items():
+        budget.setdefault('sizes', {}).setdefault(size, {}).update({
+            endpoint: {'p95_ms': summary['p95_ms'], 'rps': summary['rps']}
+            for endpoint, summary in endpoints.items()
+        })
+    budget['machine'] = f'{platform.machine()} {platform.system()}, {os.cpu_count()} CPUs, Python {platform.python_version()}'
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(budget, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument('--requests', type=int, default=50, help='requests per trip endpoint')
+    parser.add_argument('--list-requests', type=int, default=50, help='requests to /trips')
+    parser.add_argument('--generate-requests', type=int, default=20, help='trips generated concurrently')
+    parser.add_argument('--llm-latency', default='fixed:0.05', help='fake backend latency distribution')
+    parser.add_argument('--data-dir', default='instance/bench', help='where the seeded databases are kept')
+    parser.add_argument('--budget', default=DEFAULT_BUDGET)
+    parser.add_argument('--tolerance', type=float, help="allowed regression (default: the budget file's)")
+    parser.add_argument('--update-budget', action='store_true')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(measure(args.requests, args.list_requests, args.generate_requests, args.endpoints)))
+        return 0
+
+    results = {str(size): run_size(size, args) for size in args.sizes}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    budget = load_budget(args.budget)
+    if args.update_budget:
+        update_budget(args.budget, budget, results)
+    tolerance = args.tolerance if args.tolerance is not None else budget.get('tolerance', 0.5)
+    rows = compare(results, budget, tolerance)
+    print(report(rows))
+    failed = [row for row in rows if row[3] not in ('ok', 'no budget')]
+    if failed:
+        print(f'{len(failed)} regression(s) beyond {tolerance:.0%}', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Fill a SQLite database with synthetic trips for the benchmarks.
+
+    python -m benchmarks.seed instance/bench/trips_10000.db 10000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, event, func, insert, select
+from sqlalchemy.orm import Session
+
+from budget import apply_budget
+from itinerary_store import backfill, compress_itineraries
+from llm import fake_response
+from models import Trip, create_indexes, db
+from prompts import build_itinerary_prompt
+from search import index_trips
+
+DESTINATIONS = ['Kyoto', 'Lisbon', 'Cape Town', 'Reykjavik', 'Hanoi', 'Mexico City', 'Marrakesh', 'Vancouver',
+                'Istanbul', 'Buenos Aires', 'Seoul', 'Prague', 'Queenstown', 'Cusco', 'Bali', 'Edinburgh',
+                'Nairobi', 'Santorini', 'Banff', 'Jaipur']
+PREFERENCES = ['', 'street food', 'museums', 'hiking', 'nightlife']
+MOODS = ['Relaxed', 'Adventurous', 'Romantic', 'Cultural', 'Budget-friendly']
+TRIP_DAYS = range(2, 15)
+PLACEHOLDER = '__DESTINATION__'
+
+
+def itinerary_templates():
+    """Stored itinerary JSON by (days, mood), as the fake backend and budget engine produce it."""
+    templates = {}
+    start = date(2030, 1, 1)
+    for days in TRIP_DAYS:
+        for mood in MOODS:
+            end = start + timedelta(days=days - 1)
+            prompt = build_itinerary_prompt(PLACEHOLDER, start, end, 2, 100 * days, mood, '', days)
+            data = json.loads(fake_response(prompt))
+            data['trip_summary']['destination'] = PLACEHOLDER
+            templates[days, mood] = json.dumps(apply_budget(data, 100 * days, days, mood), separators=(',', ':'))
+    return templates
+
+
+def engine_for(path):
+    engine = create_engine(f'sqlite:///{path}')
+
+    @event.listens_for(engine, 'connect')
+    def _fast_inserts(connection, record):
+        # The data is synthetic and can be seeded again after a crash
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=OFF')
+    return engine
+
+
+def seed(path, count, rng_seed=0, batch_size=5000, log=None):
+    """Top the trip table in path up to count rows; returns how many were inserted.
+
+    Trips get their normalized itinerary rows and search index entries too,
+    and a database seeded before those tables or the compressed itinerary
+    column existed is migrated.
+    """
+    engine = engine_for(path)
+    db.metadata.create_all(engine)
+    create_indexes(engine)
+    with engine.connect() as connection:
+        existing = connection.execute(select(func.count()).select_from(Trip.__table__)).scalar()
+    missing = count - existing
+    if missing <= 0:
+        _migrate(engine, path, log)
+        return 0
+    rng = random.Random(f'{rng_seed}:{existing}')
+    templates = itinerary_templates()
+    now = datetime.utcnow()
+    started = time.monotonic()
+    inserted = 0
+    while inserted < missing:
+        rows = []
+        for _ in range(min(batch_size, missing - inserted)):
+            days = rng.choice(TRIP_DAYS)
+            mood = rng.choice(MOODS)
+            destination = rng.choice(DESTINATIONS)
+            start_date = date(2030, 1, 1) + timedelta(days=rng.randrange(365))
+            rows.append({
+                'destination': destination,
+                'start_date': start_date,
+                'end_date': start_date + timedelta(days=days - 1),
+                'travelers': rng.randint(1, 6),
+                'budget': float(100 * days),
+                'mood': mood,
+                'preferences': rng.choice(PREFERENCES),
+                'itinerary': templates[days, mood].replace(PLACEHOLDER, destination),
+                # Spread over two years so ordering by created_at is realistic
+                'created_at': now - timedelta(seconds=rng.randrange(2 * 365 * 24 * 3600)),
+            })
+        with engine.begin() as connection:
+            connection.execute(insert(Trip.__table__), rows)
+        inserted += len(rows)
+        if log is not None:
+            log(f'{path}: {existing + inserted}/{count} trips ({inserted / (time.monotonic() - started):.0f}/s)')
+    _migrate(engine, path, log)
+    engine.dispose()
+    return inserted
+
+
+def _migrate(engine, path, log):
+    progress = log and (lambda message: log(f'{path}: {message}'))
+    with Session(engine) as session:
+        compress_itineraries(session, batch_size=5000, log=progress)
+        backfill(session, batch_size=5000, log=progress)
+        index_trips(session, batch_size=5000, log=progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='SQLite database file')
+    parser.add_argument('count', type=int, help='number of trips the table should hold')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    seed(args.path, args.count, args.seed, log=lambda message: print(message, file=sys.stderr))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import math
+import re
+
+from schema import BUDGET_CATEGORIES
+
+# Percent of the total budget per category, in BUDGET_CATEGORIES order
+MOOD_SPLITS = {
+    'relaxed': (35, 25, 20, 15, 5),
+    'adventurous': (25, 20, 20, 30, 5),
+    'romantic': (40, 25, 10, 20, 5),
+    'cultural': (30, 25, 20, 20, 5),
+    'budget-friendly': (20, 30, 25, 15, 10),
+}
+DEFAULT_MOOD = 'relaxed'
+
+
+def mood_split(mood):
+    return MOOD_SPLITS.get((mood or '').strip().lower(), MOOD_SPLITS[DEFAULT_MOOD])
+
+
+def format_money(cents):
+    return f"${cents / 100:.2f}"
+
+
+def parse_money(text):
+    """Cents of the first figure in text, e.g. '$1,234.50' -> 123450; None if there is none."""
+    match = re.search(r'\d[\d,]*(?:\.\d+)?', str(text or ''))
+    if match is None:
+        return None
+    return round(float(match.group().replace(',', '')) * 100)
+
+
+def allocate(total, weights):
+    """Split an integer total in proportion to weights so the parts add up to exactly total."""
+    scale = sum(weights)
+    shares = [total * weight / scale for weight in weights]
+    parts = [math.floor(share) for share in shares]
+    # Largest remainders get the cents lost to rounding down
+    by_remainder = sorted(range(len(shares)), key=lambda i: parts[i] - shares[i])
+    for i in by_remainder[:total - sum(parts)]:
+        parts[i] += 1
+    return parts
+
+
+class BudgetPlan:
+    """Exact split of a trip budget into categories and days, in cents."""
+
+    def __init__(self, budget, number_of_days, mood):
+        self.percentages = mood_split(mood)
+        self.total = round(float(budget) * 100)
+        self.by_category = allocate(self.total, self.percentages)
+        # days x categories: every category spread evenly over the days
+        self.daily = [list(day) for day in zip(*(allocate(cents, [1] * number_of_days)
+                                                 for cents in self.by_category))]
+        self.day_totals = [sum(day) for day in self.daily]
+
+    def distribution(self):
+        """(category, percent, cents) for each category."""
+        return list(zip(BUDGET_CATEGORIES, self.percentages, self.by_category))
+
+
+def apply_budget(data, budget, number_of_days, mood):
+    """Fill the budget figures of an itinerary document from the budget engine.
+
+    The model only writes the qualitative budget text; percentages, costs and
+    daily category breakdowns are computed here so they add up exactly.
+    """
+    plan = BudgetPlan(budget, number_of_days, mood)
+
+    tracking = data.get('budget_tracking')
+    if not isinstance(tracking, dict):
+        tracking = data['budget_tracking'] = {}
+    suggestions = {str(row.get('category', '')).strip().lower(): row.get('suggestions', '')
+                   for row in tracking.get('distribution_table') or [] if isinstance(row, dict)}
+    tracking['distribution_table'] = [{
+        'category': category,
+        'percentage': f"{percent}%",
+        'estimated_cost': format_money(cents),
+        'suggestions': suggestions.get(category.lower(), ''),
+    } for category, percent, cents in plan.distribution()]
+
+    rows = [row for row in data.get('daily_budget_plan') or [] if isinstance(row, dict)]
+    daily_plan = data.get('daily_plan') if isinstance(data.get('daily_plan'), dict) else {}
+    daily_budget_plan = []
+    for n, (categories, total) in enumerate(zip(plan.daily, plan.day_totals), start=1):
+        row = rows[n - 1] if n <= len(rows) else {}
+        daily_budget_plan.append({
+            'day': f'Day {n}',
+            'activities': row.get('activities') or daily_plan.get(f'Day {n}', ''),
+            'estimated_spend': format_money(total),
+            'category_breakdown': {category: format_money(cents)
+                                   for category, cents in zip(BUDGET_CATEGORIES, categories)},
+            'recommendations': row.get('recommendations', ''),
+        })
+    data['daily_budget_plan'] = daily_budget_plan
+    return data
+
+
+def budget_tier(budget, number_of_days, travelers):
+    """Coarse spending level (per traveler per day, in half-octave steps) for sharing generated text."""
+    per_day = float(budget) / max(number_of_days, 1) / max(int(travelers), 1)
+    return round(2 * math.log2(max(per_day, 1.0)))
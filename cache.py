@@ -0,0 +1,356 @@
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, CachedItinerary, CachedDestinationSections
+from budget import budget_tier
+from metrics import CACHE_EVENTS, DESTINATION_CACHE_EVENTS
+
+# Returned by ItineraryCache.get() for inputs that keep failing to parse
+NEGATIVE = object()
+
+
+def _normalize_text(value):
+    return re.sub(r'\s+', ' ', (value or '').strip()).casefold()
+
+
+def make_cache_key(destination, start_date, number_of_days, travelers, budget, mood, preferences):
+    """Build a stable cache key from the normalized trip request."""
+    parts = {
+        'destination': _normalize_text(destination).strip(' .,'),
+        'month': start_date.month,
+        'days': number_of_days,
+        'travelers': travelers,
+        # Budget figures are filled in per request, so nearby budgets share the text
+        'budget': budget_tier(budget, number_of_days, travelers),
+        'mood': _normalize_text(mood),
+        'preferences': _normalize_text(preferences),
+    }
+    raw = json.dumps(parts, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ItineraryCache:
+    """Two-level cache of parsed itineraries: a per-process LRU in front of SQLite."""
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        # key -> (parse failures, when the count lapses), oldest first
+        self._failures = OrderedDict()
+        self._sets_since_trim = 0
+        self.ttl = 7 * 24 * 3600
+        self.memory_size = 256
+        self.db_size = 10000
+        self.negative_ttl = 600
+        self.negative_threshold = 3
+        self.counters = {
+            'memory_hits': 0,
+            'db_hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'failures': 0,
+        }
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('ITINERARY_CACHE_TTL', self.ttl)
+        self.memory_size = app.config.get('ITINERARY_CACHE_MEMORY_SIZE', self.memory_size)
+        self.db_size = app.config.get('ITINERARY_CACHE_DB_SIZE', self.db_size)
+        self.negative_ttl = app.config.get('ITINERARY_CACHE_NEGATIVE_TTL', self.negative_ttl)
+        self.negative_threshold = app.config.get('ITINERARY_CACHE_NEGATIVE_THRESHOLD', self.negative_threshold)
+        app.extensions['itinerary_cache'] = self
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+        CACHE_EVENTS.labels(name).inc()
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+                self.counters['evictions'] += 1
+                CACHE_EVENTS.labels('evictions').inc()
+
+    def _from_memory(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return value
+
+    def _from_db(self, key):
+        try:
+            row = db.session.get(CachedItinerary, key)
+            if row is None:
+                return None
+            if row.expires_at <= datetime.utcnow():
+                db.session.delete(row)
+                db.session.commit()
+                return None
+            row.accessed_at = datetime.utcnow()
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            return None
+        value = NEGATIVE if row.negative else row.payload
+        remaining = (row.expires_at - datetime.utcnow()).total_seconds()
+        self._remember(key, value, time.time() + remaining)
+        return value
+
+    def get(self, key):
+        """Return the cached itinerary dict, NEGATIVE, or None on a miss."""
+        value = self._from_memory(key)
+        if value is not None:
+            self._count('negative_hits' if value is NEGATIVE else 'memory_hits')
+        else:
+            value = self._from_db(key)
+            if value is None:
+                self._count('misses')
+                return None
+            self._count('negative_hits' if value is NEGATIVE else 'db_hits')
+        if value is NEGATIVE:
+            return NEGATIVE
+        return json.loads(value)
+
+    def set(self, key, data):
+        """Store a successfully parsed itinerary under key."""
+        payload = json.dumps(data)
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        with self._lock:
+            self._failures.pop(key, None)
+        self._remember(key, payload, time.time() + self.ttl)
+        self._write(key, payload=payload, negative=False, failures=0, expires_at=expires_at)
+        self._count('stores')
+
+    def record_failure(self, key):
+        """Count a parse failure; enough of them turn key into a negative entry."""
+        self._count('failures')
+        now = time.time()
+        with self._lock:
+            failures, expires_at = self._failures.pop(key, (0, now))
+            failures = failures + 1 if expires_at > now else 1
+            # Each failure extends the count by negative_ttl, so the dict stays ordered by expiry
+            self._failures[key] = (failures, now + self.negative_ttl)
+            while self._failures:
+                _, (_, oldest_expires_at) = next(iter(self._failures.items()))
+                if oldest_expires_at > now and len(self._failures) <= self.memory_size:
+                    break
+                self._failures.popitem(last=False)
+        if failures < self.negative_threshold:
+            return
+        expires_at = datetime.utcnow() + timedelta(seconds=self.negative_ttl)
+        self._remember(key, NEGATIVE, time.time() + self.negative_ttl)
+        self._write(key, payload=None, negative=True, failures=failures, expires_at=expires_at)
+
+    def _write(self, key, **fields):
+        try:
+            row = db.session.get(CachedItinerary, key)
+            if row is None:
+                row = CachedItinerary(key=key)
+                db.session.add(row)
+            for name, value in fields.items():
+                setattr(row, name, value)
+            row.accessed_at = datetime.utcnow()
+            db.session.commit()
+            self._trim_db()
+        except SQLAlchemyError:
+            db.session.rollback()
+
+    def _trim_db(self):
+        # Only check the table size every few writes to keep set() cheap
+        self._sets_since_trim += 1
+        if self._sets_since_trim < 50:
+            return
+        self._sets_since_trim = 0
+        CachedItinerary.query.filter(CachedItinerary.expires_at <= datetime.utcnow()).delete()
+        overflow = CachedItinerary.query.count() - self.db_size
+        if overflow > 0:
+            stale = (db.session.query(CachedItinerary.key)
+                     .order_by(CachedItinerary.accessed_at.asc())
+                     .limit(overflow))
+            CachedItinerary.query.filter(CachedItinerary.key.in_(stale.scalar_subquery())).delete(synchronize_session=False)
+            with self._lock:
+                self.counters['evictions'] += overflow
+            CACHE_EVENTS.labels('evictions').inc(overflow)
+        db.session.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+        hits = stats['memory_hits'] + stats['db_hits']
+        lookups = hits + stats['misses']
+        stats['hit_ratio'] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
+
+
+def canonical_destination(destination):
+    """'  Zürich, ' and 'zurich' name the same place."""
+    text = unicodedata.normalize('NFKD', destination or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r'[\W_]+', ' ', text).strip().casefold()
+
+
+def make_destination_key(destination, month, mood, tier):
+    """Key of the destination-level sections shared by trips to destination in month with mood.
+
+    tier is the trip's budget_tier(): hotels and the like differ between a
+    budget trip and a luxury one.
+    """
+    parts = {'kind': 'destination', 'destination': canonical_destination(destination), 'month': month,
+             'mood': _normalize_text(mood), 'budget': tier}
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class DestinationCache:
+    """Destination-level sections (trending places, risks, crowds, hotels) shared by every trip there.
+
+    Same two levels as ItineraryCache. get() also says when to refresh an
+    entry early: with probability rising as it nears expiry, scaled by how
+    long it took to generate (XFetch), so a hot entry is regenerated by one
+    request before it expires instead of by every request after.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._sets_since_trim = 0
+        self.enabled = True
+        self.ttl = 14 * 24 * 3600
+        self.memory_size = 512
+        self.beta = 1.0
+        self.counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'early_refreshes': 0, 'stores': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('DESTINATION_CACHE', self.enabled)
+        self.ttl = app.config.get('DESTINATION_CACHE_TTL', self.ttl)
+        self.memory_size = app.config.get('DESTINATION_CACHE_MEMORY_SIZE', self.memory_size)
+        self.beta = app.config.get('DESTINATION_CACHE_BETA', self.beta)
+        app.extensions['destination_cache'] = self
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+        DESTINATION_CACHE_EVENTS.labels(name).inc()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._memory.move_to_end(key)
+                    return entry, 'memory_hits'
+                del self._memory[key]
+        try:
+            row = db.session.get(CachedDestinationSections, key)
+            if row is None or row.expires_at <= datetime.utcnow():
+                return None, 'misses'
+            row.accessed_at = datetime.utcnow()
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            return None, 'misses'
+        remaining = (row.expires_at - datetime.utcnow()).total_seconds()
+        entry = (time.time() + remaining, row.delta, row.payload)
+        self._remember(key, entry)
+        return entry, 'db_hits'
+
+    def get(self, key):
+        """Return (sections, refresh): the cached sections or None, and whether to regenerate them now."""
+        entry, outcome = self._lookup(key)
+        self._count(outcome)
+        if entry is None:
+            return None, True
+        expires_at, delta, payload = entry
+        refresh = time.time() - delta * self.beta * math.log(1.0 - random.random()) >= expires_at
+        if refresh:
+            self._count('early_refreshes')
+        return json.loads(payload), refresh
+
+    def expires_in(self, key):
+        """Seconds until the entry for key expires (0 if there is none), without counting a lookup."""
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is not None:
+            return max(0.0, entry[0] - time.time())
+        try:
+            expires_at = (db.session.query(CachedDestinationSections.expires_at)
+                          .filter(CachedDestinationSections.key == key).scalar())
+        except SQLAlchemyError:
+            db.session.rollback()
+            return 0.0
+        if expires_at is None:
+            return 0.0
+        return max(0.0, (expires_at - datetime.utcnow()).total_seconds())
+
+    def set(self, key, sections, delta):
+        """Store sections that took delta seconds to generate."""
+        payload = json.dumps(sections)
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+        self._remember(key, (time.time() + self.ttl, delta, payload))
+        try:
+            row = db.session.get(CachedDestinationSections, key)
+            if row is None:
+                row = CachedDestinationSections(key=key)
+                db.session.add(row)
+            row.payload = payload
+            row.delta = delta
+            row.created_at = row.accessed_at = datetime.utcnow()
+            row.expires_at = expires_at
+            db.session.commit()
+            self._trim_db()
+        except SQLAlchemyError:
+            db.session.rollback()
+        self._count('stores')
+
+    def _trim_db(self):
+        self._sets_since_trim += 1
+        if self._sets_since_trim < 50:
+            return
+        self._sets_since_trim = 0
+        CachedDestinationSections.query.filter(CachedDestinationSections.expires_at <= datetime.utcnow()).delete()
+        db.session.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+        hits = stats['memory_hits'] + stats['db_hits']
+        lookups = hits + stats['misses']
+        stats['hit_ratio'] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
+
+
+itinerary_cache = ItineraryCache()
+destination_cache = DestinationCache()
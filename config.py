@@ -5,6 +5,128 @@ load_dotenv()
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///trips.db'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///trips.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+    # Gemini API endpoint override, e.g. the local fake server of the load tests
+    GEMINI_BASE_URL = os.environ.get('GEMINI_BASE_URL')
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+
+    # LLM backend behind generate_with_retry: gemini, fake (offline, for benchmarks
+    # and load tests), record (Gemini, saving every response) or replay (saved responses)
+    LLM_BACKEND = os.environ.get('LLM_BACKEND', 'gemini').lower()
+    # Fake backend latency: fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA (seconds)
+    LLM_FAKE_LATENCY = os.environ.get('LLM_FAKE_LATENCY', 'lognormal:2,0.4')
+    LLM_FAKE_429_RATE = float(os.environ.get('LLM_FAKE_429_RATE', 0.0))
+    LLM_FAKE_503_RATE = float(os.environ.get('LLM_FAKE_503_RATE', 0.0))
+    LLM_FAKE_SEED = int(os.environ.get('LLM_FAKE_SEED', 0))
+    LLM_RECORD_DIR = os.environ.get('LLM_RECORD_DIR', 'instance/llm_recordings')
+    # Replay responses after the latency they were recorded with
+    LLM_REPLAY_LATENCY = os.environ.get('LLM_REPLAY_LATENCY', 'false').lower() == 'true'
+
+    # Itinerary response cache (in-memory LRU backed by the itinerary_cache table)
+    ITINERARY_CACHE_TTL = int(os.environ.get('ITINERARY_CACHE_TTL', 7 * 24 * 3600))
+    ITINERARY_CACHE_MEMORY_SIZE = int(os.environ.get('ITINERARY_CACHE_MEMORY_SIZE', 256))
+    ITINERARY_CACHE_DB_SIZE = int(os.environ.get('ITINERARY_CACHE_DB_SIZE', 10000))
+    ITINERARY_CACHE_NEGATIVE_TTL = int(os.environ.get('ITINERARY_CACHE_NEGATIVE_TTL', 600))
+    ITINERARY_CACHE_NEGATIVE_THRESHOLD = int(os.environ.get('ITINERARY_CACHE_NEGATIVE_THRESHOLD', 3))
+
+    # Destination-level sections shared by trips to the same place, month and mood
+    DESTINATION_CACHE = os.environ.get('DESTINATION_CACHE', 'true').lower() == 'true'
+    DESTINATION_CACHE_TTL = int(os.environ.get('DESTINATION_CACHE_TTL', 14 * 24 * 3600))
+    DESTINATION_CACHE_MEMORY_SIZE = int(os.environ.get('DESTINATION_CACHE_MEMORY_SIZE', 512))
+    # Higher refreshes hot entries earlier before they expire
+    DESTINATION_CACHE_BETA = float(os.environ.get('DESTINATION_CACHE_BETA', 1.0))
+
+    # Background generation of popular destination sections during off-peak hours
+    PREWARM = os.environ.get('PREWARM', 'false').lower() == 'true'
+    PREWARM_INTERVAL = int(os.environ.get('PREWARM_INTERVAL', 3600))
+    # Local hours, start-end (may wrap past midnight); empty for any time
+    PREWARM_HOURS = os.environ.get('PREWARM_HOURS', '1-6')
+    PREWARM_TOP = int(os.environ.get('PREWARM_TOP', 50))
+    PREWARM_LOOKBACK_DAYS = int(os.environ.get('PREWARM_LOOKBACK_DAYS', 90))
+    PREWARM_REFRESH_BEFORE = int(os.environ.get('PREWARM_REFRESH_BEFORE', 2 * 24 * 3600))
+    # Ceiling on the Gemini calls pre-warming starts per minute
+    PREWARM_RPM = float(os.environ.get('PREWARM_RPM', 6))
+
+    # Trips per page of /trips and /api/trips
+    TRIPS_PAGE_SIZE = int(os.environ.get('TRIPS_PAGE_SIZE', 24))
+
+    # Give concurrent writers (web and job workers) time to get the SQLite lock
+    SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}}
+
+    # Background itinerary generation jobs
+    GENERATION_WORKERS = int(os.environ.get('GENERATION_WORKERS', 4))
+    GENERATION_POLL_INTERVAL = float(os.environ.get('GENERATION_POLL_INTERVAL', 1.0))
+    GENERATION_JOB_LEASE = int(os.environ.get('GENERATION_JOB_LEASE', 300))
+    GENERATION_JOB_MAX_ATTEMPTS = int(os.environ.get('GENERATION_JOB_MAX_ATTEMPTS', 2))
+    # Seconds finished jobs and their events are kept; 0 keeps them
+    GENERATION_JOB_RETENTION = int(os.environ.get('GENERATION_JOB_RETENTION', 7 * 24 * 3600))
+    # Seconds a /jobs/<id>/events stream may hold a web worker before the client reopens it
+    GENERATION_STREAM_TIMEOUT = int(os.environ.get('GENERATION_STREAM_TIMEOUT', 30))
+
+    # Coalescing of identical in-flight generations across threads and processes
+    GENERATION_LOCK_TTL = int(os.environ.get('GENERATION_LOCK_TTL', 180))
+    GENERATION_LOCK_POLL_INTERVAL = float(os.environ.get('GENERATION_LOCK_POLL_INTERVAL', 0.5))
+
+    # Gemini retry budget and circuit breakers
+    GEMINI_MAX_ATTEMPTS = int(os.environ.get('GEMINI_MAX_ATTEMPTS', 3))
+    GEMINI_RETRY_BASE_DELAY = float(os.environ.get('GEMINI_RETRY_BASE_DELAY', 1.0))
+    GEMINI_RETRY_MAX_DELAY = float(os.environ.get('GEMINI_RETRY_MAX_DELAY', 20.0))
+    GEMINI_DEADLINE = float(os.environ.get('GEMINI_DEADLINE', 90.0))
+    GEMINI_BREAKER_FAILURES = int(os.environ.get('GEMINI_BREAKER_FAILURES', 5))
+    GEMINI_BREAKER_RESET = float(os.environ.get('GEMINI_BREAKER_RESET', 30.0))
+
+    # Hedged requests: race the fallback model once the primary passes its p95 latency
+    GEMINI_HEDGING = os.environ.get('GEMINI_HEDGING', 'true').lower() == 'true'
+    GEMINI_HEDGE_PERCENTILE = float(os.environ.get('GEMINI_HEDGE_PERCENTILE', 0.95))
+    GEMINI_HEDGE_MIN_SAMPLES = int(os.environ.get('GEMINI_HEDGE_MIN_SAMPLES', 20))
+    GEMINI_HEDGE_DEFAULT_DELAY = float(os.environ.get('GEMINI_HEDGE_DEFAULT_DELAY', 45.0))
+    GEMINI_HEDGE_MIN_DELAY = float(os.environ.get('GEMINI_HEDGE_MIN_DELAY', 5.0))
+
+    # Outbound admission control for Gemini calls (per process); a GEMINI_RPM of 0 means no limit
+    GEMINI_RPM = float(os.environ.get('GEMINI_RPM', 60))
+    GEMINI_BURST = int(os.environ.get('GEMINI_BURST', 10))
+    GEMINI_MODEL_CONCURRENCY = int(os.environ.get('GEMINI_MODEL_CONCURRENCY', 8))
+    GEMINI_INITIAL_CONCURRENCY = int(os.environ.get('GEMINI_INITIAL_CONCURRENCY', 8))
+    GEMINI_MIN_CONCURRENCY = int(os.environ.get('GEMINI_MIN_CONCURRENCY', 1))
+    GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', 16))
+
+    # Ask Gemini for schema-conforming JSON instead of sending a JSON skeleton in the prompt
+    GEMINI_STRUCTURED_OUTPUT = os.environ.get('GEMINI_STRUCTURED_OUTPUT', 'true').lower() == 'true'
+
+    # Long trips are generated as concurrent day ranges
+    GENERATION_SHARD_THRESHOLD_DAYS = int(os.environ.get('GENERATION_SHARD_THRESHOLD_DAYS', 7))
+    GENERATION_SHARD_DAYS = int(os.environ.get('GENERATION_SHARD_DAYS', 5))
+
+    # auto: one prompt, or day ranges for long trips; sections: fan out independent
+    # section groups and day ranges concurrently; monolithic: always one prompt
+    GENERATION_STRATEGY = os.environ.get('GENERATION_STRATEGY', 'auto').lower()
+    # Tries per fan-out part whose output doesn't parse
+    GENERATION_SECTION_ATTEMPTS = int(os.environ.get('GENERATION_SECTION_ATTEMPTS', 2))
+
+    # Server-Timing header: on for every request, or only for requests sending a
+    # token from server_timing.token() in X-Server-Timing-Token
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+    SERVER_TIMING_SECRET = os.environ.get('SERVER_TIMING_SECRET')
+    SERVER_TIMING_TOKEN_MAX_AGE = int(os.environ.get('SERVER_TIMING_TOKEN_MAX_AGE', 3600))
+
+    # Token for the /admin endpoints (sent as X-Admin-Token); they are disabled without one
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+    # Sampling profiler: share of requests to profile (0 = off), optionally only these
+    # endpoints; runtime changes go through /admin/profiling
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'instance/profiles')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))
+    PROFILE_ENDPOINTS = [name for name in os.environ.get('PROFILE_ENDPOINTS', '').split(',') if name]
+    PROFILE_FORMAT = os.environ.get('PROFILE_FORMAT', 'collapsed')
+    PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+    PROFILE_MIN_DURATION_MS = float(os.environ.get('PROFILE_MIN_DURATION_MS', 0))
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+
+    # Trace spans of every request and generation job: none (ids and logs only),
+    # file (OTLP JSON lines in TRACE_FILE) or otlp (POST to an OTLP/HTTP collector)
+    TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'none').lower()
+    TRACE_FILE = os.environ.get('TRACE_FILE', 'instance/traces.jsonl')
+    TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+    TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'wandermate')
@@ -0,0 +1,218 @@
+from flask import current_app
+from google.genai import types
+from retry import RetryPolicy, CircuitBreaker, ModelsUnavailable, run_with_retry, batch_scheduler, breakers, scheduler
+from hedging import CallCancelled, hedged_call, latency
+from limiter import PRIORITY_INTERACTIVE, admission
+from llm import llm
+import timing
+import tracing
+from metrics import JSON_PARSE, JSON_PARSE_LATENCY, LLM_ATTEMPTS, LLM_LATENCY, attempt_outcome
+from concurrent.futures import TimeoutError as FuturesTimeout
+import re
+import json
+import time
+
+
+class GenerationError(Exception):
+    """Raised when an itinerary cannot be produced for a trip request."""
+
+
+# Models to try in order (primary → fallback)
+GEMINI_MODELS = ['gemini-2.5-flash', 'gemini-1.5-flash']
+
+class ModelResponse:
+    """Text of a model response, shaped like a generate_content result."""
+
+    def __init__(self, text):
+        self.text = text
+
+
+def content_config(schema=None, max_output_tokens=None):
+    """Request JSON matching schema (structured output) and cap the output length, or the SDK defaults."""
+    options = {}
+    if schema is not None:
+        options.update(response_mime_type='application/json', response_schema=schema)
+    if max_output_tokens is not None:
+        options['max_output_tokens'] = max_output_tokens
+    if not options:
+        return None
+    return types.GenerateContentConfig(**options)
+
+
+def stream_content(model_name, prompt, progress=None, cancel=None, config=None, usage=None, timeout=None):
+    """Stream a model response, feeding each chunk to progress as it arrives.
+
+    timeout bounds each read and the whole stream, in seconds.
+    """
+    if progress is not None:
+        progress.reset()
+    chunks = []
+    ends = None if timeout is None else time.monotonic() + timeout
+    for chunk in llm.stream(model_name, prompt, config, usage, timeout):
+        if cancel is not None and cancel.is_set():
+            raise CallCancelled(model_name)
+        if ends is not None and time.monotonic() > ends:
+            raise TimeoutError(f'{model_name} did not finish streaming in {timeout:.0f}s')
+        chunks.append(chunk)
+        if progress is not None:
+            progress.feed(chunk)
+    return ModelResponse(''.join(chunks))
+
+
+def retry_policy():
+    config = current_app.config
+    return RetryPolicy(max_attempts=config['GEMINI_MAX_ATTEMPTS'],
+                       base_delay=config['GEMINI_RETRY_BASE_DELAY'],
+                       max_delay=config['GEMINI_RETRY_MAX_DELAY'],
+                       deadline=config['GEMINI_DEADLINE'])
+
+
+def hedge_delay(model_name, kind):
+    """Seconds to wait on model_name before racing a backup: its rolling p95 latency for this kind of call."""
+    config = current_app.config
+    observed = latency.percentile(model_name, kind, config['GEMINI_HEDGE_PERCENTILE'],
+                                  min_samples=config['GEMINI_HEDGE_MIN_SAMPLES'])
+    if observed is None:
+        return config['GEMINI_HEDGE_DEFAULT_DELAY']
+    return max(observed, config['GEMINI_HEDGE_MIN_DELAY'])
+
+
+def _is_valid_response(response):
+    try:
+        parse_itinerary_text(response.text or '')
+        return True
+    except json.JSONDecodeError:
+        return False
+
+
+def _observe_attempt(model_name, started, error=None, timings=None):
+    outcome = attempt_outcome(error)
+    elapsed = time.monotonic() - started
+    LLM_ATTEMPTS.labels(model_name, outcome).inc()
+    LLM_LATENCY.labels(model_name, outcome).observe(elapsed)
+    if timings is not None:
+        timings.add('llm', elapsed, f'{model_name} {outcome}')
+
+
+def generate_with_retry(prompt, progress=None, priority=PRIORITY_INTERACTIVE, schema=None, max_output_tokens=None,
+                        kind='full'):
+    """Call Gemini API with jittered retries, per-model circuit breakers and model fallback.
+
+    With progress, the response is streamed and partial output is pushed to it.
+    The whole call, including backoff, is bounded by GEMINI_DEADLINE. When the
+    primary model is slower than its p95, a backup request races it on the
+    fallback model (GEMINI_HEDGING). Every attempt first waits for admission
+    by the shared outbound limiter, in priority order. With schema, Gemini is
+    asked for JSON matching it (structured output); max_output_tokens caps
+    the length of the response. kind names the sort of prompt, whose
+    latencies are tracked apart for hedging.
+    """
+    with tracing.span('llm.generate', **{'llm.prompt_chars': len(prompt), 'llm.structured': schema is not None,
+                                         'llm.max_output_tokens': max_output_tokens, 'llm.priority': priority,
+                                         'llm.kind': kind}) as parent:
+        return _call_models(prompt, progress, priority, schema, max_output_tokens, kind, parent)
+
+
+def _call_models(prompt, progress, priority, schema, max_output_tokens, kind, parent):
+    app = current_app._get_current_object()
+    policy = retry_policy()
+    # Every attempt, hedged leg and retry ends by then, so none outlives the caller
+    deadline = time.monotonic() + policy.deadline
+    config = content_config(schema, max_output_tokens)
+    # Server-Timing stages of the request or job this call belongs to
+    timings = timing.current()
+    breaker_options = {
+        'failure_threshold': app.config['GEMINI_BREAKER_FAILURES'],
+        'reset_timeout': app.config['GEMINI_BREAKER_RESET'],
+    }
+
+    def start(models, leg_progress, cancel, leg):
+        last_ended = []
+
+        def call(model_name):
+            entered = time.monotonic()
+            backoff = entered - last_ended[-1] if last_ended else 0.0
+            if timings is not None and last_ended:
+                timings.add('backoff', backoff, model_name)
+            # Attempts run on the scheduler's threads, which need their own app context
+            with app.app_context(), tracing.span('llm.attempt', parent, tracing.CLIENT, **{
+                    'gen_ai.request.model': model_name, 'llm.attempt': len(last_ended) + 1, 'llm.leg': leg,
+                    'llm.backoff_ms': round(backoff * 1000, 1)}) as span:
+                try:
+                    with admission.acquire(model_name, priority, timeout=max(0.0, deadline - entered)):
+                        started = time.monotonic()
+                        span.set_attribute('llm.admission_wait_ms', round((started - entered) * 1000, 1))
+                        if timings is not None:
+                            timings.add('admission', started - entered, model_name)
+                        timeout = deadline - started
+                        if timeout <= 0:
+                            raise ModelsUnavailable('Gemini did not respond in time. Please try again in a moment.')
+                        usage = {}
+                        try:
+                            if leg_progress is not None or cancel is not None:
+                                response = stream_content(model_name, prompt, leg_progress, cancel, config, usage,
+                                                          timeout)
+                            else:
+                                response = ModelResponse(llm.generate(model_name, prompt, config, usage, timeout))
+                        except Exception as e:
+                            _observe_attempt(model_name, started, e, timings)
+                            span.set_attribute('llm.outcome', attempt_outcome(e))
+                            raise
+                        finally:
+                            span.set_attribute('gen_ai.usage.input_tokens', usage.get('input_tokens'))
+                            span.set_attribute('gen_ai.usage.output_tokens', usage.get('output_tokens'))
+                    _observe_attempt(model_name, started, timings=timings)
+                    span.set_attribute('llm.outcome', 'ok')
+                    latency.record(model_name, kind, time.monotonic() - started)
+                    return response
+                finally:
+                    last_ended.append(time.monotonic())
+        return run_with_retry(call, models, policy, breakers,
+                              scheduler if priority <= PRIORITY_INTERACTIVE else batch_scheduler, breaker_options)
+
+    primary_model, fallback_models = GEMINI_MODELS[0], GEMINI_MODELS[1:]
+    hedge = (app.config['GEMINI_HEDGING'] and fallback_models
+             and breakers.get(primary_model, **breaker_options).state == CircuitBreaker.CLOSED)
+    if not hedge:
+        future = start(GEMINI_MODELS, progress, None, 'primary')
+        try:
+            return future.result(timeout=policy.deadline)
+        except FuturesTimeout:
+            future.cancel()
+            raise ModelsUnavailable('Gemini did not respond in time. Please try again in a moment.')
+
+    response, leg = hedged_call(
+        start_primary=lambda cancel: start(GEMINI_MODELS, progress, cancel, 'primary'),
+        start_backup=lambda cancel: start(fallback_models, None, cancel, 'backup'),
+        hedge_after=hedge_delay(primary_model, kind),
+        deadline=policy.deadline,
+        validate=_is_valid_response,
+    )
+    parent.set_attribute('llm.winning_leg', leg)
+    if leg == 'backup' and progress is not None:
+        # The preview showed the primary's partial output; replace it with the winner
+        progress.reset()
+        progress.feed(response.text)
+    return response
+
+def parse_itinerary_text(text):
+    """Strip markdown fences from a model response and parse the JSON inside."""
+    with tracing.span('response.strip_fences', **{'response.chars': len(text)}):
+        itinerary_json = text.strip()
+
+        # Clean the response to extract JSON (remove markdown code blocks if present)
+        itinerary_json = re.sub(r'```json\s*', '', itinerary_json)
+        itinerary_json = re.sub(r'```\s*', '', itinerary_json)
+        itinerary_json = itinerary_json.strip()
+
+    started = time.perf_counter()
+    try:
+        with tracing.span('response.json_parse'):
+            data = json.loads(itinerary_json)
+    except json.JSONDecodeError:
+        JSON_PARSE.labels('error').inc()
+        raise
+    finally:
+        JSON_PARSE_LATENCY.observe(time.perf_counter() - started)
+    JSON_PARSE.labels('ok').inc()
+    return data
@@ -0,0 +1,12 @@
+# Read by gunicorn from the working directory
+
+
+def post_worker_init(worker):
+    """Get a worker ready as soon as it has loaded the app, not on its first request."""
+    from app import app, start_background_threads
+    from models import db
+    from search import create_search_index
+    with app.app_context():
+        # Saving a trip indexes it, so the index has to exist before the first request
+        create_search_index(db.engine)
+    start_background_threads()
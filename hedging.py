@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from retry import ModelsUnavailable
+
+
+class CallCancelled(Exception):
+    """Raised inside a streaming call whose hedge partner already won."""
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per model and kind of call.
+
+    A short section prompt and a whole itinerary take very different times,
+    so each kind has its own window.
+    """
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name, kind, seconds):
+        with self._lock:
+            samples = self._samples.get((model_name, kind))
+            if samples is None:
+                samples = self._samples[(model_name, kind)] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, model_name, kind, q, min_samples=1):
+        """Return the q-quantile of recent latencies, or None with too few samples."""
+        with self._lock:
+            samples = sorted(self._samples.get((model_name, kind), ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        index = min(len(samples) - 1, int(q * len(samples)))
+        return samples[index]
+
+
+class HedgeStats:
+    """Counters for tuning hedging: how often we hedge, who wins, and what it costs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {
+            'calls': 0,
+            'hedged': 0,
+            'primary_wins': 0,
+            'backup_wins': 0,
+            'wasted_calls': 0,
+        }
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['hedge_rate'] = round(stats['hedged'] / stats['calls'], 4) if stats['calls'] else 0.0
+        stats['backup_win_rate'] = round(stats['backup_wins'] / stats['hedged'], 4) if stats['hedged'] else 0.0
+        # Each losing leg still in flight when the winner returned spent quota for nothing
+        stats['extra_quota_ratio'] = round(stats['wasted_calls'] / stats['calls'], 4) if stats['calls'] else 0.0
+        return stats
+
+
+def hedged_call(start_primary, start_backup, hedge_after, deadline, validate):
+    """Race a backup leg against a slow primary and return (result, winning_leg).
+
+    start_primary/start_backup take a cancel Event and return a Future. The
+    backup only starts if the primary is still pending after hedge_after
+    seconds. The first result passing validate wins and the other leg is
+    cancelled; if no result is valid, the primary's outcome is returned.
+    """
+    end = time.monotonic() + deadline
+    hedge_stats.incr('calls')
+    legs = {}
+    primary_cancel = threading.Event()
+    primary = start_primary(primary_cancel)
+    legs[primary] = ('primary', primary_cancel)
+
+    done, _ = wait([primary], timeout=max(0.0, min(hedge_after, deadline)))
+    if not done and start_backup is not None:
+        backup_cancel = threading.Event()
+        backup = start_backup(backup_cancel)
+        legs[backup] = ('backup', backup_cancel)
+        hedge_stats.incr('hedged')
+
+    pending = set(legs)
+    fallback = None
+    first_error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            leg = legs[future][0]
+            if future.exception() is not None:
+                if leg == 'primary' or first_error is None:
+                    first_error = future.exception()
+                continue
+            result = future.result()
+            if validate(result):
+                _cancel(pending, legs)
+                hedge_stats.incr(f'{leg}_wins')
+                hedge_stats.incr('wasted_calls', len(pending))
+                return result, leg
+            if fallback is None or leg == 'primary':
+                fallback = (result, leg)
+
+    _cancel(pending, legs)
+    if fallback is not None:
+        return fallback
+    if first_error is not None:
+        raise first_error
+    raise ModelsUnavailable('Gemini did not respond in time. Please try again in a moment.')
+
+
+def _cancel(futures, legs):
+    for future in futures:
+        legs[future][1].set()
+        future.cancel()
+
+
+latency = LatencyTracker()
+hedge_stats = HedgeStats()
@@ -0,0 +1,306 @@
+import json
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import (bindparam, delete, exists, func, insert, literal, literal_column, select, type_coerce,
+                        union_all, update)
+
+from budget import parse_money
+from models import db, Trip, TripOverview, TripDay, TripBudgetLine, TripHotel, TripPlace, TripNote
+from schema import ITINERARY_SECTIONS
+
+# TripNote.kind of each list-of-strings section
+NOTE_KINDS = {'quick_insights': 'insight', 'important_notes': 'note', 'optimization_tips': 'tip'}
+ROW_MODELS = [TripDay, TripBudgetLine, TripHotel, TripPlace, TripNote]
+
+
+def _dict(value):
+    return value if isinstance(value, dict) else {}
+
+
+def _list(value):
+    return value if isinstance(value, list) else []
+
+
+def _text(value):
+    # Model output sometimes has numbers where the schema asks for strings
+    return None if value is None else str(value)
+
+
+def _daily_plan(value):
+    if isinstance(value, dict):
+        return list(value.items())
+    # Structured-output shape, [{day, activities}]
+    return [(entry.get('day'), entry.get('activities')) for entry in _list(value) if isinstance(entry, dict)]
+
+
+def itinerary_rows(trip_id, data):
+    """Rows of the normalized tables for one itinerary document, as {model: [column dicts]}."""
+    summary = _dict(data.get('trip_summary'))
+    risk = _dict(data.get('risk_alert'))
+    crowd = _dict(data.get('overcrowd_predictor'))
+    tracking = _dict(data.get('budget_tracking'))
+    rows = {model: [] for model in [TripOverview] + ROW_MODELS}
+    rows[TripOverview].append({
+        'trip_id': trip_id,
+        'destination': _text(summary.get('destination')),
+        'dates': _text(summary.get('dates')),
+        'travelers': _text(summary.get('travelers')),
+        'budget': _text(summary.get('budget')),
+        'mood': _text(summary.get('mood')),
+        'theme': _text(summary.get('overall_theme')),
+        'risk_level': _text(risk.get('level')),
+        'risk_details': _text(risk.get('details')),
+        'crowd_level': _text(crowd.get('level')),
+        'crowd_reason': _text(crowd.get('reason')),
+        'budget_overview': _text(tracking.get('overview')),
+    })
+
+    plan = _daily_plan(data.get('daily_plan'))
+    budget_rows = [row for row in _list(data.get('daily_budget_plan')) if isinstance(row, dict)]
+    for day_number in range(1, max(len(plan), len(budget_rows)) + 1):
+        label, activities = plan[day_number - 1] if day_number <= len(plan) else (None, None)
+        day = {'trip_id': trip_id, 'day_number': day_number, 'label': _text(label),
+               'activities': _text(activities), 'budget_label': None, 'budget_activities': None,
+               'recommendations': None, 'estimated_spend': None, 'spend_cents': None}
+        if day_number <= len(budget_rows):
+            row = budget_rows[day_number - 1]
+            day.update({
+                'budget_label': _text(row.get('day')) or f'Day {day_number}',
+                'budget_activities': _text(row.get('activities')),
+                'recommendations': _text(row.get('recommendations')),
+                'estimated_spend': _text(row.get('estimated_spend')),
+                'spend_cents': parse_money(row.get('estimated_spend')),
+            })
+            for position, (category, amount) in enumerate(_dict(row.get('category_breakdown')).items()):
+                rows[TripBudgetLine].append({
+                    'trip_id': trip_id, 'day_number': day_number, 'position': position, 'category': str(category),
+                    'amount': _text(amount), 'cents': parse_money(amount), 'percentage': None, 'suggestions': None,
+                })
+        rows[TripDay].append(day)
+
+    for position, line in enumerate(_list(tracking.get('distribution_table'))):
+        line = _dict(line)
+        rows[TripBudgetLine].append({
+            'trip_id': trip_id, 'day_number': 0, 'position': position, 'category': str(line.get('category', '')),
+            'amount': _text(line.get('estimated_cost')), 'cents': parse_money(line.get('estimated_cost')),
+            'percentage': _text(line.get('percentage')), 'suggestions': _text(line.get('suggestions')),
+        })
+
+    for position, hotel in enumerate(_list(data.get('hotel_recommendations'))):
+        hotel = _dict(hotel)
+        rows[TripHotel].append({
+            'trip_id': trip_id, 'position': position, 'name': _text(hotel.get('name')),
+            'price_range': _text(hotel.get('price_range')), 'rating': _text(hotel.get('rating')),
+            'highlight': _text(hotel.get('highlight')),
+        })
+    for position, place in enumerate(_list(data.get('trending_places'))):
+        place = _dict(place)
+        rows[TripPlace].append({
+            'trip_id': trip_id, 'position': position, 'place': _text(place.get('place')),
+            'description': _text(place.get('description')), 'rating': _text(place.get('rating')),
+            'image_url': _text(place.get('image_url')),
+        })
+    notes = dict(data, optimization_tips=tracking.get('optimization_tips'))
+    for section, kind in NOTE_KINDS.items():
+        for position, text in enumerate(_list(notes.get(section))):
+            rows[TripNote].append({'trip_id': trip_id, 'kind': kind, 'position': position, 'text': str(text)})
+    return rows
+
+
+def save_rows(session, trip_id, data):
+    """Add the normalized rows of a trip's itinerary to session (committed by the caller)."""
+    for model, rows in itinerary_rows(trip_id, data).items():
+        if rows:
+            session.execute(insert(model), rows)
+
+
+_DELETES = [delete(model).where(model.trip_id == bindparam('trip_id')) for model in ROW_MODELS + [TripOverview]]
+
+
+def delete_rows(trip_id):
+    """Delete a trip's rows (committed by the caller)."""
+    for statement in _DELETES:
+        db.session.execute(statement, {'trip_id': trip_id})
+
+
+def _present(**values):
+    # Leave out fields the generated document didn't have
+    return {name: value for name, value in values.items() if value is not None}
+
+
+def _rows_query():
+    # One round trip for every table: (table, day_number, position, up to six text columns)
+    null = literal_column('NULL')
+    return union_all(
+        select(literal('summary'), null, literal(0), TripOverview.destination, TripOverview.dates,
+               TripOverview.travelers, TripOverview.budget, TripOverview.mood, TripOverview.theme)
+        .where(TripOverview.trip_id == bindparam('trip_id')),
+        select(literal('overview'), null, literal(0), TripOverview.risk_level, TripOverview.risk_details,
+               TripOverview.crowd_level, TripOverview.crowd_reason, TripOverview.budget_overview, null)
+        .where(TripOverview.trip_id == bindparam('trip_id')),
+        select(literal('day'), TripDay.day_number, literal(0), TripDay.label, TripDay.activities,
+               TripDay.budget_label, TripDay.budget_activities, TripDay.recommendations, TripDay.estimated_spend)
+        .where(TripDay.trip_id == bindparam('trip_id')),
+        select(literal('line'), TripBudgetLine.day_number, TripBudgetLine.position, TripBudgetLine.category,
+               TripBudgetLine.amount, TripBudgetLine.percentage, TripBudgetLine.suggestions, null, null)
+        .where(TripBudgetLine.trip_id == bindparam('trip_id')),
+        select(literal('hotel'), null, TripHotel.position, TripHotel.name, TripHotel.price_range, TripHotel.rating,
+               TripHotel.highlight, null, null)
+        .where(TripHotel.trip_id == bindparam('trip_id')),
+        select(literal('place'), null, TripPlace.position, TripPlace.place, TripPlace.description, TripPlace.rating,
+               TripPlace.image_url, null, null)
+        .where(TripPlace.trip_id == bindparam('trip_id')),
+        select(literal('note'), null, TripNote.position, TripNote.kind, TripNote.text, null, null, null, null)
+        .where(TripNote.trip_id == bindparam('trip_id')),
+    ).order_by(literal_column('1'), literal_column('2'), literal_column('3'))
+
+
+# Built once; only the trip id changes
+_ROWS = _rows_query()
+
+
+def load_itinerary(trip_id):
+    """The itinerary document of a trip rebuilt from its rows, or None if it has none yet."""
+    summary = overview = None
+    days = []
+    breakdowns = {}
+    distribution = []
+    hotels = []
+    places = []
+    texts = {kind: [] for kind in NOTE_KINDS.values()}
+    for table, day_number, _, a, b, c, d, e, f in db.session.execute(_ROWS, {'trip_id': trip_id}):
+        if table == 'summary':
+            summary = _present(destination=a, dates=b, travelers=c, budget=d, mood=e, overall_theme=f)
+        elif table == 'overview':
+            overview = (a, b, c, d, e)
+        elif table == 'day':
+            days.append((day_number, a, b, c, d, e, f))
+        elif table == 'line' and day_number == 0:
+            distribution.append(_present(category=a, percentage=c, estimated_cost=b, suggestions=d))
+        elif table == 'line':
+            breakdowns.setdefault(day_number, {})[a] = b
+        elif table == 'hotel':
+            hotels.append(_present(name=a, price_range=b, rating=c, highlight=d))
+        elif table == 'place':
+            places.append(_present(place=a, description=b, rating=c, image_url=d))
+        else:
+            texts.setdefault(a, []).append(b)
+
+    if overview is None:
+        return None
+    risk_level, risk_details, crowd_level, crowd_reason, budget_overview = overview
+    tracking = _present(overview=budget_overview)
+    tracking['distribution_table'] = distribution
+    tracking['optimization_tips'] = texts['tip']
+    data = {
+        'trip_summary': summary,
+        'trending_places': places,
+        'risk_alert': _present(level=risk_level, details=risk_details),
+        'hotel_recommendations': hotels,
+        'overcrowd_predictor': _present(level=crowd_level, reason=crowd_reason),
+        'quick_insights': texts['insight'],
+        'daily_plan': {label: activities for _, label, activities, *_ in days if label is not None},
+        'important_notes': texts['note'],
+        'daily_budget_plan': [dict(_present(day=budget_label, activities=budget_activities, estimated_spend=spend),
+                                   category_breakdown=breakdowns.get(day_number, {}),
+                                   **_present(recommendations=recommendations))
+                              for day_number, _, _, budget_label, budget_activities, recommendations, spend in days
+                              if budget_label is not None],
+        'budget_tracking': tracking,
+    }
+    return {name: data[name] for name in ITINERARY_SECTIONS}
+
+
+def backfill(session, batch_size=500, log=None):
+    """Write the rows of trips saved before the normalized tables existed; returns how many trips it did.
+
+    Runs alongside the app: each batch is its own short transaction, and
+    trips saved meanwhile already have their rows.
+    """
+    done = 0
+    last_id = 0
+    started = time.monotonic()
+    while True:
+        batch = session.execute(
+            select(Trip.id, Trip.itinerary)
+            .where(Trip.id > last_id, ~exists().where(TripOverview.trip_id == Trip.id))
+            .order_by(Trip.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return done
+        for trip_id, itinerary in batch:
+            try:
+                data = json.loads(itinerary)
+            except ValueError:
+                data = {}
+            save_rows(session, trip_id, data if isinstance(data, dict) else {})
+        session.commit()
+        last_id = batch[-1][0]
+        done += len(batch)
+        if log is not None:
+            log(f'backfilled {done} trips ({done / (time.monotonic() - started):.0f}/s)')
+
+
+def compact_json(text):
+    """JSON text without insignificant whitespace; text that isn't JSON is returned as it is."""
+    try:
+        return json.dumps(json.loads(text), separators=(',', ':'))
+    except ValueError:
+        return text
+
+
+def compress_itineraries(session, batch_size=500, log=None):
+    """Rewrite itineraries still stored as plain text in the compressed encoding; returns how many.
+
+    Like backfill(), runs alongside the app in short transactions. Only
+    rows SQLite still stores as text are read, so it can be stopped and
+    started again at any time.
+    """
+    raw = type_coerce(Trip.itinerary, db.LargeBinary)
+    rewrite = (update(Trip.__table__).where(Trip.__table__.c.id == bindparam('trip_id'))
+               .values(itinerary=bindparam('text')))
+    done = 0
+    last_id = 0
+    started = time.monotonic()
+    while True:
+        batch = session.execute(
+            select(Trip.id, raw)
+            .where(Trip.id > last_id, func.typeof(raw) == 'text')
+            .order_by(Trip.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return done
+        session.execute(rewrite, [{'trip_id': trip_id, 'text': compact_json(text)} for trip_id, text in batch])
+        session.commit()
+        last_id = batch[-1][0]
+        done += len(batch)
+        if log is not None:
+            log(f'compressed {done} itineraries ({done / (time.monotonic() - started):.0f}/s)')
+
+
+@click.command('backfill-itineraries')
+@click.option('--batch-size', type=int, default=500, help='Trips per transaction.')
+@with_appcontext
+def backfill_command(batch_size):
+    """Create the normalized itinerary tables and fill them for existing trips."""
+    db.create_all()
+    done = backfill(db.session, batch_size, log=click.echo)
+    click.echo(f'{done} trips backfilled')
+
+
+@click.command('compress-itineraries')
+@click.option('--batch-size', type=int, default=500, help='Trips per transaction.')
+@click.option('--vacuum', is_flag=True, help='Then rebuild the database file to return the freed space '
+                                            '(blocks writers while it runs).')
+@with_appcontext
+def compress_command(batch_size, vacuum):
+    """Compress itineraries saved as plain text."""
+    done = compress_itineraries(db.session, batch_size, log=click.echo)
+    click.echo(f'{done} itineraries compressed')
+    if vacuum:
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('VACUUM')
@@ -0,0 +1,333 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, date, timedelta
+
+from flask import current_app
+
+from models import db, GenerationJob, GenerationJobEvent
+from pipeline import GenerationError, generate_itinerary_data, save_trip
+from parsing import IncrementalJSONParser
+from singleflight import Heartbeat
+import timing
+import tracing
+
+
+def _encode_params(params):
+    return json.dumps({k: v.isoformat() if isinstance(v, date) else v for k, v in params.items()})
+
+
+def _decode_params(raw):
+    params = json.loads(raw)
+    for field in ('start_date', 'end_date'):
+        params[field] = date.fromisoformat(params[field])
+    return params
+
+
+def enqueue_job(params, server_timing=False):
+    """Persist a generation job for params and wake the local workers.
+
+    With server_timing, the job records its stages as a 'timing' event. The
+    job's spans continue the trace of the request that enqueued it.
+    """
+    encoded = dict(params, _trace=tracing.carrier())
+    if server_timing:
+        encoded['_server_timing'] = True
+    job = GenerationJob(id=uuid.uuid4().hex, status='queued', params=_encode_params(encoded))
+    with tracing.span('db.insert', **{'db.table': 'generation_job'}):
+        db.session.add(job)
+        db.session.commit()
+    job_pool.notify()
+    return job
+
+
+def queue_position(job):
+    """1-based position of a queued job, or 0 once a worker has picked it up."""
+    if job.status != 'queued':
+        return 0
+    ahead = GenerationJob.query.filter(
+        GenerationJob.status == 'queued',
+        GenerationJob.created_at < job.created_at
+    ).count()
+    return ahead + 1
+
+
+class JobProgress:
+    """Turn streamed model output into generation_job_event rows for one job."""
+
+    # Sections the dashboard preview renders entry by entry
+    EXPAND = ('trending_places', 'daily_plan', 'daily_budget_plan')
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.parser = None
+        self._sent = False
+        self._pinned = {}
+
+    def reset(self):
+        """Start over, e.g. when a new model attempt begins."""
+        if self._sent:
+            db.session.add(GenerationJobEvent(job_id=self.job_id, kind='reset'))
+            db.session.commit()
+            self._sent = False
+            for name, value in self._pinned.items():
+                self._send(name, value)
+        self.parser = IncrementalJSONParser(expand=self.EXPAND)
+
+    def pin(self, name, value):
+        """Publish a section known before generation starts and keep it across resets."""
+        self._pinned[name] = value
+        self._send(name, value)
+
+    def feed(self, text):
+        events = self.parser.feed(text)
+        for event in events:
+            if event[0] == 'section':
+                _, name, value = event
+                if name in self.EXPAND:
+                    continue  # already sent entry by entry
+                row = GenerationJobEvent(job_id=self.job_id, kind='section', name=name)
+            else:
+                _, name, key, value = event
+                row = GenerationJobEvent(job_id=self.job_id, kind='item', name=name, item_key=str(key))
+            row.value = json.dumps(value)
+            db.session.add(row)
+        if events:
+            db.session.commit()
+            self._sent = True
+
+    def publish(self, name, value):
+        """Send a section that was generated on its own rather than streamed."""
+        self._send(name, value)
+        self._sent = True
+
+    def _send(self, name, value):
+        if name in self.EXPAND:
+            items = value.items() if isinstance(value, dict) else enumerate(value)
+            rows = [GenerationJobEvent(job_id=self.job_id, kind='item', name=name, item_key=str(key),
+                                       value=json.dumps(item))
+                    for key, item in items]
+        else:
+            rows = [GenerationJobEvent(job_id=self.job_id, kind='section', name=name, value=json.dumps(value))]
+        db.session.add_all(rows)
+        db.session.commit()
+
+
+def job_timing(job_id):
+    """Server-Timing stages recorded by a job, or None."""
+    row = (GenerationJobEvent.query
+           .filter(GenerationJobEvent.job_id == job_id, GenerationJobEvent.kind == 'timing')
+           .first())
+    return json.loads(row.value) if row is not None else None
+
+
+def iter_job_events(job_id, last_event_id=0, poll_interval=0.25, timeout=30):
+    """Yield (event_id, event_name, payload) for a job until it finishes, or 'timeout' after timeout seconds.
+
+    The stream holds a web worker while it is open, so it is kept short and
+    clients reopen it from the last event id they got.
+    """
+    deadline = time.time() + timeout
+    last_position = 0
+    while time.time() < deadline:
+        rows = (GenerationJobEvent.query
+                .filter(GenerationJobEvent.job_id == job_id, GenerationJobEvent.id > last_event_id)
+                .order_by(GenerationJobEvent.id.asc())
+                .all())
+        for row in rows:
+            last_event_id = row.id
+            yield row.id, row.kind, row.to_dict()
+        job = db.session.get(GenerationJob, job_id)
+        if job.status == 'done':
+            yield None, 'done', {'trip_id': job.trip_id}
+            return
+        if job.status == 'failed':
+            yield None, 'failed', {'error': job.error}
+            return
+        position = queue_position(job)
+        if position != last_position:
+            last_position = position
+            yield None, 'queued', {'queue_position': position}
+        # End the read transaction so the next poll sees new rows
+        db.session.rollback()
+        time.sleep(poll_interval)
+    yield None, 'timeout', {}
+
+
+class JobWorkerPool:
+    """Worker threads that claim generation jobs from the generation_job table."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.size = 4
+        self.poll_interval = 1.0
+        self.lease = 300
+        self.max_attempts = 2
+        self.retention = 7 * 24 * 3600
+        self._threads = []
+        self._started = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._last_recovery = 0.0
+        self._last_prune = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.size = app.config.get('GENERATION_WORKERS', self.size)
+        self.poll_interval = app.config.get('GENERATION_POLL_INTERVAL', self.poll_interval)
+        self.lease = app.config.get('GENERATION_JOB_LEASE', self.lease)
+        self.max_attempts = app.config.get('GENERATION_JOB_MAX_ATTEMPTS', self.max_attempts)
+        self.retention = app.config.get('GENERATION_JOB_RETENTION', self.retention)
+        app.extensions['job_pool'] = self
+        # Servers start the workers from their start hooks (app.py, gunicorn.conf.py), not on
+        # import, so CLI commands and the reloader parent don't spawn any; others start them here
+        app.before_request(self.start)
+
+    def start(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+            for n in range(self.size):
+                thread = threading.Thread(target=self._run, args=(f"{worker_prefix}:{n}",),
+                                          name=f"generation-worker-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self, worker_id):
+        errors = 0
+        while True:
+            try:
+                with self.app.app_context():
+                    self.requeue_expired()
+                    self.prune_finished()
+                    job = self.claim(worker_id)
+                    if job is not None:
+                        self.process(job)
+                        errors = 0
+                        continue
+                errors = 0
+            except Exception:
+                # Keep the worker alive; the job lease takes care of anything left running
+                errors += 1
+                self.app.logger.exception('generation worker %s failed', worker_id)
+                # Back off while the failure lasts (e.g. the database is down) instead of spinning
+                time.sleep(min(self.poll_interval * 2 ** errors, 60))
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def claim(self, worker_id):
+        """Atomically move the oldest queued job to running and return it."""
+        while True:
+            candidate = (db.session.query(GenerationJob.id)
+                         .filter(GenerationJob.status == 'queued')
+                         .order_by(GenerationJob.created_at.asc())
+                         .first())
+            if candidate is None:
+                return None
+            claimed = (GenerationJob.query
+                       .filter(GenerationJob.id == candidate.id, GenerationJob.status == 'queued')
+                       .update({'status': 'running',
+                                'worker': worker_id,
+                                'started_at': datetime.utcnow(),
+                                'attempts': GenerationJob.attempts + 1},
+                               synchronize_session=False))
+            db.session.commit()
+            if claimed:
+                return db.session.get(GenerationJob, candidate.id)
+
+    def requeue_expired(self):
+        """Return jobs whose worker died (lease expired) to the queue."""
+        now = time.time()
+        if now - self._last_recovery < self.lease / 4:
+            return
+        self._last_recovery = now
+        cutoff = datetime.utcnow() - timedelta(seconds=self.lease)
+        expired = GenerationJob.query.filter(GenerationJob.status == 'running',
+                                             GenerationJob.started_at < cutoff)
+        expired.filter(GenerationJob.attempts >= self.max_attempts).update(
+            {'status': 'failed',
+             'error': 'Generation was interrupted. Please try again.',
+             'finished_at': datetime.utcnow()},
+            synchronize_session=False)
+        expired.filter(GenerationJob.attempts < self.max_attempts).update(
+            {'status': 'queued', 'worker': None}, synchronize_session=False)
+        db.session.commit()
+
+    def renew_lease(self, job_id, worker_id):
+        """Restart the lease of a job this worker is still running; False if it was requeued."""
+        renewed = (GenerationJob.query
+                   .filter(GenerationJob.id == job_id, GenerationJob.status == 'running',
+                           GenerationJob.worker == worker_id)
+                   .update({'started_at': datetime.utcnow()}, synchronize_session=False))
+        db.session.commit()
+        if not renewed:
+            current_app.logger.warning('generation job %s was requeued while %s ran it', job_id, worker_id)
+        return bool(renewed)
+
+    def prune_finished(self):
+        """Delete jobs finished more than GENERATION_JOB_RETENTION ago, and their events."""
+        now = time.time()
+        if not self.retention or now - self._last_prune < min(self.retention, 3600):
+            return 0
+        self._last_prune = now
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        finished = (db.select(GenerationJob.id)
+                    .where(GenerationJob.status.in_(('done', 'failed')), GenerationJob.finished_at < cutoff))
+        GenerationJobEvent.query.filter(GenerationJobEvent.job_id.in_(finished)).delete(synchronize_session=False)
+        pruned = (GenerationJob.query
+                  .filter(GenerationJob.status.in_(('done', 'failed')), GenerationJob.finished_at < cutoff)
+                  .delete(synchronize_session=False))
+        db.session.commit()
+        return pruned
+
+    def process(self, job):
+        """Run the model call for a claimed job and record the outcome."""
+        params = _decode_params(job.params)
+        timings = timing.Timings() if params.pop('_server_timing', False) else None
+        with tracing.span('generation.job', params.pop('_trace', None), **{
+                'job.id': job.id, 'job.attempt': job.attempts, 'job.worker': job.worker}) as span:
+            # Keep the lease while the job runs, however long that takes
+            heartbeat = Heartbeat(lambda: self.renew_lease(job.id, job.worker), self.lease / 4,
+                                  name='generation-job-lease')
+            try:
+                with heartbeat, timing.bind(timings):
+                    data = generate_itinerary_data(params, progress=JobProgress(job.id))
+                    with timing.stage('db', 'save trip'):
+                        trip = save_trip(params, data)
+                job.status = 'done'
+                job.trip_id = trip.id
+            except GenerationError as e:
+                db.session.rollback()
+                job.status = 'failed'
+                job.error = str(e)
+            except Exception as e:
+                db.session.rollback()
+                job.status = 'failed'
+                job.error = f'Error generating itinerary: {str(e)}'
+            job.finished_at = datetime.utcnow()
+            if timings is not None:
+                db.session.add(GenerationJobEvent(job_id=job.id, kind='timing', value=json.dumps(timings.to_list())))
+            db.session.commit()
+            span.set_attribute('job.status', job.status)
+            if job.status == 'failed':
+                span.error = job.error
+                current_app.logger.warning('generation job %s failed: %s request_id=%s', job.id, job.error,
+                                           span.trace_id)
+            else:
+                current_app.logger.info('generation job %s done trip_id=%s request_id=%s', job.id, job.trip_id,
+                                        span.trace_id)
+
+
+job_pool = JobWorkerPool()
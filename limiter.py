@@ -0,0 +1,169 @@
+import bisect
+import itertools
+import threading
+import time
+
+from retry import ModelsUnavailable, is_rate_limited
+
+# Lower value is admitted first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+
+class AdmissionTimeout(ModelsUnavailable):
+    """Raised when a call could not be admitted before its deadline."""
+
+    def __init__(self):
+        super().__init__('Too many itineraries are being planned right now. Please try again in a moment.')
+
+
+class TokenBucket:
+    """Requests-per-minute limiter with a small burst allowance; a rate of 0 means no limit."""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = max(rate_per_minute, 0) / 60.0
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until a token is available (0 if one is available now)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class _Permit:
+    def __init__(self, controller, model_name, admitted_at):
+        self.controller = controller
+        self.model_name = model_name
+        self.admitted_at = admitted_at
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.controller.release(self.model_name, error=exc, admitted_at=self.admitted_at)
+        return False
+
+
+class AdmissionController:
+    """Shared gate in front of the Gemini client.
+
+    A call is admitted when it is the highest-priority waiter that fits:
+    the global AIMD concurrency limit has room, its model's bulkhead has
+    room and the requests-per-minute bucket has a token. The limit halves
+    on RESOURCE_EXHAUSTED, at most once per round trip, and grows back by
+    one per limit's worth of successful calls.
+    """
+
+    def __init__(self, app=None):
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiters = []
+        self._in_flight = {}
+        self.total_in_flight = 0
+        self.rpm = 60
+        self.burst = 10
+        self.model_concurrency = 8
+        self.min_limit = 1
+        self.max_limit = 16
+        self.limit = 8.0
+        self._decreased_at = 0.0
+        self.bucket = TokenBucket(self.rpm, self.burst)
+        self.counters = {'admitted': 0, 'rejected': 0, 'throttled': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rpm = app.config.get('GEMINI_RPM', self.rpm)
+        self.burst = app.config.get('GEMINI_BURST', self.burst)
+        self.model_concurrency = app.config.get('GEMINI_MODEL_CONCURRENCY', self.model_concurrency)
+        self.min_limit = app.config.get('GEMINI_MIN_CONCURRENCY', self.min_limit)
+        self.max_limit = app.config.get('GEMINI_MAX_CONCURRENCY', self.max_limit)
+        self.limit = float(min(self.max_limit, app.config.get('GEMINI_INITIAL_CONCURRENCY', self.limit)))
+        self.bucket = TokenBucket(self.rpm, self.burst)
+        app.extensions['gemini_admission'] = self
+
+    def _has_room(self, model_name):
+        return (self.total_in_flight < int(self.limit)
+                and self._in_flight.get(model_name, 0) < self.model_concurrency)
+
+    def _is_next(self, waiter):
+        # Waiters whose model is full don't hold back waiters for other models
+        for candidate in self._waiters:
+            if self._has_room(candidate[2]):
+                return candidate is waiter
+        return False
+
+    def acquire(self, model_name, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """Wait for admission; use the returned permit as a context manager around the call."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waiter = (priority, next(self._seq), model_name)
+        with self._cond:
+            bisect.insort(self._waiters, waiter)
+            try:
+                while True:
+                    wait = None
+                    if self._is_next(waiter):
+                        wait = self.bucket.wait_time()
+                        if wait == 0:
+                            self.bucket.take()
+                            self._in_flight[model_name] = self._in_flight.get(model_name, 0) + 1
+                            self.total_in_flight += 1
+                            self.counters['admitted'] += 1
+                            admitted_at = time.monotonic()
+                            break
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.counters['rejected'] += 1
+                            raise AdmissionTimeout()
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                self._waiters.remove(waiter)
+                self._cond.notify_all()
+        return _Permit(self, model_name, admitted_at)
+
+    def release(self, model_name, error=None, admitted_at=None):
+        with self._cond:
+            self._in_flight[model_name] -= 1
+            self.total_in_flight -= 1
+            if error is not None and is_rate_limited(error):
+                self.counters['throttled'] += 1
+                # Multiplicative decrease on upstream throttling. Calls admitted before the
+                # last decrease were sent at the old limit, so their 429s don't halve it again.
+                if admitted_at is None or admitted_at >= self._decreased_at:
+                    self.limit = max(float(self.min_limit), self.limit / 2)
+                    self._decreased_at = time.monotonic()
+            elif error is None:
+                # Additive increase: about +1 per `limit` successful calls
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats.update({
+                'limit': round(self.limit, 2),
+                'in_flight': self.total_in_flight,
+                'in_flight_by_model': dict(self._in_flight),
+                'waiting': len(self._waiters),
+            })
+        return stats
+
+
+admission = AdmissionController()
@@ -0,0 +1,297 @@
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+from google import genai
+from google.genai import errors, types
+
+from schema import DAILY_SECTIONS, ITINERARY_SCHEMA, section_schema
+
+
+class GeminiBackend:
+    """The real Gemini API."""
+
+    name = 'gemini'
+
+    def __init__(self, api_key, base_url=None):
+        self.api_key = api_key
+        # Another endpoint speaking the Gemini API, e.g. benchmarks.fake_gemini for load tests
+        self.base_url = base_url
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Created on first use so the other backends run without an API key
+        with self._lock:
+            if self._client is None:
+                http_options = types.HttpOptions(base_url=self.base_url) if self.base_url else None
+                self._client = genai.Client(api_key=self.api_key, http_options=http_options)
+            return self._client
+
+    def generate(self, model_name, prompt, config=None, usage=None, timeout=None):
+        """Return the response text for prompt, filling usage with its token counts."""
+        response = self.client.models.generate_content(model=model_name, contents=prompt,
+                                                       config=_with_timeout(config, timeout))
+        _record_usage(usage, response.usage_metadata)
+        return response.text
+
+    def stream(self, model_name, prompt, config=None, usage=None, timeout=None):
+        """Yield the response text chunk by chunk."""
+        for chunk in self.client.models.generate_content_stream(model=model_name, contents=prompt,
+                                                                config=_with_timeout(config, timeout)):
+            # Every chunk carries the counts so far
+            _record_usage(usage, chunk.usage_metadata)
+            if chunk.text:
+                yield chunk.text
+
+
+def _with_timeout(config, timeout):
+    """config with an HTTP timeout of timeout seconds for this call; the client's default waits indefinitely."""
+    if timeout is None:
+        return config
+    http_options = types.HttpOptions(timeout=max(1, math.ceil(timeout * 1000)))
+    if config is None:
+        return types.GenerateContentConfig(http_options=http_options)
+    return config.model_copy(update={'http_options': http_options})
+
+
+def _record_usage(usage, metadata):
+    if usage is not None and metadata is not None:
+        usage['input_tokens'] = metadata.prompt_token_count
+        usage['output_tokens'] = metadata.candidates_token_count
+
+
+def estimate_usage(usage, prompt, text):
+    """Rough token counts (about four characters a token) for backends that don't report them."""
+    if usage is not None:
+        usage['input_tokens'] = len(prompt) // 4
+        usage['output_tokens'] = len(text) // 4
+
+
+def _wait(seconds, timeout):
+    """Sleep through a response delay, or fail like an HTTP read that times out first."""
+    if timeout is not None and seconds > timeout:
+        time.sleep(max(0.0, timeout))
+        raise TimeoutError('Read timed out')
+    time.sleep(seconds)
+
+
+def parse_latency(spec):
+    """Parse a latency distribution: 'fixed:S', 'uniform:LOW,HIGH' or 'lognormal:MEDIAN,SIGMA' (seconds)."""
+    kind, _, args = spec.partition(':')
+    values = [float(value) for value in args.split(',') if value.strip()]
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'lognormal' and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f'Invalid latency distribution: {spec!r}')
+
+
+class FakeBackend:
+    """Offline stand-in for Gemini with configurable latency and injected errors.
+
+    Responses are valid itinerary JSON for whichever prompt was sent. Latency
+    and failures are drawn from an RNG seeded by the seed, model, prompt and
+    how often that prompt was sent, so a run replays identically whatever
+    the thread interleaving.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency='lognormal:2,0.4', rate_limit_rate=0.0, unavailable_rate=0.0, seed=0, chunk_size=64):
+        self.latency = parse_latency(latency)
+        self.rate_limit_rate = rate_limit_rate
+        self.unavailable_rate = unavailable_rate
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self._sent = {}
+        self._lock = threading.Lock()
+
+    def _rng(self, model_name, prompt):
+        digest = hashlib.sha256(f'{model_name}\0{prompt}'.encode('utf-8')).hexdigest()
+        with self._lock:
+            count = self._sent[digest] = self._sent.get(digest, 0) + 1
+        return random.Random(f'{self.seed}:{digest}:{count}')
+
+    def _fail(self, rng):
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            time.sleep(0.05)
+            raise errors.ClientError(429, {'error': {
+                'code': 429, 'status': 'RESOURCE_EXHAUSTED', 'message': 'Fake quota exceeded'}})
+        if roll < self.rate_limit_rate + self.unavailable_rate:
+            time.sleep(0.05)
+            raise errors.ServerError(503, {'error': {
+                'code': 503, 'status': 'UNAVAILABLE', 'message': 'Fake model overloaded'}})
+
+    def generate(self, model_name, prompt, config=None, usage=None, timeout=None):
+        rng = self._rng(model_name, prompt)
+        self._fail(rng)
+        _wait(max(0.0, self.latency(rng)), timeout)
+        text = fake_response(prompt, config)
+        estimate_usage(usage, prompt, text)
+        return text
+
+    def stream(self, model_name, prompt, config=None, usage=None, timeout=None):
+        rng = self._rng(model_name, prompt)
+        self._fail(rng)
+        text = fake_response(prompt, config)
+        estimate_usage(usage, prompt, text)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        total = max(0.0, self.latency(rng))
+        # About a third of the latency passes before the first chunk; the timeout applies to each read
+        _wait(total / 3, timeout)
+        for chunk in chunks:
+            yield chunk
+            _wait(total * 2 / 3 / len(chunks), timeout)
+
+
+def _prompt_int(pattern, prompt, default=None):
+    match = re.search(pattern, prompt)
+    return int(match.group(1)) if match else default
+
+
+def fake_response(prompt, config=None):
+    """Itinerary JSON answering one of the prompts in prompts.py."""
+    number_of_days = _prompt_int(r'Number of days: (\d+)', prompt, 1)
+    days = re.search(r'Day (\d+) to Day (\d+)', prompt)
+    first, last = (int(days.group(1)), int(days.group(2))) if days else (1, number_of_days)
+    sections = re.search(r'Only write these sections: ([\w, ]+)\.', prompt)
+    if sections:
+        schema = section_schema(sections.group(1).split(', '))
+    elif 'Plan only Day' in prompt:
+        schema = section_schema(DAILY_SECTIONS)
+    else:
+        schema = ITINERARY_SCHEMA
+    data = _fill(schema, range(first, last + 1))
+    structured = config is not None and getattr(config, 'response_schema', None) is not None
+    if not structured and isinstance(data.get('daily_plan'), list):
+        data['daily_plan'] = {entry['day']: entry['activities'] for entry in data['daily_plan']}
+    return json.dumps(data, indent=2)
+
+
+def _fill(schema, days, name=None):
+    if schema['type'] == 'OBJECT':
+        return {key: _fill(prop, days, key) for key, prop in schema['properties'].items()}
+    if schema['type'] == 'ARRAY':
+        if name in DAILY_SECTIONS:
+            return [dict(_fill(schema['items'], days), day=f'Day {day}') for day in days]
+        return [_fill(schema['items'], days) for _ in range(schema.get('min_items', 1))]
+    return schema.get('description', name or '')
+
+
+class RecordReplayBackend:
+    """Record prompt/response pairs from another backend to disk, or play them back.
+
+    Each pair is one JSON file named by the hash of the prompt and response
+    schema, so recordings from several processes don't collide. In replay
+    mode a prompt that was never recorded raises LookupError.
+    """
+
+    def __init__(self, directory, mode, backend=None, replay_latency=False):
+        self.directory = directory
+        self.mode = mode
+        self.backend = backend
+        self.replay_latency = replay_latency
+        self.name = mode
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, prompt, config):
+        schema = getattr(config, 'response_schema', None) if config is not None else None
+        raw = json.dumps([prompt, schema], sort_keys=True, default=str)
+        return os.path.join(self.directory, hashlib.sha256(raw.encode('utf-8')).hexdigest() + '.json')
+
+    def _save(self, path, model_name, prompt, chunks, seconds, usage):
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'model': model_name, 'prompt': prompt, 'chunks': chunks, 'seconds': seconds,
+                       'usage': usage}, f)
+        os.replace(tmp, path)
+
+    def _load(self, prompt, config, usage=None):
+        path = self._path(prompt, config)
+        try:
+            with open(path, encoding='utf-8') as f:
+                recording = json.load(f)
+        except FileNotFoundError:
+            raise LookupError(f'No recorded response for this prompt ({os.path.basename(path)})')
+        if self.replay_latency:
+            time.sleep(recording['seconds'])
+        if usage is not None and recording.get('usage'):
+            usage.update(recording['usage'])
+        return recording['chunks']
+
+    def generate(self, model_name, prompt, config=None, usage=None, timeout=None):
+        if self.mode == 'replay':
+            return ''.join(self._load(prompt, config, usage))
+        started = time.monotonic()
+        recorded = {}
+        text = self.backend.generate(model_name, prompt, config, recorded, timeout)
+        self._save(self._path(prompt, config), model_name, prompt, [text or ''], time.monotonic() - started, recorded)
+        if usage is not None:
+            usage.update(recorded)
+        return text
+
+    def stream(self, model_name, prompt, config=None, usage=None, timeout=None):
+        if self.mode == 'replay':
+            yield from self._load(prompt, config, usage)
+            return
+        started = time.monotonic()
+        recorded = {}
+        chunks = []
+        for chunk in self.backend.stream(model_name, prompt, config, recorded, timeout):
+            chunks.append(chunk)
+            yield chunk
+        self._save(self._path(prompt, config), model_name, prompt, chunks, time.monotonic() - started, recorded)
+        if usage is not None:
+            usage.update(recorded)
+
+
+class LLM:
+    """The configured LLM backend (LLM_BACKEND) that generate_with_retry calls."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = create_backend(app.config)
+        app.extensions['llm'] = self
+
+    def generate(self, model_name, prompt, config=None, usage=None, timeout=None):
+        """Response text for prompt; usage, if given, receives input_tokens and output_tokens.
+
+        timeout bounds the wait for the response in seconds (for stream(), each read).
+        """
+        return self.backend.generate(model_name, prompt, config, usage, timeout)
+
+    def stream(self, model_name, prompt, config=None, usage=None, timeout=None):
+        return self.backend.stream(model_name, prompt, config, usage, timeout)
+
+
+def create_backend(config):
+    kind = config.get('LLM_BACKEND', 'gemini')
+    if kind == 'gemini':
+        return GeminiBackend(config.get('GEMINI_API_KEY'), config.get('GEMINI_BASE_URL'))
+    if kind == 'fake':
+        return FakeBackend(latency=config.get('LLM_FAKE_LATENCY', 'lognormal:2,0.4'),
+                           rate_limit_rate=config.get('LLM_FAKE_429_RATE', 0.0),
+                           unavailable_rate=config.get('LLM_FAKE_503_RATE', 0.0),
+                           seed=config.get('LLM_FAKE_SEED', 0))
+    if kind in ('record', 'replay'):
+        return RecordReplayBackend(config.get('LLM_RECORD_DIR', 'instance/llm_recordings'), kind,
+                                   backend=GeminiBackend(config.get('GEMINI_API_KEY'), config.get('GEMINI_BASE_URL')),
+                                   replay_latency=config.get('LLM_REPLAY_LATENCY', False))
+    raise ValueError(f'Unknown LLM_BACKEND: {kind!r}')
+
+
+llm = LLM()
@@ -0,0 +1,100 @@
+import os
+import time
+
+from flask import g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# With PROMETHEUS_MULTIPROC_DIR set (before this module is imported), every
+# worker process writes its samples to files in that directory and /metrics
+# aggregates them, so any worker can answer a scrape.
+
+HTTP_REQUESTS = Counter('wandermate_http_requests_total', 'HTTP requests',
+                        ['method', 'endpoint', 'status'])
+HTTP_LATENCY = Histogram('wandermate_http_request_duration_seconds', 'Time to produce an HTTP response',
+                         ['method', 'endpoint'],
+                         buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+LLM_ATTEMPTS = Counter('wandermate_llm_attempts_total', 'Model calls, one per retry or hedge attempt',
+                       ['model', 'outcome'])
+LLM_LATENCY = Histogram('wandermate_llm_attempt_duration_seconds', 'Duration of one model call',
+                        ['model', 'outcome'],
+                        buckets=(0.5, 1, 2, 5, 10, 20, 30, 45, 60, 90, 120))
+
+JSON_PARSE = Counter('wandermate_json_parse_total', 'Parses of model output', ['outcome'])
+JSON_PARSE_LATENCY = Histogram('wandermate_json_parse_duration_seconds', 'json.loads of model output',
+                               buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
+
+DB_COMMITS = Counter('wandermate_db_commits_total', 'Database session commits')
+DB_COMMIT_LATENCY = Histogram('wandermate_db_commit_duration_seconds', 'Flush and commit of a database session',
+                              buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5, 30))
+
+PDF_RENDER_LATENCY = Histogram('wandermate_pdf_render_duration_seconds', 'doc.build of an exported trip',
+                               buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+CACHE_EVENTS = Counter('wandermate_itinerary_cache_events_total', 'Itinerary cache lookups and writes', ['event'])
+DESTINATION_CACHE_EVENTS = Counter('wandermate_destination_cache_events_total',
+                                   'Destination section cache lookups, early refreshes and writes', ['event'])
+PREWARM_EVENTS = Counter('wandermate_prewarm_total', 'Destination sections considered for pre-warming', ['outcome'])
+
+
+def attempt_outcome(error):
+    """Label for a model call that raised error (None for success)."""
+    if error is None:
+        return 'ok'
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return str(code)
+    return type(error).__name__
+
+
+class Metrics:
+    """Per-route request counters and latency, plus the /metrics exposition."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._record)
+        event.listen(Session, 'before_commit', _commit_started)
+        event.listen(Session, 'after_commit', _commit_finished)
+        app.extensions['metrics'] = self
+
+    def _start(self):
+        g.metrics_started = time.perf_counter()
+
+    def _record(self, response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            # The URL rule keeps label cardinality bounded
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(request.method, endpoint, str(response.status_code)).inc()
+        return response
+
+    def exposition(self):
+        """Return (body, content_type) for a scrape."""
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def _commit_started(session):
+    session.info['metrics_commit_started'] = time.perf_counter()
+
+
+def _commit_finished(session):
+    started = session.info.pop('metrics_commit_started', None)
+    if started is not None:
+        DB_COMMIT_LATENCY.observe(time.perf_counter() - started)
+        DB_COMMITS.inc()
+
+
+metrics = Metrics()
@@ -1,8 +1,52 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import json
+import zlib
 
 db = SQLAlchemy()
 
+
+def create_indexes(bind):
+    """Add indexes declared after their table was created, which create_all() leaves out."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+
+# First byte of a CompressedText value
+ENCODING_RAW = 0
+ENCODING_ZLIB = 1
+
+
+class CompressedText(db.TypeDecorator):
+    """Text stored as an encoding version byte followed by zlib-compressed UTF-8.
+
+    Reads also accept plain text, so rows written before the column was
+    compressed keep working while they are migrated.
+    """
+
+    impl = db.LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        raw = value.encode('utf-8')
+        packed = zlib.compress(raw, 6)
+        if len(packed) < len(raw):
+            return bytes([ENCODING_ZLIB]) + packed
+        return bytes([ENCODING_RAW]) + raw
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        encoding, body = value[0], value[1:]
+        if encoding == ENCODING_ZLIB:
+            return zlib.decompress(body).decode('utf-8')
+        if encoding == ENCODING_RAW:
+            return body.decode('utf-8')
+        raise ValueError(f'Unknown text encoding {encoding}')
+
+
 class Trip(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     destination = db.Column(db.String(100), nullable=False)
@@ -12,8 +56,9 @@ class Trip(db.Model):
     budget = db.Column(db.Float, nullable=False)
     mood = db.Column(db.String(50))
     preferences = db.Column(db.Text)
-    itinerary = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    itinerary = db.Column(CompressedText, nullable=False)
+    # With the rowid (id) SQLite keeps in every index, this orders /trips pages
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     def to_dict(self):
         return {
@@ -28,3 +73,172 @@ class Trip(db.Model):
             'itinerary': self.itinerary,
             'created_at': self.created_at.isoformat()
         }
+
+    def to_summary_dict(self):
+        """The fields of a trip card, without the itinerary."""
+        return {
+            'id': self.id,
+            'destination': self.destination,
+            'start_date': self.start_date.isoformat(),
+            'end_date': self.end_date.isoformat(),
+            'travelers': self.travelers,
+            'budget': self.budget,
+            'mood': self.mood,
+            'created_at': self.created_at.isoformat()
+        }
+
+# Trip.itinerary keeps the whole generated document; the tables below hold
+# the same content as rows the views read and cross-trip queries can index.
+# Rows are written with the trip (itinerary_store.py) and backfilled for
+# trips saved before them.
+
+class TripOverview(db.Model):
+    __tablename__ = 'trip_overview'
+
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id', ondelete='CASCADE'), primary_key=True)
+    destination = db.Column(db.String(200))
+    dates = db.Column(db.String(100))
+    travelers = db.Column(db.String(50))
+    budget = db.Column(db.String(50))
+    mood = db.Column(db.String(50))
+    theme = db.Column(db.Text)
+    risk_level = db.Column(db.String(20), index=True)
+    risk_details = db.Column(db.Text)
+    crowd_level = db.Column(db.String(20), index=True)
+    crowd_reason = db.Column(db.Text)
+    budget_overview = db.Column(db.Text)
+
+class TripDay(db.Model):
+    __tablename__ = 'trip_day'
+    # Clustered on the primary key, so a trip's rows are read together
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id', ondelete='CASCADE'), primary_key=True)
+    day_number = db.Column(db.Integer, primary_key=True)
+    # Label and activities of the daily plan (None if the day isn't in it)
+    label = db.Column(db.String(50))
+    activities = db.Column(db.Text)
+    # The day's budget row (None if the day isn't in the budget plan)
+    budget_label = db.Column(db.String(50))
+    budget_activities = db.Column(db.Text)
+    recommendations = db.Column(db.Text)
+    estimated_spend = db.Column(db.String(50))
+    spend_cents = db.Column(db.Integer)
+
+class TripBudgetLine(db.Model):
+    __tablename__ = 'trip_budget_line'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id', ondelete='CASCADE'), primary_key=True)
+    # 0 for the whole-trip distribution table
+    day_number = db.Column(db.Integer, primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.String(50), nullable=False)
+    amount = db.Column(db.String(50))
+    cents = db.Column(db.Integer)
+    percentage = db.Column(db.String(20))
+    suggestions = db.Column(db.Text)
+
+class TripHotel(db.Model):
+    __tablename__ = 'trip_hotel'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id', ondelete='CASCADE'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), index=True)
+    price_range = db.Column(db.String(100))
+    rating = db.Column(db.String(20))
+    highlight = db.Column(db.Text)
+
+class TripPlace(db.Model):
+    __tablename__ = 'trip_place'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id', ondelete='CASCADE'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    place = db.Column(db.String(200), index=True)
+    description = db.Column(db.Text)
+    rating = db.Column(db.String(20))
+    image_url = db.Column(db.Text)
+
+class TripNote(db.Model):
+    __tablename__ = 'trip_note'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id', ondelete='CASCADE'), primary_key=True)
+    # insight, note or tip (quick_insights, important_notes, budget optimization_tips)
+    kind = db.Column(db.String(20), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.Text, nullable=False)
+
+class CachedItinerary(db.Model):
+    __tablename__ = 'itinerary_cache'
+
+    key = db.Column(db.String(64), primary_key=True)
+    payload = db.Column(db.Text)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    negative = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    accessed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class CachedDestinationSections(db.Model):
+    __tablename__ = 'destination_cache'
+
+    key = db.Column(db.String(64), primary_key=True)
+    payload = db.Column(db.Text, nullable=False)
+    # Seconds it took to generate the sections, for early refresh
+    delta = db.Column(db.Float, nullable=False, default=0.0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    accessed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class GenerationJob(db.Model):
+    __tablename__ = 'generation_job'
+
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    params = db.Column(db.Text, nullable=False)
+    trip_id = db.Column(db.Integer, db.ForeignKey('trip.id'))
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Claimed, then renewed by the running worker's heartbeat; the lease runs from here
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'trip_id': self.trip_id,
+            'error': self.error,
+            'created_at': self.created_at.isoformat()
+        }
+
+class GenerationJobEvent(db.Model):
+    __tablename__ = 'generation_job_event'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(32), db.ForeignKey('generation_job.id'), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)
+    name = db.Column(db.String(50))
+    item_key = db.Column(db.String(50))
+    value = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'name': self.name,
+            'key': self.item_key,
+            'value': json.loads(self.value) if self.value is not None else None
+        }
+
+class GenerationLock(db.Model):
+    __tablename__ = 'generation_lock'
+
+    key = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
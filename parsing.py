@@ -0,0 +1,157 @@
+import json
+import re
+
+# A comma right before a closing bracket, which json.loads rejects
+_TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+
+
+class _Frame:
+    __slots__ = ('kind', 'start', 'key', 'expecting', 'count')
+
+    def __init__(self, kind, start):
+        self.kind = kind
+        self.start = start
+        self.key = None
+        self.expecting = 'key' if kind == 'object' else 'value'
+        self.count = 0
+
+
+class IncrementalJSONParser:
+    """Parse a streamed JSON object and report members as soon as they are complete.
+
+    feed() returns a list of events: ('section', name, value) for each finished
+    top-level member, and ('item', name, key, value) for each finished entry of
+    the members named in expand (object key or list index).
+    """
+
+    def __init__(self, expand=()):
+        self.expand = set(expand)
+        self.buffer = ''
+        self.stack = []
+        self.done = False
+        self._pos = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._primitive_start = None
+        # End of the last complete value and the containers open around it
+        self._last_end = None
+        self._last_frames = ()
+
+    def feed(self, text):
+        events = []
+        self.buffer += text
+        buf = self.buffer
+        i = self._pos
+        while i < len(buf) and not self.done:
+            ch = buf[i]
+            if not self._started:
+                # Skip markdown fences or chatter before the root object
+                if ch == '{':
+                    self._started = True
+                    self.stack.append(_Frame('object', i))
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._string_done(self._string_start, i + 1, events)
+                i += 1
+                continue
+
+            if self._primitive_start is not None and ch in ',}] \t\r\n':
+                self._value_done(self._primitive_start, i, events)
+                self._primitive_start = None
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in '{[':
+                self.stack.append(_Frame('object' if ch == '{' else 'array', i))
+            elif ch in '}]':
+                frame = self.stack.pop()
+                if not self.stack:
+                    self.done = True
+                else:
+                    self._value_done(frame.start, i + 1, events)
+            elif ch == ':':
+                self.stack[-1].expecting = 'value'
+            elif ch == ',':
+                frame = self.stack[-1]
+                frame.expecting = 'key' if frame.kind == 'object' else 'value'
+            elif ch not in ' \t\r\n' and self._primitive_start is None:
+                self._primitive_start = i
+            i += 1
+        self._pos = i
+        return events
+
+    def _string_done(self, start, end, events):
+        frame = self.stack[-1]
+        if frame.kind == 'object' and frame.expecting == 'key':
+            frame.key = json.loads(self.buffer[start:end])
+            frame.expecting = 'colon'
+        else:
+            self._value_done(start, end, events)
+
+    def _value_done(self, start, end, events):
+        frame = self.stack[-1]
+        depth = len(self.stack)
+        key = frame.key if frame.kind == 'object' else frame.count
+        frame.count += 1
+        self._last_end = end
+        self._last_frames = tuple(self.stack)
+        if depth == 1:
+            events.append(('section', key, self._load(start, end)))
+        elif depth == 2 and self.stack[0].key in self.expand:
+            events.append(('item', self.stack[0].key, key, self._load(start, end)))
+
+    def close(self):
+        """Return (name, text) of the unfinished top-level member, closed at its last complete value."""
+        if self.done or len(self.stack) < 2:
+            return None
+        section = self.stack[1]
+        frames = self._last_frames
+        if len(frames) > 1 and frames[1] is section:
+            text = self.buffer[section.start:self._last_end]
+        else:
+            text, frames = self.buffer[section.start], (None, section)
+        return self.stack[0].key, text + ''.join('}' if f.kind == 'object' else ']' for f in reversed(frames[1:]))
+
+    def _load(self, start, end):
+        return loads_lenient(self.buffer[start:end])
+
+
+def loads_lenient(text):
+    """json.loads that tolerates trailing commas; None if the text still doesn't parse."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(_TRAILING_COMMA.sub(r'\1', text))
+    except json.JSONDecodeError:
+        return None
+
+
+def salvage_json(text):
+    """Recover what is usable from a malformed or cut-off JSON object.
+
+    Returns (sections, partial): every top-level member that is complete, and
+    the member that was cut off, closed at its last complete value (empty if
+    nothing was cut off).
+    """
+    parser = IncrementalJSONParser()
+    sections = {name: value for _, name, value in parser.feed(text) if value is not None}
+    partial = {}
+    closed = parser.close()
+    if closed is not None:
+        value = loads_lenient(closed[1])
+        if value is not None:
+            partial[closed[0]] = value
+    return sections, partial
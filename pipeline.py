@@ -0,0 +1,166 @@
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Trip
+from cache import itinerary_cache, make_cache_key, NEGATIVE, destination_cache, make_destination_key
+from singleflight import SingleFlight, lock_owner, acquire_lock, keep_lock, release_lock, wait_for_release
+from generation import GenerationError
+from limiter import PRIORITY_INTERACTIVE
+from schema import DESTINATION_SECTIONS, ITINERARY_SECTIONS
+from strategies import select_strategy, trip_days
+from budget import apply_budget, budget_tier, format_money
+from itinerary_store import save_rows
+from search import index_trip
+import tracing
+import copy
+import json
+import time
+
+
+def request_cache_key(params):
+    number_of_days = trip_days(params)
+    return make_cache_key(params['destination'], params['start_date'], number_of_days, params['travelers'],
+                          params['budget'], params['mood'], params['preferences'])
+
+
+def personalize(data, params):
+    """Point a shared itinerary at the dates, wording and exact budget of this request."""
+    data.setdefault('trip_summary', {}).update({
+        'destination': params['destination'],
+        'dates': f"{params['start_date']} to {params['end_date']}",
+        # The cache key only has the budget tier, so the cached figure may be another request's
+        'travelers': str(params['travelers']),
+        'budget': format_money(round(params['budget'] * 100)),
+    })
+    return apply_budget(data, params['budget'], trip_days(params), params['mood'])
+
+
+def cached_itinerary(params):
+    """Return a cached itinerary for params, or None if it has to be generated."""
+    data = itinerary_cache.get(request_cache_key(params))
+    if data is NEGATIVE:
+        raise GenerationError('Error parsing AI response for this request. Please adjust your preferences or try again later.')
+    if data is not None:
+        # Cached plans were made for another request with the same inputs
+        personalize(data, params)
+    return data
+
+
+# Identical requests in flight in this process share one upstream call
+_in_flight = SingleFlight()
+
+
+def generate_itinerary_data(params, progress=None, priority=PRIORITY_INTERACTIVE):
+    """Produce the itinerary document for a validated trip request."""
+    data = cached_itinerary(params)
+    if data is not None:
+        return data
+
+    cache_key = request_cache_key(params)
+    data, _ = _in_flight.do(cache_key, lambda: _generate_coalesced(params, cache_key, progress, priority))
+    # Followers copy the same object, so the leader can't personalize it in place either
+    return personalize(copy.deepcopy(data), params)
+
+
+def _generate_coalesced(params, cache_key, progress, priority):
+    # Other processes generating the same request hold its generation_lock row;
+    # wait for them and take their result from the shared cache instead
+    ttl = current_app.config['GENERATION_LOCK_TTL']
+    poll_interval = current_app.config['GENERATION_LOCK_POLL_INTERVAL']
+    owner = lock_owner()
+    while True:
+        if acquire_lock(cache_key, owner, ttl):
+            try:
+                with keep_lock(cache_key, owner, ttl):
+                    data = cached_itinerary(params)
+                    if data is None:
+                        data = _generate_uncached(params, cache_key, progress, priority)
+                return data
+            finally:
+                release_lock(cache_key, owner)
+
+        wait_for_release(cache_key, ttl, poll_interval)
+        data = cached_itinerary(params)
+        if data is not None:
+            return data
+
+
+def _generate_uncached(params, cache_key, progress, priority):
+    strategy = select_strategy(params)
+    try:
+        with tracing.span('generation.strategy', **{'generation.strategy': strategy.__name__,
+                                                    'generation.days': trip_days(params)}):
+            data = _generate_with_shared_sections(strategy, params, progress, priority)
+    except json.JSONDecodeError:
+        itinerary_cache.record_failure(cache_key)
+        raise GenerationError('Error parsing AI response. Please try again.')
+
+    itinerary_cache.set(cache_key, data)
+    return data
+
+
+def _generate_with_shared_sections(strategy, params, progress, priority):
+    """Run strategy, reusing destination-level sections already generated for another trip there."""
+    if not destination_cache.enabled:
+        return strategy(params, progress=progress, priority=priority)
+    key = make_destination_key(params['destination'], params['start_date'].month, params['mood'],
+                               budget_tier(params['budget'], trip_days(params), params['travelers']))
+    with tracing.span('destination_cache.lookup') as lookup:
+        known, refresh = destination_cache.get(key)
+        lookup.set_attribute('cache.hit', known is not None)
+        lookup.set_attribute('cache.refresh', refresh)
+    if refresh:
+        # One request (re)generates the sections; the lock row keeps others from doing the same
+        owner = lock_owner()
+        ttl = current_app.config['GENERATION_LOCK_TTL']
+        if acquire_lock(key, owner, ttl):
+            try:
+                with keep_lock(key, owner, ttl):
+                    return _generate_and_share(strategy, params, progress, priority, key)
+            finally:
+                release_lock(key, owner)
+        if known is None:
+            # The lock holder is generating a whole itinerary; waiting for it would
+            # cost as long as generating this one without the shared sections
+            return strategy(params, progress=progress, priority=priority)
+
+    if progress is not None:
+        for name, value in known.items():
+            progress.pin(name, value)
+    data = strategy(params, progress=progress, priority=priority, known=known)
+    data.update(copy.deepcopy(known))
+    return {name: data[name] for name in ITINERARY_SECTIONS if name in data}
+
+
+def _generate_and_share(strategy, params, progress, priority, key):
+    started = time.monotonic()
+    data = strategy(params, progress=progress, priority=priority)
+    sections = {name: data[name] for name in DESTINATION_SECTIONS if name in data}
+    if len(sections) == len(DESTINATION_SECTIONS):
+        destination_cache.set(key, sections, time.monotonic() - started)
+    return data
+
+
+def save_trip(params, data):
+    """Save a generated itinerary as a new Trip row."""
+    trip = Trip(
+        destination=params['destination'],
+        start_date=params['start_date'],
+        end_date=params['end_date'],
+        travelers=params['travelers'],
+        budget=params['budget'],
+        mood=params['mood'],
+        preferences=params['preferences'],
+        itinerary=json.dumps(data, separators=(',', ':'))  # Stored compressed (models.CompressedText)
+    )
+    with tracing.span('db.insert', **{'db.table': 'trips'}):
+        db.session.add(trip)
+        db.session.flush()
+        save_rows(db.session, trip.id, data)
+        # A trip that couldn't be indexed is still saved; `flask index-trips` adds it later
+        try:
+            with db.session.begin_nested():
+                index_trip(db.session, trip, data)
+        except SQLAlchemyError:
+            current_app.logger.exception('could not index trip %s', trip.id)
+        db.session.commit()
+    return trip
@@ -0,0 +1,208 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from budget import budget_tier
+from cache import destination_cache, make_destination_key
+from limiter import PRIORITY_BATCH, TokenBucket
+from metrics import PREWARM_EVENTS
+from models import db, Trip
+from retry import ModelsUnavailable
+from singleflight import lock_owner, acquire_lock, keep_lock, release_lock
+from strategies import generate_destination_sections
+import tracing
+
+# generation_lock row that lets one process per interval run the warm-up
+RUN_LOCK = 'prewarm'
+
+
+def parse_hours(spec):
+    """'1-6' -> (1, 6): local hours from 1:00 up to 6:00; '22-4' wraps past midnight; '' is always."""
+    if not spec:
+        return None
+    start, _, end = spec.partition('-')
+    return int(start) % 24, int(end) % 24
+
+
+def in_hours(hours, hour):
+    if hours is None:
+        return True
+    start, end = hours
+    if start < end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+class Prewarmer:
+    """Generates the destination sections of the most requested trips ahead of demand.
+
+    Once per PREWARM_INTERVAL, during the off-peak PREWARM_HOURS, one process
+    ranks destination/month/mood/budget tier combinations by how many trips asked for
+    them in the last PREWARM_LOOKBACK_DAYS and generates the shared sections
+    of the top PREWARM_TOP that are missing from the destination cache or
+    about to expire. Calls wait for admission at batch priority, behind
+    every interactive request, and are started at most PREWARM_RPM a minute
+    so warming stays under that share of the Gemini quota.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.interval = 3600
+        self.hours = (1, 6)
+        self.top = 50
+        self.lookback_days = 90
+        self.refresh_before = 2 * 24 * 3600
+        self.rpm = 6
+        self.poll_interval = 60
+        self.last_run = None
+        self.counters = {'runs': 0, 'stored': 0, 'warm': 0, 'busy': 0, 'failed': 0, 'unavailable': 0}
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('PREWARM', self.enabled)
+        self.interval = app.config.get('PREWARM_INTERVAL', self.interval)
+        self.hours = parse_hours(app.config.get('PREWARM_HOURS', '1-6'))
+        self.top = app.config.get('PREWARM_TOP', self.top)
+        self.lookback_days = app.config.get('PREWARM_LOOKBACK_DAYS', self.lookback_days)
+        self.refresh_before = app.config.get('PREWARM_REFRESH_BEFORE', self.refresh_before)
+        self.rpm = app.config.get('PREWARM_RPM', self.rpm)
+        app.extensions['prewarmer'] = self
+        app.cli.add_command(prewarm_command)
+        if self.enabled:
+            # Started by the server start hooks, or else on the first request, like the job workers
+            app.before_request(self.start)
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='prewarm', daemon=True)
+                self._thread.start()
+
+    def off_peak(self):
+        return in_hours(self.hours, datetime.now().hour)
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    if (destination_cache.enabled and self.off_peak()
+                            and acquire_lock(RUN_LOCK, lock_owner(), self.interval)):
+                        # The lock is left to expire so no process runs again before the interval
+                        self.run_once()
+            except Exception:
+                self.app.logger.exception('pre-warming failed')
+            time.sleep(self.poll_interval)
+
+    def popular(self):
+        """(cache key, params) of the most requested destination/month/mood combinations, most requested first."""
+        since = datetime.utcnow() - timedelta(days=self.lookback_days)
+        travel_month = db.extract('month', Trip.start_date)
+        days = db.func.julianday(Trip.end_date) - db.func.julianday(Trip.start_date) + 1
+        rows = (db.session.query(Trip.destination, travel_month, Trip.mood, Trip.budget, days, Trip.travelers,
+                                 db.func.count(Trip.id), db.func.max(Trip.id))
+                .filter(Trip.created_at >= since)
+                .group_by(Trip.destination, travel_month, Trip.mood, Trip.budget, days, Trip.travelers)
+                .all())
+        # Spellings of one destination ('Kyoto', 'kyoto ') and nearby budgets share a cache key
+        combined = {}
+        for destination, month, mood, budget, number_of_days, travelers, count, latest in rows:
+            key = make_destination_key(destination, month, mood, budget_tier(budget, int(number_of_days), travelers))
+            total, _, representative = combined.get(key, (0, 0, None))
+            if representative is None or count > representative[0]:
+                representative = (count, latest)
+            combined[key] = (total + count, key, representative)
+        ranked = sorted(combined.values(), key=lambda item: item[0], reverse=True)[:self.top]
+        for _, key, (_, trip_id) in ranked:
+            trip = db.session.get(Trip, trip_id)
+            yield key, {
+                'destination': trip.destination,
+                'start_date': trip.start_date,
+                'end_date': trip.end_date,
+                'travelers': trip.travelers,
+                'budget': trip.budget,
+                'mood': trip.mood,
+                'preferences': '',
+            }
+
+    def run_once(self, ignore_hours=False):
+        """Warm the most requested combinations now; returns how many had each outcome."""
+        outcomes = {'stored': 0, 'warm': 0, 'busy': 0, 'failed': 0, 'unavailable': 0}
+        bucket = TokenBucket(self.rpm, 1)
+        ttl = current_app.config['GENERATION_LOCK_TTL']
+        with tracing.span('prewarm.run', **{'prewarm.top': self.top}) as run:
+            for key, params in list(self.popular()):
+                if not ignore_hours and not self.off_peak():
+                    break
+                if destination_cache.expires_in(key) > self.refresh_before:
+                    outcome = 'warm'
+                else:
+                    wait = bucket.wait_time()
+                    while wait > 0:
+                        time.sleep(wait)
+                        wait = bucket.wait_time()
+                    bucket.take()
+                    outcome = self._warm(key, params, ttl)
+                outcomes[outcome] += 1
+                PREWARM_EVENTS.labels(outcome).inc()
+                if outcome == 'unavailable':
+                    # Out of quota or models down: leave the rest for the next run
+                    break
+            run.set_attributes({f'prewarm.{name}': count for name, count in outcomes.items()})
+        with self._lock:
+            self.counters['runs'] += 1
+            for name, count in outcomes.items():
+                self.counters[name] += count
+            self.last_run = datetime.utcnow()
+        current_app.logger.info('pre-warmed destination sections: %s', outcomes)
+        return outcomes
+
+    def _warm(self, key, params, ttl):
+        # Requests generating the same sections hold this lock too
+        owner = lock_owner()
+        if not acquire_lock(key, owner, ttl):
+            return 'busy'
+        try:
+            started = time.monotonic()
+            with keep_lock(key, owner, ttl), tracing.span('prewarm.destination', **{
+                    'prewarm.destination': params['destination'], 'prewarm.month': params['start_date'].month}):
+                sections = generate_destination_sections(params, priority=PRIORITY_BATCH)
+            destination_cache.set(key, sections, time.monotonic() - started)
+            return 'stored'
+        except ModelsUnavailable:
+            return 'unavailable'
+        except Exception as e:
+            current_app.logger.warning('pre-warming %s failed: %s', params['destination'], e)
+            return 'failed'
+        finally:
+            release_lock(key, owner)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['enabled'] = self.enabled
+            stats['last_run'] = self.last_run.isoformat() if self.last_run else None
+        return stats
+
+
+@click.command('prewarm')
+@click.option('--top', type=int, help='How many combinations to consider (default PREWARM_TOP).')
+@with_appcontext
+def prewarm_command(top):
+    """Generate popular destination sections now, ignoring PREWARM_HOURS."""
+    if top is not None:
+        prewarmer.top = top
+    click.echo(prewarmer.run_once(ignore_hours=True))
+
+
+prewarmer = Prewarmer()
@@ -0,0 +1,271 @@
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from flask import g, request
+
+SETTINGS_FILE = 'profiling.json'
+FORMATS = {'collapsed': '.folded', 'speedscope': '.speedscope.json'}
+_PROFILE_NAME = re.compile(r'^(\d+)_(\w+)_(\d+|none)_(\d+)ms(\.folded|\.speedscope\.json)$')
+
+
+def _number(name, value, low, high=None):
+    if isinstance(value, bool):
+        raise ValueError(f'{name} must be a number')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number') from None
+    if high is None and not number >= low:
+        raise ValueError(f'{name} must be at least {low}')
+    if high is not None and not low <= number <= high:
+        raise ValueError(f'{name} must be between {low} and {high}')
+    return number
+
+
+def validate_setting(name, value):
+    """The profiler setting as used, numbers coerced; ValueError if it isn't valid."""
+    if name == 'sample_rate':
+        return _number(name, value, 0, 1)
+    if name == 'interval_ms':
+        return _number(name, value, 1, 1000)
+    if name == 'min_duration_ms':
+        return _number(name, value, 0)
+    if name == 'endpoints':
+        if not isinstance(value, list) or not all(isinstance(endpoint, str) for endpoint in value):
+            raise ValueError('endpoints must be a list of endpoint names')
+        return value
+    if name == 'format':
+        if value not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        return value
+    raise ValueError(f'unknown setting {name}')
+
+
+class StackSampler:
+    """Sample one thread's Python stack every interval seconds from a helper thread."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append((tuple(stack), now - last))
+            last = now
+
+
+def _short_path(filename):
+    return '/'.join(filename.replace('\\', '/').split('/')[-2:])
+
+
+def collapsed(samples):
+    """Folded stacks ('root;caller;callee count' per line), as read by flamegraph.pl and speedscope."""
+    counts = {}
+    for stack, _ in samples:
+        key = ';'.join(f'{name} ({_short_path(filename)}:{line})' for name, filename, line in stack)
+        counts[key] = counts.get(key, 0) + 1
+    return ''.join(f'{stack} {count}\n' for stack, count in counts.items())
+
+
+def speedscope(samples, name, duration):
+    """A speedscope 'sampled' profile."""
+    frames = []
+    index = {}
+    stacks = []
+    for stack, _ in samples:
+        ids = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+            ids.append(index[frame])
+        stacks.append(ids)
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': duration,
+            'samples': stacks,
+            'weights': [weight for _, weight in samples],
+        }],
+        'name': name,
+        'exporter': 'wandermate',
+    }
+
+
+class Profiler:
+    """Opt-in sampling profiler for a share of requests, optionally limited to some endpoints.
+
+    Settings start from config and can be changed at runtime through
+    /admin/profiling, which writes them to profiling.json in PROFILE_DIR so
+    every worker process picks them up.
+    """
+
+    def __init__(self, app=None):
+        self.directory = 'instance/profiles'
+        self.max_files = 200
+        self.defaults = {}
+        self._settings = {}
+        self._settings_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.directory = config.get('PROFILE_DIR', self.directory)
+        self.max_files = config.get('PROFILE_MAX_FILES', self.max_files)
+        self.defaults = {
+            'sample_rate': config.get('PROFILE_SAMPLE_RATE', 0.0),
+            'endpoints': config.get('PROFILE_ENDPOINTS', []),
+            'format': config.get('PROFILE_FORMAT', 'collapsed'),
+            'interval_ms': config.get('PROFILE_INTERVAL_MS', 5),
+            'min_duration_ms': config.get('PROFILE_MIN_DURATION_MS', 0),
+        }
+        self._settings = dict(self.defaults)
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.extensions['profiler'] = self
+
+    def settings(self):
+        """Current settings, re-read from profiling.json at most once a second."""
+        now = time.monotonic()
+        if now - self._checked_at < 1.0:
+            return self._settings
+        with self._lock:
+            self._checked_at = now
+            path = os.path.join(self.directory, SETTINGS_FILE)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self._settings_mtime:
+                self._settings = dict(self.defaults)
+                if mtime is not None:
+                    try:
+                        with open(path, encoding='utf-8') as f:
+                            saved = json.load(f)
+                    except (OSError, ValueError):
+                        saved = {}
+                    # A value edited into the file by hand that isn't valid keeps its default
+                    for name, value in (saved.items() if isinstance(saved, dict) else ()):
+                        if name in self.defaults:
+                            try:
+                                self._settings[name] = validate_setting(name, value)
+                            except ValueError:
+                                pass
+                self._settings_mtime = mtime
+        return self._settings
+
+    def update_settings(self, changes):
+        """Merge changes into the runtime settings shared by all worker processes."""
+        if not isinstance(changes, dict):
+            raise ValueError('settings must be a JSON object')
+        settings = dict(self.settings())
+        settings.update({key: validate_setting(key, value) for key, value in changes.items()
+                         if key in self.defaults})
+        path = os.path.join(self.directory, SETTINGS_FILE)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(settings, f)
+        os.replace(tmp, path)
+        self._checked_at = 0.0
+        return self.settings()
+
+    def _start(self):
+        settings = self.settings()
+        if settings['sample_rate'] <= 0:
+            return
+        if settings['endpoints'] and request.endpoint not in settings['endpoints']:
+            return
+        if random.random() >= settings['sample_rate']:
+            return
+        g.profiler = StackSampler(threading.get_ident(), settings['interval_ms'] / 1000).start()
+        g.profiler_started = time.perf_counter()
+
+    def _finish(self, response):
+        sampler = g.pop('profiler', None)
+        if sampler is None:
+            return response
+        samples = sampler.stop()
+        duration = time.perf_counter() - g.profiler_started
+        settings = self.settings()
+        if samples and duration * 1000 >= settings['min_duration_ms']:
+            trip_id = (request.view_args or {}).get('trip_id', 'none')
+            self._write(samples, request.endpoint or 'unmatched', trip_id, duration, settings['format'])
+        return response
+
+    def _write(self, samples, endpoint, trip_id, duration, fmt):
+        name = f"{int(time.time() * 1000)}_{endpoint}_{trip_id}_{int(duration * 1000)}ms{FORMATS[fmt]}"
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            if fmt == 'speedscope':
+                json.dump(speedscope(samples, f'{endpoint} {trip_id}', duration), f)
+            else:
+                f.write(collapsed(samples))
+        self._trim()
+
+    def _trim(self):
+        profiles = sorted(self.profiles(), key=lambda p: p['captured_at'])
+        for profile in profiles[:max(0, len(profiles) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.directory, profile['file']))
+            except OSError:
+                pass
+
+    def profiles(self):
+        """Metadata of the captured profiles, parsed from their file names."""
+        found = []
+        for entry in os.scandir(self.directory):
+            match = _PROFILE_NAME.match(entry.name)
+            if match:
+                captured_at, endpoint, trip_id, duration_ms, _ = match.groups()
+                found.append({
+                    'file': entry.name,
+                    'endpoint': endpoint,
+                    'trip_id': None if trip_id == 'none' else int(trip_id),
+                    'duration_ms': int(duration_ms),
+                    'captured_at': int(captured_at) / 1000,
+                })
+        return found
+
+    def slowest(self, limit=20, endpoint=None):
+        profiles = [p for p in self.profiles() if endpoint is None or p['endpoint'] == endpoint]
+        return sorted(profiles, key=lambda p: p['duration_ms'], reverse=True)[:limit]
+
+
+profiler = Profiler()
@@ -0,0 +1,280 @@
+from datetime import timedelta
+import json
+
+from schema import schema_example, section_schema
+
+
+def itinerary_rules(number_of_days, plan_days=None):
+    """Content rules shared by the skeleton and structured-output prompts.
+
+    plan_days=(first, last) limits the daily sections to that day range of a
+    long trip whose other days are generated separately.
+    """
+    if plan_days is None:
+        daily_scope = f"one object per day (total {number_of_days} days)"
+    else:
+        daily_scope = (f"one object per day for Day {plan_days[0]} to Day {plan_days[1]} only "
+                       f"(the trip has {number_of_days} days; daily_plan also covers only these days and the others are planned separately)")
+    return f"""Rules:
+    - Always respond with valid JSON only.
+    - Fill all fields based on input data (destination, dates, budget, mood).
+    - Risk alert and overcrowd level must match seasonal logic (e.g., high crowd in summer for popular destinations).
+    - Hotel recommendations should align with the budget and mood.
+    - Adjust destination recommendations and activities based on the selected mood.
+    - Budget figures (percentages, costs, daily spends and category breakdowns) are calculated separately from the mood. Only write the budget text: an overview of whether the budget suits the mood and trip duration, one suggestion per budget category and optimization tips, without quoting amounts.
+    - For daily_budget_plan, create an array with {daily_scope}, each with a brief activities summary and practical recommendations.
+    - Ensure the JSON is valid and complete.
+    """.strip()
+
+
+def build_itinerary_prompt(destination, start_date, end_date, travelers, budget, mood, preferences, number_of_days, plan_days=None):
+    """Build the Gemini prompt for a full itinerary."""
+    return f"""
+    Create a detailed travel itinerary for a trip to {destination} from {start_date} to {end_date}.
+    Number of travelers: {travelers}
+    Budget: ${budget}
+    Mood: {mood}
+    Special preferences: {preferences}
+    Number of days: {number_of_days}
+
+    Respond ONLY with a valid JSON object in the following exact format. Do not include any additional text, explanations, or markdown formatting:
+    {{
+      "trip_summary": {{
+        "destination": "{destination}",
+        "dates": "{start_date} to {end_date}",
+        "travelers": "{travelers}",
+        "budget": "${budget}",
+        "mood": "{mood}",
+        "overall_theme": "Brief description based on mood and preferences"
+      }},
+      "trending_places": [
+        {{
+          "place": "Popular Destination 1",
+          "description": "Brief description of the place",
+          "rating": "4.5",
+          "image_url": "https://example.com/image1.jpg"
+        }},
+        {{
+          "place": "Popular Destination 2",
+          "description": "Brief description of the place",
+          "rating": "4.7",
+          "image_url": "https://example.com/image2.jpg"
+        }},
+        {{
+          "place": "Popular Destination 3",
+          "description": "Brief description of the place",
+          "rating": "4.3",
+          "image_url": "https://example.com/image3.jpg"
+        }},
+        {{
+          "place": "Popular Destination 4",
+          "description": "Brief description of the place",
+          "rating": "4.6",
+          "image_url": "https://example.com/image4.jpg"
+        }}
+      ],
+      "risk_alert": {{
+        "level": "Low",
+        "details": "Brief safety and weather risk assessment"
+      }},
+      "hotel_recommendations": [
+        {{
+          "name": "Hotel Name 1",
+          "price_range": "$100-150/night",
+          "rating": "4.2",
+          "highlight": "Key feature or amenity"
+        }},
+        {{
+          "name": "Hotel Name 2",
+          "price_range": "$150-200/night",
+          "rating": "4.5",
+          "highlight": "Key feature or amenity"
+        }},
+        {{
+          "name": "Hotel Name 3",
+          "price_range": "$200-250/night",
+          "rating": "4.8",
+          "highlight": "Key feature or amenity"
+        }},
+        {{
+          "name": "Hotel Name 4",
+          "price_range": "$250-300/night",
+          "rating": "4.6",
+          "highlight": "Key feature or amenity"
+        }},
+        {{
+          "name": "Hotel Name 5",
+          "price_range": "$300-350/night",
+          "rating": "4.9",
+          "highlight": "Key feature or amenity"
+        }}
+      ],
+      "overcrowd_predictor": {{
+        "level": "Medium",
+        "reason": "Explanation based on season and dates"
+      }},
+      "quick_insights": [
+        "Insight 1: Key attraction or activity",
+        "Insight 2: Another key point",
+        "Insight 3: Additional insight"
+      ],
+      "daily_plan": {{
+        "Day 1": "Detailed activities for Day 1",
+        "Day 2": "Detailed activities for Day 2"
+      }},
+      "important_notes": [
+        "Note 1: Important tip or warning",
+        "Note 2: Another note"
+      ],
+      "daily_budget_plan": [
+        {{
+          "day": "Day 1",
+          "activities": "Brief summary of activities for Day 1",
+          "recommendations": "Practical daily recommendations"
+        }},
+        {{
+          "day": "Day 2",
+          "activities": "Brief summary of activities for Day 2",
+          "recommendations": "Practical daily recommendations"
+        }}
+      ],
+      "budget_tracking": {{
+        "overview": "Summarize whether the user's total budget is sufficient for their selected mood and trip duration.",
+        "distribution_table": [
+          {{
+            "category": "Accommodation",
+            "suggestions": "e.g., choose 3-star hotels or local stays to optimize."
+          }},
+          {{
+            "category": "Food",
+            "suggestions": "e.g., explore local street food to save."
+          }},
+          {{
+            "category": "Transport",
+            "suggestions": "e.g., use metro or shared rides instead of taxis."
+          }},
+          {{
+            "category": "Activities",
+            "suggestions": "e.g., combine sightseeing passes or free attractions."
+          }},
+          {{
+            "category": "Miscellaneous",
+            "suggestions": "e.g., keep buffer for souvenirs or emergencies."
+          }}
+        ],
+        "optimization_tips": [
+          "List practical recommendations to make the most of the user's budget.",
+          "If budget is high, suggest upgrades or luxury add-ons.",
+          "If budget is low, suggest free or low-cost experiences."
+        ]
+      }}
+    }}
+
+    {itinerary_rules(number_of_days, plan_days)}
+    """
+
+
+def build_structured_prompt(destination, start_date, end_date, travelers, budget, mood, preferences, number_of_days, plan_days=None):
+    """Build the prompt for structured-output mode; the response schema replaces the JSON skeleton."""
+    return f"""
+    Create a detailed travel itinerary for a trip to {destination} from {start_date} to {end_date}.
+    Number of travelers: {travelers}
+    Budget: ${budget}
+    Mood: {mood}
+    Special preferences: {preferences}
+    Number of days: {number_of_days}
+
+    Fill every field of the response schema.
+
+    {itinerary_rules(number_of_days, plan_days)}
+    """
+
+
+def build_days_prompt(destination, start_date, end_date, travelers, budget, mood, preferences, number_of_days,
+                      first_day, last_day, structured=False):
+    """Build the prompt for one later day range of a long trip (daily sections only)."""
+    range_start = start_date + timedelta(days=first_day - 1)
+    range_end = start_date + timedelta(days=last_day - 1)
+    if structured:
+        response_format = "Fill every field of the response schema."
+    else:
+        response_format = f"""Respond ONLY with a valid JSON object in the following exact format. Do not include any additional text, explanations, or markdown formatting:
+    {{
+      "daily_plan": {{
+        "Day {first_day}": "Detailed activities for Day {first_day}"
+      }},
+      "daily_budget_plan": [
+        {{
+          "day": "Day {first_day}",
+          "activities": "Brief summary of activities for Day {first_day}",
+          "recommendations": "Practical daily recommendations"
+        }}
+      ]
+    }}"""
+    return f"""
+    Continue a detailed travel itinerary for a trip to {destination} from {start_date} to {end_date}.
+    Number of travelers: {travelers}
+    Budget: ${budget}
+    Mood: {mood}
+    Special preferences: {preferences}
+    Number of days: {number_of_days}
+
+    Plan only Day {first_day} to Day {last_day} ({range_start} to {range_end}). The other days of this trip are
+    planned separately, so spread the destination's sights across the whole trip instead of repeating the
+    best-known highlights, and only plan the departure if Day {number_of_days} is in this range.
+
+    {response_format}
+
+    Rules:
+    - Always respond with valid JSON only.
+    - daily_plan and daily_budget_plan must contain exactly one entry per day from Day {first_day} to Day {last_day}.
+    - Adjust activities to the selected mood and special preferences.
+    - Daily spends are calculated separately; only write each day's activities summary and recommendations.
+    """
+
+
+def _known_context(known):
+    """Lines naming what the already written sections recommend, so the new ones build on them."""
+    lines = []
+    places = [place.get('place') for place in known.get('trending_places') or [] if place.get('place')]
+    if places:
+        lines.append(f"Trending places already recommended: {', '.join(places)}.")
+    hotels = [hotel.get('name') for hotel in known.get('hotel_recommendations') or [] if hotel.get('name')]
+    if hotels:
+        lines.append(f"Hotels already recommended: {', '.join(hotels)}.")
+    for name in ('risk_alert', 'overcrowd_predictor'):
+        level = (known.get(name) or {}).get('level')
+        if level:
+            lines.append(f"{name.replace('_', ' ').capitalize()} level: {level}.")
+    return '\n    '.join(lines)
+
+
+def build_sections_prompt(destination, start_date, end_date, travelers, budget, mood, preferences, number_of_days,
+                          sections, structured=False, plan_days=None, known=None):
+    """Build the prompt for a subset of the itinerary sections.
+
+    plan_days limits the daily sections to a day range, as in itinerary_rules;
+    known holds sections written earlier (e.g. from the destination cache)
+    for the new sections to build on.
+    """
+    if structured:
+        response_format = "Fill every field of the response schema."
+    else:
+        example = json.dumps(schema_example(section_schema(sections)), indent=2)
+        response_format = ("Respond ONLY with a valid JSON object in the following exact format. "
+                           "Do not include any additional text, explanations, or markdown formatting:\n" + example)
+    return f"""
+    Create part of a detailed travel itinerary for a trip to {destination} from {start_date} to {end_date}.
+    Number of travelers: {travelers}
+    Budget: ${budget}
+    Mood: {mood}
+    Special preferences: {preferences}
+    Number of days: {number_of_days}
+
+    Only write these sections: {', '.join(sections)}. The other sections are written separately.
+    {_known_context(known or {})}
+
+    {response_format}
+
+    {itinerary_rules(number_of_days, plan_days)}
+    """
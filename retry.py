@@ -0,0 +1,229 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+
+import httpx
+
+# HTTP codes and Google RPC statuses worth another attempt
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_STATUSES = {'RESOURCE_EXHAUSTED', 'UNAVAILABLE', 'DEADLINE_EXCEEDED', 'INTERNAL'}
+
+
+class ModelsUnavailable(Exception):
+    """Raised when no model produced a response within the retry budget."""
+
+    def __init__(self, message='All Gemini models are currently unavailable. Please try again in a moment.'):
+        super().__init__(message)
+
+
+def is_retryable(error):
+    """Decide from the error code/status whether another attempt may succeed."""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code in RETRYABLE_CODES or getattr(error, 'status', None) in RETRYABLE_STATUSES
+    # Transport failures never reached the API
+    return isinstance(error, (httpx.TimeoutException, httpx.NetworkError, ConnectionError, TimeoutError))
+
+
+def is_rate_limited(error):
+    """True for upstream quota errors (429 / RESOURCE_EXHAUSTED)."""
+    return getattr(error, 'code', None) == 429 or getattr(error, 'status', None) == 'RESOURCE_EXHAUSTED'
+
+
+class CircuitBreaker:
+    """Per-model breaker: opens after consecutive failures and lets one probe through after a cool-off."""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call to this model may be attempted now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """Give back a half-open probe whose call never reached the model, leaving the state as it is."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+class CircuitBreakerRegistry:
+    """Process-wide breakers, one per model name."""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, failure_threshold=5, reset_timeout=30.0):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+            return breaker
+
+    def states(self):
+        with self._lock:
+            return {name: breaker.state for name, breaker in self._breakers.items()}
+
+
+class RetryScheduler:
+    """Run callables after a delay on a small thread pool; nothing sleeps while waiting."""
+
+    def __init__(self, max_workers=16, name='gemini-call'):
+        self.max_workers = max_workers
+        self.name = name
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = None
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+            self._thread = threading.Thread(target=self._loop, name='retry-scheduler', daemon=True)
+            self._thread.start()
+
+    def call_later(self, delay, fn, *args):
+        with self._cond:
+            self._ensure_started()
+            heapq.heappush(self._heap, (time.monotonic() + max(delay, 0), next(self._seq), fn, args))
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                _, _, fn, args = heapq.heappop(self._heap)
+            try:
+                self._executor.submit(fn, *args)
+            except RuntimeError:
+                # The executor was shut down with the interpreter (e.g. a worker exiting)
+                return
+
+
+class RetryPolicy:
+    """Attempt limits, full-jitter backoff and an overall deadline for one logical call."""
+
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=20.0, deadline=90.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt):
+        """Full jitter: uniform between 0 and the capped exponential delay."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def _settle(future, result=None, error=None):
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass  # the caller already gave up on this call
+
+
+def run_with_retry(call, models, policy, breakers, scheduler, breaker_options=None):
+    """Start call(model_name) with retries and model fallback; returns a Future.
+
+    Backoff waits are scheduled on scheduler rather than slept, models whose
+    breaker is open are skipped, and the Future fails once policy.deadline
+    would be exceeded.
+    """
+    future = Future()
+    deadline = time.monotonic() + policy.deadline
+    breaker_options = breaker_options or {}
+    state = {'model': 0, 'attempt': 0}
+
+    def attempt():
+        if future.done():
+            return
+        while state['model'] < len(models):
+            breaker = breakers.get(models[state['model']], **breaker_options)
+            if breaker.allow():
+                break
+            state['model'] += 1
+            state['attempt'] = 0
+        else:
+            _settle(future, error=ModelsUnavailable())
+            return
+
+        model_name = models[state['model']]
+        try:
+            result = call(model_name)
+        except Exception as e:
+            if not is_retryable(e):
+                if isinstance(getattr(e, 'code', None), int):
+                    breaker.record_success()  # the model answered; the request itself is bad
+                else:
+                    # Failed before any upstream answer (admission, replay): nothing learnt about the model
+                    breaker.release()
+                _settle(future, error=e)
+                return
+            breaker.record_failure()
+            retry_later()
+            return
+        breaker.record_success()
+        _settle(future, result=result)
+
+    def retry_later():
+        state['attempt'] += 1
+        if state['attempt'] < policy.max_attempts:
+            delay = policy.backoff(state['attempt'])
+        else:
+            state['model'] += 1
+            state['attempt'] = 0
+            delay = 0
+        if state['model'] >= len(models) or time.monotonic() + delay >= deadline:
+            _settle(future, error=ModelsUnavailable())
+            return
+        scheduler.call_later(delay, attempt)
+
+    scheduler.call_later(0, attempt)
+    return future
+
+
+breakers = CircuitBreakerRegistry()
+scheduler = RetryScheduler()
+# Batch attempts wait for admission on threads of their own, so they never hold
+# the threads interactive attempts need to reach the admission queue
+batch_scheduler = RetryScheduler(max_workers=4, name='gemini-batch-call')
@@ -1,7 +1,22 @@
-from flask import render_template, request, jsonify, flash, redirect, url_for, send_file
+from flask import render_template, request, jsonify, flash, redirect, url_for, send_file, send_from_directory, Response, stream_with_context, abort
 from app import app, db
-from models import Trip
-from google import genai
+from models import Trip, GenerationJob
+from pipeline import GenerationError, cached_itinerary, save_trip
+from jobs import enqueue_job, queue_position, iter_job_events, job_timing
+from itinerary_store import load_itinerary, delete_rows
+from search import search_trips, unindex_trip
+from cache import itinerary_cache, destination_cache
+from retry import breakers
+from hedging import hedge_stats
+from limiter import admission
+from budget import BudgetPlan, format_money
+from metrics import metrics, PDF_RENDER_LATENCY
+import timing
+import tracing
+from profiling import profiler
+from prewarm import prewarmer
+import hmac
+import os
 from datetime import datetime
 import io
 from reportlab.pdfgen import canvas
@@ -9,40 +24,8 @@ from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 from reportlab.lib import colors
-import re
 import json
-import time
-
-# Configure Gemini API
-client = genai.Client(api_key=app.config['GEMINI_API_KEY'])
-
-# Models to try in order (primary → fallback)
-GEMINI_MODELS = ['gemini-2.5-flash', 'gemini-1.5-flash']
-
-def generate_with_retry(prompt, max_retries=3, initial_delay=5):
-    """Call Gemini API with exponential backoff retry and model fallback."""
-    for model_name in GEMINI_MODELS:
-        delay = initial_delay
-        for attempt in range(max_retries):
-            try:
-                response = client.models.generate_content(
-                    model=model_name,
-                    contents=prompt
-                )
-                return response
-            except Exception as e:
-                err_str = str(e)
-                is_retryable = '503' in err_str or '429' in err_str or 'UNAVAILABLE' in err_str or 'RESOURCE_EXHAUSTED' in err_str
-                if is_retryable and attempt < max_retries - 1:
-                    time.sleep(delay)
-                    delay *= 2  # exponential backoff
-                elif is_retryable and attempt == max_retries - 1:
-                    break  # try next model
-                else:
-                    raise  # non-retryable error, raise immediately
-    raise Exception('All Gemini models are currently unavailable. Please try again in a moment.')
-
-
+from sqlalchemy.orm import defer
 
 @app.route('/')
 def index():
@@ -67,269 +50,115 @@ def generate_itinerary():
     mood = request.form.get('mood', '')
     preferences = request.form.get('preferences', '')
 
+    # Every response carries the id that the logs and trace spans of this request use
+    request_id = tracing.request_id()
+
     # Server-side validation
     errors = []
-    try:
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-        travelers = int(travelers_str)
-        budget = float(budget_str)
-    except ValueError:
-        errors.append('Invalid date, number, or budget format.')
-
-    today = datetime.now().date()
-    if start_date < today:
-        errors.append('Start date cannot be in the past.')
-    if end_date <= start_date:
-        errors.append('End date must be after start date.')
-    if travelers < 1:
-        errors.append('Number of travelers must be at least 1.')
-    if budget <= 0:
-        errors.append('Budget must be greater than 0.')
+    with tracing.span('validate') as span:
+        try:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+            travelers = int(travelers_str)
+            budget = float(budget_str)
+        except ValueError:
+            errors.append('Invalid date, number, or budget format.')
+
+        today = datetime.now().date()
+        if start_date < today:
+            errors.append('Start date cannot be in the past.')
+        if end_date <= start_date:
+            errors.append('End date must be after start date.')
+        if travelers < 1:
+            errors.append('Number of travelers must be at least 1.')
+        if budget <= 0:
+            errors.append('Budget must be greater than 0.')
+        span.set_attribute('validation.errors', len(errors))
 
     if errors:
-        return jsonify({'error': errors[0]}), 400
-
-    # Calculate number of days
-    number_of_days = (end_date - start_date).days + 1
-
-    # Generate itinerary using Gemini AI
-    prompt = f"""
-    Create a detailed travel itinerary for a trip to {destination} from {start_date} to {end_date}.
-    Number of travelers: {travelers}
-    Budget: ${budget}
-    Mood: {mood}
-    Special preferences: {preferences}
-    Number of days: {number_of_days}
-
-    Respond ONLY with a valid JSON object in the following exact format. Do not include any additional text, explanations, or markdown formatting:
-    {{
-      "trip_summary": {{
-        "destination": "{destination}",
-        "dates": "{start_date} to {end_date}",
-        "travelers": "{travelers}",
-        "budget": "${budget}",
-        "mood": "{mood}",
-        "overall_theme": "Brief description based on mood and preferences"
-      }},
-      "trending_places": [
-        {{
-          "place": "Popular Destination 1",
-          "description": "Brief description of the place",
-          "rating": "4.5",
-          "image_url": "https://example.com/image1.jpg"
-        }},
-        {{
-          "place": "Popular Destination 2",
-          "description": "Brief description of the place",
-          "rating": "4.7",
-          "image_url": "https://example.com/image2.jpg"
-        }},
-        {{
-          "place": "Popular Destination 3",
-          "description": "Brief description of the place",
-          "rating": "4.3",
-          "image_url": "https://example.com/image3.jpg"
-        }},
-        {{
-          "place": "Popular Destination 4",
-          "description": "Brief description of the place",
-          "rating": "4.6",
-          "image_url": "https://example.com/image4.jpg"
-        }}
-      ],
-      "risk_alert": {{
-        "level": "Low",
-        "details": "Brief safety and weather risk assessment"
-      }},
-      "hotel_recommendations": [
-        {{
-          "name": "Hotel Name 1",
-          "price_range": "$100-150/night",
-          "rating": "4.2",
-          "highlight": "Key feature or amenity"
-        }},
-        {{
-          "name": "Hotel Name 2",
-          "price_range": "$150-200/night",
-          "rating": "4.5",
-          "highlight": "Key feature or amenity"
-        }},
-        {{
-          "name": "Hotel Name 3",
-          "price_range": "$200-250/night",
-          "rating": "4.8",
-          "highlight": "Key feature or amenity"
-        }},
-        {{
-          "name": "Hotel Name 4",
-          "price_range": "$250-300/night",
-          "rating": "4.6",
-          "highlight": "Key feature or amenity"
-        }},
-        {{
-          "name": "Hotel Name 5",
-          "price_range": "$300-350/night",
-          "rating": "4.9",
-          "highlight": "Key feature or amenity"
-        }}
-      ],
-      "overcrowd_predictor": {{
-        "level": "Medium",
-        "reason": "Explanation based on season and dates"
-      }},
-      "quick_insights": [
-        "Insight 1: Key attraction or activity",
-        "Insight 2: Another key point",
-        "Insight 3: Additional insight"
-      ],
-      "daily_plan": {{
-        "Day 1": "Detailed activities for Day 1",
-        "Day 2": "Detailed activities for Day 2"
-      }},
-      "important_notes": [
-        "Note 1: Important tip or warning",
-        "Note 2: Another note"
-      ],
-      "daily_budget_plan": [
-        {{
-          "day": "Day 1",
-          "activities": "Brief summary of activities for Day 1",
-          "estimated_spend": "$X",
-          "category_breakdown": {{
-            "Accommodation": "$X",
-            "Food": "$X",
-            "Transport": "$X",
-            "Activities": "$X",
-            "Miscellaneous": "$X"
-          }},
-          "recommendations": "Practical daily recommendations"
-        }},
-        {{
-          "day": "Day 2",
-          "activities": "Brief summary of activities for Day 2",
-          "estimated_spend": "$X",
-          "category_breakdown": {{
-            "Accommodation": "$X",
-            "Food": "$X",
-            "Transport": "$X",
-            "Activities": "$X",
-            "Miscellaneous": "$X"
-          }},
-          "recommendations": "Practical daily recommendations"
-        }}
-      ],
-      "budget_tracking": {{
-        "overview": "Summarize whether the user's total budget is sufficient for their selected mood and trip duration.",
-        "distribution_table": [
-          {{
-            "category": "Accommodation",
-            "percentage": "",
-            "estimated_cost": "",
-            "suggestions": "e.g., choose 3-star hotels or local stays to optimize."
-          }},
-          {{
-            "category": "Food",
-            "percentage": "",
-            "estimated_cost": "",
-            "suggestions": "e.g., explore local street food to save."
-          }},
-          {{
-            "category": "Transport",
-            "percentage": "",
-            "estimated_cost": "",
-            "suggestions": "e.g., use metro or shared rides instead of taxis."
-          }},
-          {{
-            "category": "Activities",
-            "percentage": "",
-            "estimated_cost": "",
-            "suggestions": "e.g., combine sightseeing passes or free attractions."
-          }},
-          {{
-            "category": "Miscellaneous",
-            "percentage": "",
-            "estimated_cost": "",
-            "suggestions": "e.g., keep buffer for souvenirs or emergencies."
-          }}
-        ],
-        "optimization_tips": [
-          "List practical recommendations to make the most of the user's budget.",
-          "If budget is high, suggest upgrades or luxury add-ons.",
-          "If budget is low, suggest free or low-cost experiences."
-        ]
-      }}
-    }}
-
-    Rules:
-    - Always respond with valid JSON only.
-    - Fill all fields based on input data (destination, dates, budget, mood).
-    - Risk alert and overcrowd level must match seasonal logic (e.g., high crowd in summer for popular destinations).
-    - Hotel recommendations should align with the budget and mood.
-    - Adjust destination recommendations and activities based on the selected mood.
-    - For budget_tracking, use the following percentages based on mood:
-      - Relaxed: Accommodation 35%, Food 25%, Transport 20%, Activities 15%, Miscellaneous 5%
-      - Adventurous: Accommodation 25%, Food 20%, Transport 20%, Activities 30%, Miscellaneous 5%
-      - Romantic: Accommodation 40%, Food 25%, Transport 10%, Activities 20%, Miscellaneous 5%
-      - Cultural: Accommodation 30%, Food 25%, Transport 20%, Activities 20%, Miscellaneous 5%
-      - Budget-Friendly: Accommodation 20%, Food 30%, Transport 25%, Activities 15%, Miscellaneous 10%
-    - Calculate estimated_cost as percentage of total budget, ensuring total estimated costs do not exceed the budget.
-    - Provide realistic estimated_cost values with currency symbols (e.g., "$120").
-    - For daily_budget_plan, create an array with one object per day (total {number_of_days} days). Each day's estimated_spend should sum approximately to total_budget / {number_of_days}. Use the same mood-based percentages for category_breakdown. Include brief activities summary and practical recommendations.
-    - Ensure the JSON is valid and complete.
-    """
+        return jsonify({'error': errors[0], 'request_id': request_id}), 400
+
+    params = {
+        'destination': destination,
+        'start_date': start_date,
+        'end_date': end_date,
+        'travelers': travelers,
+        'budget': budget,
+        'mood': mood,
+        'preferences': preferences,
+    }
 
     try:
-        response = generate_with_retry(prompt)
-        itinerary_json = response.text.strip()
-
-        # Clean the response to extract JSON (remove markdown code blocks if present)
-        itinerary_json = re.sub(r'```json\s*', '', itinerary_json)
-        itinerary_json = re.sub(r'```\s*', '', itinerary_json)
-        itinerary_json = itinerary_json.strip()
-
-        # Parse the JSON response
-        try:
-            data = json.loads(itinerary_json)
-        except json.JSONDecodeError:
-            # Fallback if JSON parsing fails
-            return jsonify({'error': 'Error parsing AI response. Please try again.'}), 500
-
-        # Extract structured data
-        summary = data.get('trip_summary', {})
-        trending = data.get('trending_places', [])
-        risk = data.get('risk_alert', {})
-        hotels = data.get('hotel_recommendations', [])
-        crowd = data.get('overcrowd_predictor', {})
-        insights = data.get('quick_insights', [])
-        daily_plan = data.get('daily_plan', {})
-        notes = data.get('important_notes', [])
-        daily_budget_plan = data.get('daily_budget_plan', [])
-        budget_tracking = data.get('budget_tracking', {})
-
-        # Save trip to database (store the full JSON as itinerary)
-        trip = Trip(
-            destination=destination,
-            start_date=start_date,
-            end_date=end_date,
-            travelers=travelers,
-            budget=budget,
-            mood=mood,
-            preferences=preferences,
-            itinerary=json.dumps(data)  # Store structured data as JSON string
-        )
-        db.session.add(trip)
-        db.session.commit()
-
-        return jsonify({'trip_id': trip.id})
-
+        # Repeat requests are answered straight from the cache
+        with timing.stage('cache'), tracing.span('cache.lookup') as span:
+            data = cached_itinerary(params)
+            span.set_attribute('cache.hit', data is not None)
+        if data is not None:
+            with timing.stage('db', 'save trip'):
+                trip = save_trip(params, data)
+            return jsonify({'trip_id': trip.id, 'request_id': request_id})
+
+        with timing.stage('db', 'enqueue'):
+            job = enqueue_job(params, server_timing=timing.current() is not None)
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'queue_position': queue_position(job),
+            'request_id': request_id
+        }), 202
+
+    except GenerationError as e:
+        return jsonify({'error': str(e), 'request_id': request_id}), 500
     except Exception as e:
-        return jsonify({'error': f'Error generating itinerary: {str(e)}'}), 500
+        return jsonify({'error': f'Error generating itinerary: {str(e)}', 'request_id': request_id}), 500
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = GenerationJob.query.get_or_404(job_id)
+    result = job.to_dict()
+    result['queue_position'] = queue_position(job)
+    response = jsonify(result)
+    stages = job_timing(job_id) if timing.current() is not None and job.status == 'done' else None
+    if stages:
+        # How the job itself spent its time: model attempts, backoff, saving
+        response.headers['Server-Timing'] = timing.format_header(stages)
+    return response
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-Sent Events feed of partial itinerary sections for a job."""
+    GenerationJob.query.get_or_404(job_id)
+    # Browsers send Last-Event-ID when they reconnect; a reopened stream passes it in the URL
+    last_event_id = (request.headers.get('Last-Event-ID', type=int)
+                     or request.args.get('last_event_id', type=int) or 0)
+    timeout = app.config['GENERATION_STREAM_TIMEOUT']
+
+    def stream():
+        for event_id, event, payload in iter_job_events(job_id, last_event_id, timeout=timeout):
+            message = f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+            if event_id is not None:
+                message = f"id: {event_id}\n" + message
+            yield message
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _trip_or_404(trip_id):
+    """The trip without its itinerary JSON, which is only loaded if it is used."""
+    trip = db.session.get(Trip, trip_id, options=[defer(Trip.itinerary)])
+    if trip is None:
+        abort(404)
+    return trip
 
 @app.route('/dashboard/<int:trip_id>')
 def dashboard(trip_id):
-    trip = Trip.query.get_or_404(trip_id)
-    trip_data = json.loads(trip.itinerary)
+    with timing.stage('db'):
+        trip = _trip_or_404(trip_id)
+        trip_data = load_itinerary(trip_id)
+    if trip_data is None:
+        # Saved before the itinerary tables and not backfilled yet
+        with timing.stage('decode'):
+            trip_data = json.loads(trip.itinerary)
 
     summary = trip_data.get('trip_summary', {})
     trending = trip_data.get('trending_places', [])
@@ -343,46 +172,109 @@ def dashboard(trip_id):
     budget_tracking = trip_data.get('budget_tracking', {})
 
     # Budget tracking logic
-    total_budget = trip.budget
-    mood = trip.mood.lower()
-    mood_percentages = {
-        'relaxed': {'accommodation': 0.35, 'food': 0.25, 'transport': 0.20, 'activities': 0.15, 'misc': 0.05},
-        'adventurous': {'accommodation': 0.25, 'food': 0.20, 'transport': 0.20, 'activities': 0.30, 'misc': 0.05},
-        'romantic': {'accommodation': 0.40, 'food': 0.25, 'transport': 0.10, 'activities': 0.20, 'misc': 0.05},
-        'cultural': {'accommodation': 0.30, 'food': 0.25, 'transport': 0.20, 'activities': 0.20, 'misc': 0.05},
-        'budget-friendly': {'accommodation': 0.20, 'food': 0.30, 'transport': 0.25, 'activities': 0.15, 'misc': 0.10}
-    }
-    percentages = mood_percentages.get(mood, mood_percentages['relaxed'])
-    budget_data = []
-    for cat, perc in percentages.items():
-        cost = total_budget * perc
-        budget_data.append({
-            'category': cat.capitalize(),
-            'percentage': f"{perc * 100:.0f}%",
-            'cost': f"${cost:.2f}"
-        })
-
-    return render_template(
-        'dashboard.html',
-        itinerary=json.dumps(trip_data),
-        trip_id=trip.id,
-        summary=summary,
-        trending=trending,
-        risk=risk,
-        hotels=hotels,
-        crowd=crowd,
-        insights=insights,
-        daily_plan=daily_plan,
-        notes=notes,
-        daily_budget_plan=daily_budget_plan,
-        budget_data=budget_data,
-        budget_tracking=budget_tracking
-    )
+    with timing.stage('budget'):
+        plan = BudgetPlan(trip.budget, (trip.end_date - trip.start_date).days + 1, trip.mood)
+        budget_data = [{
+            'category': category,
+            'percentage': f"{percent}%",
+            'cost': format_money(cents)
+        } for category, percent, cents in plan.distribution()]
+
+    with timing.stage('render'):
+        return render_template(
+            'dashboard.html',
+            trip_id=trip.id,
+            summary=summary,
+            trending=trending,
+            risk=risk,
+            hotels=hotels,
+            crowd=crowd,
+            insights=insights,
+            daily_plan=daily_plan,
+            notes=notes,
+            daily_budget_plan=daily_budget_plan,
+            budget_data=budget_data,
+            budget_tracking=budget_tracking
+        )
+
+def _trip_cursor(trip):
+    return f"{trip.created_at.isoformat()}_{trip.id}"
+
+def _trip_page(cursor, limit):
+    """Up to limit trips, newest first, after cursor; and the cursor of the next page (None on the last).
+
+    Pages are keyed on (created_at, id) rather than an offset, so each one is a
+    range scan of the created_at index however deep it is, and the itinerary
+    and preferences aren't read at all.
+    """
+    query = Trip.query.options(defer(Trip.itinerary), defer(Trip.preferences))
+    if cursor:
+        created_at, _, trip_id = cursor.rpartition('_')
+        try:
+            after = (datetime.fromisoformat(created_at), int(trip_id))
+        except ValueError:
+            abort(400)
+        query = query.filter(db.tuple_(Trip.created_at, Trip.id) < after)
+    trips = query.order_by(Trip.created_at.desc(), Trip.id.desc()).limit(limit + 1).all()
+    if len(trips) > limit:
+        return trips[:limit], _trip_cursor(trips[limit - 1])
+    return trips, None
+
+def _page_size():
+    return max(1, min(request.args.get('limit', app.config['TRIPS_PAGE_SIZE'], type=int), 100))
+
+# Each page of /trips and /search links to the next, and the infinite scroll
+# in script.js fetches the same page from /api/trips or /api/search.
 
 @app.route('/trips')
 def trips():
-    trips = Trip.query.order_by(Trip.created_at.desc()).all()
-    return render_template('trips.html', trips=trips)
+    with timing.stage('db'):
+        trips, next_cursor = _trip_page(request.args.get('cursor'), app.config['TRIPS_PAGE_SIZE'])
+    with timing.stage('render'):
+        return render_template(
+            'trips.html', trips=trips,
+            next_url=url_for('trips', cursor=next_cursor) if next_cursor else None,
+            next_api_url=url_for('api_trips', cursor=next_cursor) if next_cursor else None
+        )
+
+@app.route('/api/trips')
+def api_trips():
+    """Saved trips as JSON a page at a time, for the infinite scroll of /trips."""
+    with timing.stage('db'):
+        trips, next_cursor = _trip_page(request.args.get('cursor'), _page_size())
+    return jsonify({
+        'trips': [trip.to_summary_dict() for trip in trips],
+        'next_cursor': next_cursor,
+        'next': url_for('api_trips', cursor=next_cursor, limit=request.args.get('limit')) if next_cursor else None
+    })
+
+@app.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return redirect(url_for('trips'))
+    page = max(1, request.args.get('page', 1, type=int))
+    with timing.stage('db'):
+        trips, more = search_trips(query, page, app.config['TRIPS_PAGE_SIZE'])
+    with timing.stage('render'):
+        return render_template(
+            'trips.html', trips=trips, query=query,
+            next_url=url_for('search', q=query, page=page + 1) if more else None,
+            next_api_url=url_for('api_search', q=query, page=page + 1) if more else None
+        )
+
+@app.route('/api/search')
+def api_search():
+    """Saved trips matching ?q=, best match first (BM25), a ?page= at a time."""
+    query = request.args.get('q', '')
+    page = max(1, request.args.get('page', 1, type=int))
+    with timing.stage('db'):
+        trips, more = search_trips(query, page, _page_size())
+    return jsonify({
+        'trips': [trip.to_summary_dict() for trip in trips],
+        'next_page': page + 1 if more else None,
+        'next': url_for('api_search', q=query, page=page + 1, limit=request.args.get('limit')) if more else None
+    })
 
 @app.route('/trip/<int:trip_id>')
 def trip_detail(trip_id):
@@ -391,10 +283,12 @@ def trip_detail(trip_id):
 
 @app.route('/export/<int:trip_id>')
 def export_trip(trip_id):
-    trip = Trip.query.get_or_404(trip_id)
-
-    # Parse the itinerary JSON
-    data = json.loads(trip.itinerary)
+    with timing.stage('db'):
+        trip = _trip_or_404(trip_id)
+        data = load_itinerary(trip_id)
+    if data is None:
+        with timing.stage('decode'):
+            data = json.loads(trip.itinerary)
 
     # Create PDF with margins
     buffer = io.BytesIO()
@@ -572,7 +466,8 @@ def export_trip(trip_id):
         story.append(table)
         story.append(Spacer(1, 12))
 
-    doc.build(story)
+    with PDF_RENDER_LATENCY.time(), timing.stage('pdf'):
+        doc.build(story)
     buffer.seek(0)
 
     return send_file(
@@ -584,7 +479,58 @@ def export_trip(trip_id):
 
 @app.route('/delete_trip/<int:trip_id>', methods=['POST'])
 def delete_trip(trip_id):
-    trip = Trip.query.get_or_404(trip_id)
+    trip = _trip_or_404(trip_id)
+    delete_rows(trip_id)
+    unindex_trip(trip_id)
     db.session.delete(trip)
     db.session.commit()
     return jsonify({'success': True})
+
+@app.route('/stats')
+def stats():
+    """Runtime counters for tuning the generation pipeline."""
+    return jsonify({
+        'itinerary_cache': itinerary_cache.stats(),
+        'destination_cache': destination_cache.stats(),
+        'prewarm': prewarmer.stats(),
+        'circuit_breakers': breakers.states(),
+        'hedging': hedge_stats.snapshot(),
+        'admission': admission.stats()
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition of the request, model, parse, database and cache metrics."""
+    body, content_type = metrics.exposition()
+    return Response(body, content_type=content_type)
+
+def require_admin():
+    """Abort unless the request carries the configured X-Admin-Token."""
+    token = app.config.get('ADMIN_TOKEN')
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+        abort(403)
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def profiling_settings():
+    """Show or change the sampling profiler settings at runtime."""
+    require_admin()
+    if request.method == 'POST':
+        try:
+            return jsonify(profiler.update_settings(request.get_json(force=True) or {}))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    return jsonify(profiler.settings())
+
+@app.route('/admin/profiles')
+def slowest_profiles():
+    """The slowest captured profiles, optionally for one endpoint."""
+    require_admin()
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify(profiler.slowest(limit, request.args.get('endpoint')))
+
+@app.route('/admin/profiles/<path:name>')
+def download_profile(name):
+    require_admin()
+    return send_from_directory(os.path.abspath(profiler.directory), name, as_attachment=True)
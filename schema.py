@@ -0,0 +1,112 @@
+BUDGET_CATEGORIES = ['Accommodation', 'Food', 'Transport', 'Activities', 'Miscellaneous']
+
+# Sections with one entry per day of the trip
+DAILY_SECTIONS = ['daily_plan', 'daily_budget_plan']
+# Sections that depend on the destination, month and mood rather than on the traveler
+DESTINATION_SECTIONS = ['trending_places', 'risk_alert', 'overcrowd_predictor', 'hotel_recommendations']
+
+
+def _string(description):
+    return {'type': 'STRING', 'description': description}
+
+
+def _object(properties, description=None):
+    schema = {
+        'type': 'OBJECT',
+        'properties': properties,
+        'required': list(properties),
+        'property_ordering': list(properties),
+    }
+    if description:
+        schema['description'] = description
+    return schema
+
+
+def _array(items, description=None, min_items=None):
+    schema = {'type': 'ARRAY', 'items': items}
+    if description:
+        schema['description'] = description
+    if min_items is not None:
+        schema['min_items'] = min_items
+    return schema
+
+
+# Section name -> schema, in the order the model should write them. daily_plan
+# is a list of {day, activities} here because the structured-output schema
+# can't express arbitrary "Day N" keys; from_structured() turns it back into
+# the mapping stored in Trip.itinerary. Budget figures are left out: the
+# budget engine (budget.py) computes them.
+ITINERARY_SECTIONS = {
+    'trip_summary': _object({
+        'destination': _string('Destination as given by the traveler'),
+        'dates': _string('Travel dates, "YYYY-MM-DD to YYYY-MM-DD"'),
+        'travelers': _string('Number of travelers'),
+        'budget': _string('Total budget with currency symbol'),
+        'mood': _string('Travel mood'),
+        'overall_theme': _string('Brief description based on mood and preferences'),
+    }),
+    'trending_places': _array(_object({
+        'place': _string('Name of a popular place'),
+        'description': _string('Brief description of the place'),
+        'rating': _string('Rating out of 5, e.g. "4.5"'),
+        'image_url': _string('Image URL of the place'),
+    }), 'Four popular places matching the mood', min_items=4),
+    'risk_alert': _object({
+        'level': _string('Low, Medium or High'),
+        'details': _string('Brief safety and weather risk assessment'),
+    }),
+    'hotel_recommendations': _array(_object({
+        'name': _string('Hotel name'),
+        'price_range': _string('Price per night, e.g. "$100-150/night"'),
+        'rating': _string('Rating out of 5'),
+        'highlight': _string('Key feature or amenity'),
+    }), 'Five hotels matching the budget and mood', min_items=5),
+    'overcrowd_predictor': _object({
+        'level': _string('Low, Medium or High'),
+        'reason': _string('Explanation based on season and dates'),
+    }),
+    'quick_insights': _array(_string('Key attraction, activity or tip'), min_items=3),
+    'daily_plan': _array(_object({
+        'day': _string('"Day N"'),
+        'activities': _string('Detailed activities for the day'),
+    }), 'One entry per day of the trip'),
+    'important_notes': _array(_string('Important tip or warning'), min_items=2),
+    'daily_budget_plan': _array(_object({
+        'day': _string('"Day N"'),
+        'activities': _string('Brief summary of activities for the day'),
+        'recommendations': _string('Practical daily recommendations'),
+    }), 'One entry per day of the trip'),
+    'budget_tracking': _object({
+        'overview': _string("Whether the total budget is sufficient for the mood and trip duration"),
+        'distribution_table': _array(_object({
+            'category': _string('One of ' + ', '.join(BUDGET_CATEGORIES)),
+            'suggestions': _string('How to optimize this category'),
+        }), 'One row per budget category', min_items=len(BUDGET_CATEGORIES)),
+        'optimization_tips': _array(_string('Practical recommendation for the budget'), min_items=3),
+    }),
+}
+
+ITINERARY_SCHEMA = _object(ITINERARY_SECTIONS)
+
+
+def from_structured(data):
+    """Convert a structured-output response to the stored itinerary shape."""
+    daily_plan = data.get('daily_plan')
+    if isinstance(daily_plan, list):
+        data['daily_plan'] = {entry.get('day') or f'Day {n}': entry.get('activities', '')
+                              for n, entry in enumerate(daily_plan, start=1)}
+    return data
+
+
+def section_schema(names):
+    """Response schema for a subset of the itinerary sections."""
+    return _object({name: ITINERARY_SECTIONS[name] for name in names})
+
+
+def schema_example(schema):
+    """JSON skeleton for a schema, with descriptions as placeholder values."""
+    if schema['type'] == 'OBJECT':
+        return {name: schema_example(prop) for name, prop in schema['properties'].items()}
+    if schema['type'] == 'ARRAY':
+        return [schema_example(schema['items'])]
+    return schema.get('description', '')
@@ -0,0 +1,139 @@
+import json
+import re
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Column, DDL, Integer, MetaData, Table, Text, delete, event, exists, insert, select, text
+from sqlalchemy.orm import defer
+
+from itinerary_store import itinerary_rows
+from models import db, Trip, TripDay, TripHotel, TripPlace
+
+# Indexed columns and their weight in BM25 ranking: a word of the destination
+# counts ten times one of the daily plan
+WEIGHTS = {'destination': 10.0, 'preferences': 4.0, 'daily_plan': 1.0, 'hotels': 4.0, 'places': 2.0}
+
+# Left out of queries, so "the Kyoto trip with the ryokan" looks for Kyoto and ryokan
+STOP_WORDS = frozenset("""
+    a an and any are as at be by for from has have i in is it its me my of on or our that the their them
+    this to trip trips was we were where which with
+""".split())
+
+# The FTS5 table, with the trip id as its rowid. It is created by the DDL below
+# (create_all() can't create virtual tables), and described here for Core statements.
+trip_search = Table('trip_search', MetaData(), Column('rowid', Integer, primary_key=True),
+                    *(Column(name, Text) for name in WEIGHTS))
+
+# Stemmed, case and accent insensitive. The token positions of the default
+# detail=full make the index bigger but spare bm25() tokenizing every match again.
+_CREATE = DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS trip_search USING fts5({', '.join(WEIGHTS)}, "
+    "tokenize='porter unicode61 remove_diacritics 2')"
+)
+event.listen(db.metadata, 'after_create', _CREATE)
+
+_ALL_MATCH = text('SELECT EXISTS (SELECT 1 FROM trip_search WHERE trip_search MATCH :query)')
+
+_SEARCH = text(
+    'SELECT rowid FROM trip_search WHERE trip_search MATCH :query '
+    f"ORDER BY bm25(trip_search, {', '.join(map(str, WEIGHTS.values()))}), rowid DESC "
+    'LIMIT :limit OFFSET :offset'
+)
+
+
+def search_row(trip, data):
+    """The trip_search row of a trip and its itinerary document."""
+    rows = itinerary_rows(trip.id, data)
+    return {
+        'rowid': trip.id,
+        'destination': trip.destination,
+        'preferences': trip.preferences or '',
+        'daily_plan': '\n'.join(filter(None, (day['activities'] for day in rows[TripDay]))),
+        'hotels': '\n'.join(filter(None, (hotel['name'] for hotel in rows[TripHotel]))),
+        'places': '\n'.join(filter(None, (f"{place['place'] or ''} {place['description'] or ''}".strip()
+                                          for place in rows[TripPlace]))),
+    }
+
+
+def create_search_index(bind):
+    """Create the search index if it doesn't exist, as for a database made before it did."""
+    with bind.begin() as connection:
+        connection.execute(_CREATE)
+
+
+def index_trip(session, trip, data):
+    """Add a saved trip to the search index (committed by the caller)."""
+    session.execute(insert(trip_search), [search_row(trip, data)])
+
+
+def unindex_trip(trip_id):
+    db.session.execute(delete(trip_search).where(trip_search.c.rowid == trip_id))
+
+
+def search_terms(words):
+    """The words worth searching for, each quoted so nothing typed is read as FTS5 query syntax."""
+    terms = [word for word in re.findall(r'[^\W_]+', words.lower()) if word not in STOP_WORDS]
+    return [f'"{term}"' for term in dict.fromkeys(terms)]
+
+
+def search_trips(words, page, per_page):
+    """Trips matching words, best first, for a 1-based page; and whether another page follows."""
+    terms = search_terms(words)
+    if not terms:
+        return [], False
+    # Trips with all of the words, or if there are none, with any of them. Ranking
+    # only the trips with all words keeps common words from scoring most of the table.
+    query = ' '.join(terms)
+    if len(terms) > 1 and not db.session.execute(_ALL_MATCH, {'query': query}).scalar():
+        query = ' OR '.join(terms)
+    ids = db.session.execute(_SEARCH, {'query': query, 'limit': per_page + 1,
+                                       'offset': (page - 1) * per_page}).scalars().all()
+    trips = {trip.id: trip for trip in Trip.query.options(defer(Trip.itinerary), defer(Trip.preferences))
+             .filter(Trip.id.in_(ids[:per_page]))}
+    return [trips[trip_id] for trip_id in ids[:per_page] if trip_id in trips], len(ids) > per_page
+
+
+def index_trips(session, batch_size=500, log=None):
+    """Add trips missing from the search index; returns how many.
+
+    Runs in short transactions next to the app and can be stopped and started
+    again, like itinerary_store.backfill().
+    """
+    done = 0
+    last_id = 0
+    started = time.monotonic()
+    while True:
+        batch = session.execute(
+            select(Trip)
+            .where(Trip.id > last_id, ~exists().where(trip_search.c.rowid == Trip.id))
+            .order_by(Trip.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not batch:
+            return done
+        rows = []
+        for trip in batch:
+            try:
+                data = json.loads(trip.itinerary)
+            except ValueError:
+                data = {}
+            rows.append(search_row(trip, data if isinstance(data, dict) else {}))
+        session.execute(insert(trip_search), rows)
+        session.commit()
+        # The trips and their itineraries aren't needed again
+        session.expunge_all()
+        last_id = rows[-1]['rowid']
+        done += len(batch)
+        if log is not None:
+            log(f'indexed {done} trips ({done / (time.monotonic() - started):.0f}/s)')
+
+
+@click.command('index-trips')
+@click.option('--batch-size', type=int, default=500, help='Trips per transaction.')
+@with_appcontext
+def index_command(batch_size):
+    """Create the search index and add trips saved before it existed."""
+    db.create_all()
+    done = index_trips(db.session, batch_size, log=click.echo)
+    click.echo(f'{done} trips indexed')
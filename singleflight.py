@@ -0,0 +1,136 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from models import db, GenerationLock
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution per process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Run fn once for all concurrent callers of key; returns (result, shared)."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+def lock_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def acquire_lock(key, owner, ttl):
+    """Take the generation_lock row for key; expired locks of dead holders are taken over."""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl)
+    try:
+        db.session.add(GenerationLock(key=key, owner=owner, expires_at=expires_at))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+
+    taken = (GenerationLock.query
+             .filter(GenerationLock.key == key, GenerationLock.expires_at < now)
+             .update({'owner': owner, 'expires_at': expires_at}, synchronize_session=False))
+    db.session.commit()
+    return bool(taken)
+
+
+def renew_lock(key, owner, ttl):
+    """Push back the expiry of a lock owner still holds; False if it was taken over."""
+    renewed = (GenerationLock.query
+               .filter_by(key=key, owner=owner)
+               .update({'expires_at': datetime.utcnow() + timedelta(seconds=ttl)}, synchronize_session=False))
+    db.session.commit()
+    return bool(renewed)
+
+
+class Heartbeat:
+    """Call beat() every interval seconds from a background thread while the with block runs."""
+
+    def __init__(self, beat, interval, name='heartbeat'):
+        self.beat = beat
+        self.interval = interval
+        self.name = name
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        app = current_app._get_current_object()
+        self._thread = threading.Thread(target=self._run, args=(app,), name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self, app):
+        with app.app_context():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.beat()
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('%s failed', self.name)
+
+
+def keep_lock(key, owner, ttl):
+    """Renew a held lock every third of its ttl, so work that outlasts the ttl keeps it."""
+    return Heartbeat(lambda: renew_lock(key, owner, ttl), ttl / 3, name='generation-lock-renewal')
+
+
+def release_lock(key, owner):
+    GenerationLock.query.filter_by(key=key, owner=owner).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def wait_for_release(key, timeout, poll_interval):
+    """Block until nobody holds the lock for key (or timeout); returns True if released."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        held = (GenerationLock.query
+                .filter(GenerationLock.key == key, GenerationLock.expires_at >= datetime.utcnow())
+                .count())
+        # End the read transaction so the next poll sees the holder's commit
+        db.session.rollback()
+        if not held:
+            return True
+        time.sleep(poll_interval)
+    return False
@@ -1,39 +1,55 @@
 // JavaScript for AI Trip Planner
 
 document.addEventListener('DOMContentLoaded', function() {
-    // Handle delete trip buttons
-    const deleteButtons = document.querySelectorAll('.delete-trip');
-    deleteButtons.forEach(button => {
-        button.addEventListener('click', function() {
-            const tripId = this.getAttribute('data-trip-id');
-            if (confirm('Are you sure you want to delete this trip?')) {
-                fetch(`/delete_trip/${tripId}`, {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                })
-                .then(response => response.json())
-                .then(data => {
-                    if (data.success) {
-                        // Remove the trip card from the DOM
-                        this.closest('.col-md-6').remove();
-                        // If no trips left, show the no trips message
-                        const tripCards = document.querySelectorAll('.col-md-6');
-                        if (tripCards.length === 1) { // Since we removed one, check if now 0
-                            location.reload(); // Simple way to refresh and show no trips
-                        }
-                    } else {
-                        alert('Error deleting trip.');
+    // Handle delete trip buttons, including those of cards added by the infinite scroll
+    document.addEventListener('click', function(e) {
+        const button = e.target.closest('.delete-trip');
+        if (!button) {
+            return;
+        }
+        const tripId = button.getAttribute('data-trip-id');
+        if (confirm('Are you sure you want to delete this trip?')) {
+            fetch(`/delete_trip/${tripId}`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    // Remove the trip card from the DOM
+                    button.closest('.col-md-6').remove();
+                    // If no trips left, show the no trips message
+                    const tripCards = document.querySelectorAll('.col-md-6');
+                    if (tripCards.length === 1) { // Since we removed one, check if now 0
+                        location.reload(); // Simple way to refresh and show no trips
                     }
-                })
-                .catch(error => {
-                    console.error('Error:', error);
+                } else {
                     alert('Error deleting trip.');
-                });
+                }
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                alert('Error deleting trip.');
+            });
+        }
+    });
+
+    // Load the next page of saved trips or search results when the end of the list comes into view
+    const loadMoreTrips = document.getElementById('loadMoreTrips');
+    if (loadMoreTrips && 'IntersectionObserver' in window) {
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadTripPage(loadMoreTrips, observer);
             }
+        }, {rootMargin: '400px'});
+        observer.observe(loadMoreTrips);
+        loadMoreTrips.addEventListener('click', function(e) {
+            e.preventDefault();
+            loadTripPage(loadMoreTrips, observer);
         });
-    });
+    }
 
     // Handle form submission for loading animation and AJAX
     const tripForm = document.getElementById('tripForm');
@@ -60,17 +76,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: formData
             })
             .then(response => response.json())
-            .then(data => {
-                if (data.error) {
-                    alert(data.error);
-                    if (planningDiv) {
-                        planningDiv.style.display = 'none';
-                    }
-                } else {
-                    // Redirect to dashboard
-                    window.location.href = `/dashboard/${data.trip_id}`;
-                }
-            })
+            .then(data => handleGenerationResult(data, planningDiv))
             .catch(error => {
                 console.error('Error:', error);
                 alert('An error occurred. Please try again.');
@@ -81,3 +87,201 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 });
+
+// Redirect to the dashboard once a trip exists, polling the job until then
+function handleGenerationResult(data, planningDiv) {
+    if (data.error) {
+        alert(data.error);
+        if (planningDiv) {
+            planningDiv.style.display = 'none';
+        }
+    } else if (data.trip_id) {
+        // Redirect to dashboard
+        window.location.href = `/dashboard/${data.trip_id}`;
+    } else if (data.job_id) {
+        updateQueueStatus(data);
+        if (window.EventSource) {
+            streamGenerationJob(data.job_id, planningDiv);
+        } else {
+            setTimeout(() => pollGenerationJob(data.job_id, planningDiv), 1500);
+        }
+    }
+}
+
+// Render itinerary sections as the server streams them, then redirect
+function streamGenerationJob(jobId, planningDiv, lastEventId = 0) {
+    const container = document.getElementById('itineraryContainer');
+    const source = new EventSource(`/jobs/${jobId}/events?last_event_id=${lastEventId}`);
+    let finished = false;
+
+    const track = handler => e => {
+        lastEventId = e.lastEventId || lastEventId;
+        handler(e);
+    };
+    const renderEvent = track(e => renderPreviewEvent(container, JSON.parse(e.data)));
+    source.addEventListener('section', renderEvent);
+    source.addEventListener('item', renderEvent);
+    source.addEventListener('reset', track(() => clearPreview(container)));
+    source.addEventListener('queued', e => {
+        updateQueueStatus({ status: 'queued', queue_position: JSON.parse(e.data).queue_position });
+    });
+    source.addEventListener('done', e => {
+        finished = true;
+        source.close();
+        handleGenerationResult(JSON.parse(e.data), planningDiv);
+    });
+    source.addEventListener('failed', e => {
+        finished = true;
+        source.close();
+        clearPreview(container);
+        handleGenerationResult({ error: JSON.parse(e.data).error || 'An error occurred. Please try again.' }, planningDiv);
+    });
+    source.addEventListener('timeout', () => {
+        // The server keeps streams short; carry on from the last event in a new one
+        finished = true;
+        source.close();
+        streamGenerationJob(jobId, planningDiv, lastEventId);
+    });
+    source.onerror = () => {
+        if (!finished) {
+            // Fall back to polling if the stream drops
+            source.close();
+            pollGenerationJob(jobId, planningDiv);
+        }
+    };
+}
+
+function clearPreview(container) {
+    if (container) {
+        container.innerHTML = '';
+        container.style.display = 'none';
+    }
+}
+
+function previewBlock(container, id, title) {
+    let block = document.getElementById(id);
+    if (!block) {
+        block = document.createElement('div');
+        block.id = id;
+        block.className = 'bento-box card border-0 shadow-sm p-4 mb-4';
+        const heading = document.createElement('h5');
+        heading.className = 'fw-bold mb-3';
+        heading.textContent = title;
+        block.appendChild(heading);
+        container.appendChild(block);
+    }
+    return block;
+}
+
+function previewLine(block, label, text) {
+    const line = document.createElement('p');
+    line.className = 'mb-2';
+    if (label) {
+        const strong = document.createElement('strong');
+        strong.textContent = `${label}: `;
+        line.appendChild(strong);
+    }
+    line.appendChild(document.createTextNode(text || ''));
+    block.appendChild(line);
+}
+
+function renderPreviewEvent(container, event) {
+    if (!container || !event.value) {
+        return;
+    }
+    if (event.kind === 'section' && event.name === 'trip_summary') {
+        const block = previewBlock(container, 'preview-summary', `Trip to ${event.value.destination || ''}`);
+        previewLine(block, 'Dates', event.value.dates);
+        previewLine(block, 'Theme', event.value.overall_theme);
+    } else if (event.kind === 'item' && event.name === 'trending_places') {
+        const block = previewBlock(container, 'preview-trending', 'Trending Places');
+        previewLine(block, event.value.place, event.value.description);
+    } else if (event.kind === 'item' && event.name === 'daily_plan') {
+        const block = previewBlock(container, 'preview-daily-plan', 'Daily Plan');
+        if (typeof event.value === 'object') {
+            // Structured-output responses list days as {day, activities}
+            previewLine(block, event.value.day, event.value.activities);
+        } else {
+            previewLine(block, event.key, event.value);
+        }
+    } else {
+        return;
+    }
+    container.style.display = 'block';
+}
+
+function pollGenerationJob(jobId, planningDiv) {
+    fetch(`/jobs/${jobId}`)
+    .then(response => response.json())
+    .then(job => {
+        if (job.status === 'failed') {
+            handleGenerationResult({ error: job.error || 'An error occurred. Please try again.' }, planningDiv);
+        } else if (job.status === 'done') {
+            handleGenerationResult(job, planningDiv);
+        } else {
+            // Still queued or running: check again without reopening the event stream
+            updateQueueStatus(job);
+            setTimeout(() => pollGenerationJob(jobId, planningDiv), 1500);
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        setTimeout(() => pollGenerationJob(jobId, planningDiv), 3000);
+    });
+}
+
+function updateQueueStatus(job) {
+    const queueStatus = document.getElementById('queueStatus');
+    if (!queueStatus) {
+        return;
+    }
+    if (job.status === 'queued' && job.queue_position > 1) {
+        queueStatus.textContent = `You're number ${job.queue_position} in line...`;
+    } else {
+        queueStatus.textContent = '';
+    }
+}
+
+function loadTripPage(loadMore, observer) {
+    if (loadMore.dataset.loading) {
+        return;
+    }
+    loadMore.dataset.loading = 'true';
+    fetch(loadMore.dataset.next)
+        .then(response => response.json())
+        .then(data => {
+            const grid = document.getElementById('tripGrid');
+            const template = document.getElementById('tripCardTemplate');
+            data.trips.forEach(trip => grid.appendChild(renderTripCard(template, trip)));
+            if (data.next) {
+                loadMore.dataset.next = data.next;
+                // /trips and /search serve the same pages as /api/trips and /api/search
+                loadMore.href = data.next.replace('/api/', '/');
+                // Observing again reports the link at once if it is still in view
+                observer.unobserve(loadMore);
+                observer.observe(loadMore);
+            } else {
+                observer.disconnect();
+                loadMore.parentElement.remove();
+            }
+        })
+        .catch(error => console.error('Error loading trips:', error))
+        .finally(() => delete loadMore.dataset.loading);
+}
+
+function renderTripCard(template, trip) {
+    const card = template.content.firstElementChild.cloneNode(true);
+    const field = name => card.querySelector(`[data-field="${name}"]`);
+    // created_at is a date and time without a zone, so it is shown as it is
+    field('created_at').textContent = new Date(trip.created_at).toLocaleDateString('en-US', {
+        month: 'short', day: '2-digit', year: 'numeric'
+    });
+    field('destination').textContent = trip.destination;
+    field('dates').textContent = `${trip.start_date} \u2192 ${trip.end_date}`;
+    field('travelers').textContent = `${trip.travelers} Travelers`;
+    field('budget').textContent = `$${trip.budget}`;
+    field('view').href = `/trip/${trip.id}`;
+    field('export').href = `/export/${trip.id}`;
+    card.querySelector('.delete-trip').setAttribute('data-trip-id', trip.id);
+    return card;
+}
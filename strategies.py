@@ -0,0 +1,276 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from flask import current_app
+
+from generation import generate_with_retry, parse_itinerary_text
+from retry import ModelsUnavailable
+from limiter import PRIORITY_INTERACTIVE
+from parsing import salvage_json
+import timing
+import tracing
+from prompts import build_itinerary_prompt, build_structured_prompt, build_days_prompt, build_sections_prompt
+from schema import DAILY_SECTIONS, DESTINATION_SECTIONS, ITINERARY_SCHEMA, ITINERARY_SECTIONS, from_structured, section_schema
+
+# Non-daily sections are fanned out in these groups, each with an output cap
+# sized to it; the daily sections are generated per day range
+SECTION_GROUPS = [
+    (['trip_summary', 'risk_alert', 'overcrowd_predictor', 'quick_insights', 'important_notes'], 1536),
+    (['trending_places'], 1024),
+    (['hotel_recommendations'], 1024),
+    (['budget_tracking'], 1024),
+]
+DAY_OUTPUT_TOKENS = 384
+DESTINATION_OUTPUT_TOKENS = 3072
+
+# Sub-requests of one itinerary (day ranges) run here; each still waits for
+# admission by the outbound limiter before calling Gemini
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='itinerary-part')
+
+
+def trip_days(params):
+    return (params['end_date'] - params['start_date']).days + 1
+
+
+def _prompt_args(params):
+    return (params['destination'], params['start_date'], params['end_date'], params['travelers'],
+            params['budget'], params['mood'], params['preferences'], trip_days(params))
+
+
+class IncompleteResponse(json.JSONDecodeError):
+    """A response whose JSON was malformed or cut off before every required section."""
+
+    def __init__(self, error, salvaged, partial, missing):
+        super().__init__(error.msg, error.doc, error.pos)
+        self.salvaged = salvaged
+        self.partial = partial
+        self.missing = missing
+
+
+def _parse(response, structured, required=()):
+    """Parse a response, keeping every complete section when the JSON is malformed or cut off.
+
+    Raises IncompleteResponse if sections in required could not be recovered.
+    """
+    try:
+        data = parse_itinerary_text(response.text)
+    except json.JSONDecodeError as e:
+        data, partial = salvage_json(response.text or '')
+        if structured:
+            partial = from_structured(partial)
+        missing = [name for name in required if name not in data]
+        if missing or not data:
+            raise IncompleteResponse(e, from_structured(data) if structured else data, partial, missing)
+    return from_structured(data) if structured else data
+
+
+def _submit(fn, *args):
+    app = current_app._get_current_object()
+    timings = timing.current()
+    span = tracing.current_span()
+
+    def run():
+        with app.app_context(), timing.bind(timings), tracing.bind(span):
+            return fn(*args)
+    return _executor.submit(run)
+
+
+def _generate_full(params, progress, priority, plan_days=None, known=None):
+    """Every section of the itinerary, except those already in known."""
+    structured = current_app.config['GEMINI_STRUCTURED_OUTPUT']
+    if known:
+        sections = [name for name in ITINERARY_SECTIONS if name not in known]
+        schema = section_schema(sections)
+        with tracing.span('prompt.build', **{'prompt.kind': 'sections', 'prompt.sections': ','.join(sections),
+                                             'prompt.days': _days_label(plan_days)}):
+            prompt = build_sections_prompt(*_prompt_args(params), sections, structured=structured,
+                                           plan_days=plan_days, known=known)
+    else:
+        sections = list(ITINERARY_SECTIONS)
+        schema = ITINERARY_SCHEMA
+        build_prompt = build_structured_prompt if structured else build_itinerary_prompt
+        with tracing.span('prompt.build', **{'prompt.kind': 'full', 'prompt.days': _days_label(plan_days)}):
+            prompt = build_prompt(*_prompt_args(params), plan_days=plan_days)
+    # The first day range of a sharded trip is a shorter call than a whole itinerary
+    kind = f"sections:{','.join(sections)}" if known else 'full'
+    response = generate_with_retry(prompt, progress=progress, priority=priority,
+                                   schema=schema if structured else None,
+                                   kind=kind if plan_days is None else f'{kind}:range')
+    try:
+        return _parse(response, structured, required=sections)
+    except IncompleteResponse as e:
+        if not e.salvaged:
+            raise
+        with tracing.span('generation.repair', **{'repair.sections': ','.join(e.missing)}):
+            return _repair(params, e, progress, priority, plan_days)
+
+
+def _repair(params, incomplete, progress, priority, plan_days=None):
+    """Ask only for the sections a cut-off response is missing and merge them into what was salvaged.
+
+    If the repair call fails, a section that was cut off part-way is used as far as it got.
+    """
+    data = incomplete.salvaged
+    daily = [name for name in incomplete.missing if name in DAILY_SECTIONS]
+    other = [name for name in incomplete.missing if name not in DAILY_SECTIONS]
+    try:
+        repaired = {}
+        if other:
+            repaired.update(_generate_section_group(params, other, priority))
+        if daily and plan_days is not None:
+            # A shard's daily sections cover only its own day range
+            repaired.update({name: value for name, value in _generate_day_range(params, plan_days, priority).items()
+                             if name in daily})
+        elif daily:
+            repaired.update(_generate_section_group(params, daily, priority))
+    except (json.JSONDecodeError, ModelsUnavailable):
+        if any(name not in incomplete.partial for name in incomplete.missing):
+            raise
+        repaired = {name: incomplete.partial[name] for name in incomplete.missing}
+    data.update(repaired)
+    if progress is not None:
+        for name, value in repaired.items():
+            progress.publish(name, value)
+    return {name: data[name] for name in ITINERARY_SECTIONS if name in data}
+
+
+def generate_monolithic(params, progress=None, priority=PRIORITY_INTERACTIVE, known=None):
+    """One prompt for the whole itinerary."""
+    return _generate_full(params, progress, priority, known=known)
+
+
+def _days_label(plan_days):
+    return f'{plan_days[0]}-{plan_days[1]}' if plan_days is not None else None
+
+
+def day_ranges(number_of_days, shard_days):
+    return [(first, min(first + shard_days - 1, number_of_days))
+            for first in range(1, number_of_days + 1, shard_days)]
+
+
+def _generate_day_range(params, plan_days, priority, max_output_tokens=None):
+    structured = current_app.config['GEMINI_STRUCTURED_OUTPUT']
+    with tracing.span('prompt.build', **{'prompt.kind': 'days', 'prompt.days': _days_label(plan_days)}):
+        prompt = build_days_prompt(*_prompt_args(params), plan_days[0], plan_days[1], structured=structured)
+    response = generate_with_retry(prompt, priority=priority,
+                                   schema=section_schema(DAILY_SECTIONS) if structured else None,
+                                   max_output_tokens=max_output_tokens, kind='days')
+    return _parse(response, structured, required=DAILY_SECTIONS)
+
+
+def merge_day_ranges(base, ranges, parts):
+    """Merge per-range daily sections into base, numbering days from each range's first day."""
+    daily_plan = {}
+    daily_budget_plan = []
+    for (first, last), part in zip(ranges, parts):
+        count = last - first + 1
+        plan = part.get('daily_plan') or {}
+        for offset, activities in enumerate(list(plan.values())[:count]):
+            daily_plan[f'Day {first + offset}'] = activities
+        for offset, row in enumerate((part.get('daily_budget_plan') or [])[:count]):
+            row['day'] = f'Day {first + offset}'
+            daily_budget_plan.append(row)
+    base['daily_plan'] = daily_plan
+    base['daily_budget_plan'] = daily_budget_plan
+    return base
+
+
+def generate_sharded(params, progress=None, priority=PRIORITY_INTERACTIVE, known=None):
+    """Split a long trip into day ranges generated concurrently, then merge them."""
+    ranges = day_ranges(trip_days(params), current_app.config['GENERATION_SHARD_DAYS'])
+    later = [_submit(_generate_day_range, params, plan_days, priority) for plan_days in ranges[1:]]
+    try:
+        # The first range also carries every non-daily section and feeds the live preview
+        base = _generate_full(params, progress, priority, plan_days=ranges[0], known=known)
+        parts = [base] + [future.result() for future in later]
+    finally:
+        for future in later:
+            future.cancel()
+    return merge_day_ranges(base, ranges, parts)
+
+
+def _generate_section_group(params, sections, priority, max_output_tokens=None):
+    structured = current_app.config['GEMINI_STRUCTURED_OUTPUT']
+    with tracing.span('prompt.build', **{'prompt.kind': 'sections', 'prompt.sections': ','.join(sections)}):
+        prompt = build_sections_prompt(*_prompt_args(params), sections, structured=structured)
+    response = generate_with_retry(prompt, priority=priority,
+                                   schema=section_schema(sections) if structured else None,
+                                   max_output_tokens=max_output_tokens, kind=f"sections:{','.join(sections)}")
+    data = from_structured(_parse(response, structured, required=sections))
+    missing = [name for name in sections if name not in data]
+    if missing:
+        raise json.JSONDecodeError(f'Missing sections {", ".join(missing)}', response.text or '', 0)
+    return {name: data[name] for name in sections}
+
+
+def _with_section_retries(fn, params, part, max_output_tokens, priority, attempts):
+    """Run one fan-out part, retrying it alone when its output doesn't parse.
+
+    A part that fails to parse was usually cut off at its output cap, so each
+    retry doubles the cap.
+    """
+    for attempt in range(attempts):
+        try:
+            return fn(params, part, priority, max_output_tokens=max_output_tokens * 2 ** attempt)
+        except json.JSONDecodeError:
+            if attempt == attempts - 1:
+                raise
+
+
+def generate_destination_sections(params, priority=PRIORITY_INTERACTIVE):
+    """Only the sections shared by every trip to the destination in that month and mood."""
+    attempts = current_app.config['GENERATION_SECTION_ATTEMPTS']
+    return _with_section_retries(_generate_section_group, params, DESTINATION_SECTIONS, DESTINATION_OUTPUT_TOKENS,
+                                 priority, attempts)
+
+
+def generate_sections(params, progress=None, priority=PRIORITY_INTERACTIVE, known=None):
+    """Generate independent section groups and day ranges concurrently, then assemble them.
+
+    Each part is a small prompt with its own output cap, so a failed part is
+    retried on its own instead of regenerating the whole itinerary. Parts
+    are published to progress as they complete. Sections in known are not
+    generated again.
+    """
+    config = current_app.config
+    attempts = config['GENERATION_SECTION_ATTEMPTS']
+    ranges = day_ranges(trip_days(params), config['GENERATION_SHARD_DAYS'])
+    known = known or {}
+    section_groups = [([name for name in sections if name not in known], max_tokens)
+                      for sections, max_tokens in SECTION_GROUPS]
+    groups = {_submit(_with_section_retries, _generate_section_group, params, sections, max_tokens, priority,
+                      attempts): None
+              for sections, max_tokens in section_groups if sections}
+    days = {_submit(_with_section_retries, _generate_day_range, params, plan_days,
+                    DAY_OUTPUT_TOKENS * (plan_days[1] - plan_days[0] + 1), priority, attempts): plan_days
+            for plan_days in ranges}
+    data = {}
+    parts = {}
+    try:
+        for future in as_completed(list(groups) + list(days)):
+            if future in groups:
+                data.update(future.result())
+                if progress is not None:
+                    for name, value in future.result().items():
+                        progress.publish(name, value)
+            else:
+                parts[days[future]] = future.result()
+    finally:
+        for future in list(groups) + list(days):
+            future.cancel()
+    merge_day_ranges(data, ranges, [parts[plan_days] for plan_days in ranges])
+    if progress is not None:
+        for name in DAILY_SECTIONS:
+            progress.publish(name, data[name])
+    # Keep the section order of the single-prompt document
+    return {name: data[name] for name in ITINERARY_SECTIONS if name in data}
+
+
+def select_strategy(params):
+    """Pick how to generate an itinerary for params (GENERATION_STRATEGY)."""
+    strategy = current_app.config['GENERATION_STRATEGY']
+    if strategy == 'sections':
+        return generate_sections
+    if strategy == 'auto' and trip_days(params) > current_app.config['GENERATION_SHARD_THRESHOLD_DAYS']:
+        return generate_sharded
+    return generate_monolithic
@@ -0,0 +1,64 @@
+import json
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+import pytest
+
+# The app reads its configuration when it is imported
+_instance = tempfile.mkdtemp(prefix='wandermate-tests-')
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(_instance, 'trips.db')}",
+    GEMINI_API_KEY='test',
+    GENERATION_WORKERS='0',
+    LLM_BACKEND='fake',
+    LLM_RECORD_DIR=os.path.join(_instance, 'llm_recordings'),
+    PROFILE_DIR=os.path.join(_instance, 'profiles'),
+    TRACE_FILE=os.path.join(_instance, 'traces.jsonl'),
+)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app():
+    from app import app
+    from cache import destination_cache, itinerary_cache
+    from models import db
+    with app.app_context():
+        db.create_all()
+        yield app
+        # The process-level caches outlive the database of a test
+        for cache in (itinerary_cache, destination_cache):
+            cache._memory.clear()
+        itinerary_cache._failures.clear()
+        db.session.remove()
+        db.drop_all()
+        db.session.execute(db.text('DROP TABLE IF EXISTS trip_search'))
+        db.session.commit()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_trip(app):
+    """Save a trip with its itinerary, indexed for search like the ones the app saves."""
+    from models import db, Trip
+    from search import index_trip
+    started = datetime(2030, 1, 1)
+
+    def make_trip(destination='Kyoto', preferences='', itinerary=None, minutes=0):
+        data = itinerary or {'trip_summary': {'destination': destination}}
+        trip = Trip(destination=destination, start_date=date(2030, 4, 1), end_date=date(2030, 4, 3),
+                    travelers=2, budget=1500, mood='Cultural', preferences=preferences,
+                    itinerary=json.dumps(data), created_at=started + timedelta(minutes=minutes))
+        db.session.add(trip)
+        db.session.flush()
+        index_trip(db.session, trip, data)
+        db.session.commit()
+        return trip
+
+    return make_trip
@@ -0,0 +1,83 @@
+from datetime import date
+
+import pytest
+
+from budget import BudgetPlan, allocate, apply_budget, budget_tier, format_money, parse_money
+
+
+def test_allocate_gives_the_rounding_remainder_to_the_largest_remainders():
+    # 100 * (1/3, 1/3, 1/3) = 33.33 each: one part gets the lost cent
+    assert sorted(allocate(100, [1, 1, 1])) == [33, 33, 34]
+    # 10 * (0.15, 0.25, 0.6) = 1.5, 2.5, 6.0
+    assert allocate(10, [15, 25, 60]) in ([2, 2, 6], [1, 3, 6])
+    # 7 * (0.28, 0.72) = 1.96, 5.04: the bigger remainder (.96) rounds up
+    assert allocate(7, [28, 72]) == [2, 5]
+
+
+@pytest.mark.parametrize('total, weights', [
+    (150000, [35, 25, 20, 15, 5]),
+    (99999, [1, 1, 1, 1, 1, 1, 1]),
+    (1, [3, 3, 3]),
+    (0, [1, 2]),
+    (123457, [0.1, 0.2, 0.7]),
+])
+def test_allocate_parts_add_up_to_the_total(total, weights):
+    parts = allocate(total, weights)
+    assert sum(parts) == total
+    for part, weight in zip(parts, weights):
+        assert abs(part - total * weight / sum(weights)) < 1
+
+
+def test_budget_plan_days_and_categories_add_up_exactly():
+    plan = BudgetPlan('1000.01', 3, 'Romantic')
+    assert plan.total == 100001
+    assert sum(plan.by_category) == plan.total
+    assert sum(plan.day_totals) == plan.total
+    assert [sum(day[i] for day in plan.daily) for i in range(len(plan.by_category))] == plan.by_category
+    assert [percent for _, percent, _ in plan.distribution()] == [40, 25, 10, 20, 5]
+
+
+def test_unknown_mood_uses_the_default_split():
+    assert BudgetPlan(100, 1, 'Sleepy').percentages == BudgetPlan(100, 1, 'relaxed').percentages
+
+
+def test_money():
+    assert parse_money('$1,234.50 per day') == 123450
+    assert parse_money('about 80') == 8000
+    assert parse_money('free') is None
+    assert format_money(123450) == '$1234.50'
+
+
+def test_apply_budget_fills_the_figures_and_keeps_the_model_text():
+    data = {
+        'daily_plan': {'Day 1': 'Temples', 'Day 2': 'Tea'},
+        'daily_budget_plan': [{'day': 'Day 1', 'estimated_spend': '$5', 'recommendations': 'Eat ramen'}],
+        'budget_tracking': {'overview': 'Fine', 'distribution_table': [
+            {'category': 'accommodation', 'percentage': '90%', 'suggestions': 'Ryokan'}]},
+    }
+    apply_budget(data, 200, 2, 'Relaxed')
+    table = data['budget_tracking']['distribution_table']
+    assert [row['percentage'] for row in table] == ['35%', '25%', '20%', '15%', '5%']
+    assert table[0]['estimated_cost'] == '$70.00' and table[0]['suggestions'] == 'Ryokan'
+    assert data['budget_tracking']['overview'] == 'Fine'
+    days = data['daily_budget_plan']
+    assert [day['estimated_spend'] for day in days] == ['$100.00', '$100.00']
+    assert days[0]['recommendations'] == 'Eat ramen'
+    assert days[1]['activities'] == 'Tea'
+
+
+def test_budget_tier_groups_similar_spending():
+    assert budget_tier(1000, 5, 2) == budget_tier(1050, 5, 2)
+    assert budget_tier(1000, 5, 2) < budget_tier(4000, 5, 2)
+    assert budget_tier(0, 0, 0) == 0
+
+
+def test_personalize_uses_the_requests_own_figures():
+    from pipeline import personalize
+    cached = {'trip_summary': {'destination': 'kyoto', 'travelers': '4', 'budget': '$999.00'}}
+    params = {'destination': 'Kyoto', 'start_date': date(2030, 4, 1), 'end_date': date(2030, 4, 3),
+              'travelers': 2, 'budget': 1234.5, 'mood': 'Cultural'}
+    summary = personalize(cached, params)['trip_summary']
+    assert summary == {'destination': 'Kyoto', 'dates': '2030-04-01 to 2030-04-03', 'travelers': '2',
+                       'budget': '$1234.50'}
+    assert sum(parse_money(day['estimated_spend']) for day in cached['daily_budget_plan']) == 123450
@@ -0,0 +1,146 @@
+import time
+from datetime import date
+
+import pytest
+
+from budget import budget_tier
+from cache import NEGATIVE, DestinationCache, ItineraryCache, destination_cache, make_cache_key, make_destination_key
+from models import db
+from schema import DESTINATION_SECTIONS, ITINERARY_SECTIONS
+from singleflight import acquire_lock, release_lock
+
+PARAMS = {'destination': 'Kyoto', 'start_date': date(2030, 4, 1), 'end_date': date(2030, 4, 3), 'travelers': 2,
+          'budget': 1500, 'mood': 'Cultural', 'preferences': ''}
+SECTIONS = {name: f'shared {name}' for name in DESTINATION_SECTIONS}
+
+
+def destination_key(params):
+    return make_destination_key(params['destination'], params['start_date'].month, params['mood'],
+                                budget_tier(params['budget'], 3, params['travelers']))
+
+
+def test_cache_key_is_shared_by_spellings_and_nearby_budgets():
+    key = make_cache_key('Kyoto', date(2030, 4, 1), 3, 2, 1000, 'Cultural', 'Temples')
+    assert make_cache_key(' kyoto.', date(2030, 4, 20), 3, 2, 1050, 'cultural', 'temples ') == key
+    assert make_cache_key('Kyoto', date(2030, 4, 1), 4, 2, 1000, 'Cultural', 'Temples') != key
+    assert make_cache_key('Kyoto', date(2030, 4, 1), 3, 2, 1000, 'Cultural', 'Food') != key
+
+
+def test_memory_keeps_the_most_recently_used_and_the_table_keeps_the_rest(app):
+    cache = ItineraryCache()
+    cache.memory_size = 2
+    for key in ('a', 'b', 'c'):
+        cache.set(key, {'key': key})
+        cache.get('a')
+    assert list(cache._memory) == ['c', 'a']
+    assert cache.get('b') == {'key': 'b'}
+    stats = cache.stats()
+    assert (stats['evictions'], stats['db_hits'], stats['memory_hits']) == (2, 1, 3)
+    assert cache.get('missing') is None
+
+
+def test_expired_itineraries_are_misses(app):
+    cache = ItineraryCache()
+    cache.ttl = 0
+    cache.set('key', {'key': 'key'})
+    assert cache.get('key') is None
+    assert ItineraryCache().get('key') is None
+
+
+def test_repeated_parse_failures_become_a_negative_entry_until_it_expires(app):
+    cache = ItineraryCache()
+    cache.negative_ttl = 0.3
+    cache.record_failure('key')
+    cache.record_failure('key')
+    assert cache.get('key') is None
+    cache.record_failure('key')
+    assert cache.get('key') is NEGATIVE
+    assert ItineraryCache().get('key') is NEGATIVE
+    time.sleep(0.4)
+    assert cache.get('key') is None
+    cache.set('key', {'key': 'key'})
+    assert cache.get('key') == {'key': 'key'}
+
+
+def test_failure_counts_lapse_after_the_negative_ttl(app):
+    cache = ItineraryCache()
+    cache.negative_ttl = 0.2
+    cache.record_failure('key')
+    cache.record_failure('key')
+    time.sleep(0.3)
+    cache.record_failure('key')
+    assert cache.get('key') is None
+    assert cache._failures['key'][0] == 1
+
+
+def test_destination_key_is_shared_by_spellings_but_not_budget_tiers():
+    assert make_destination_key(' Zürich, ', 4, 'Cultural', 10) == make_destination_key('zurich', 4, 'cultural ', 10)
+    assert make_destination_key('Zurich', 4, 'Cultural', 10) != make_destination_key('Zurich', 4, 'Cultural', 14)
+    assert make_destination_key('Zurich', 4, 'Cultural', 10) != make_destination_key('Zurich', 5, 'Cultural', 10)
+
+
+def test_destination_sections_survive_the_process_cache(app):
+    cache = DestinationCache(app)
+    cache.set('key', SECTIONS, 2.0)
+    assert cache.get('key') == (SECTIONS, False)
+    assert DestinationCache(app).get('key')[0] == SECTIONS
+    assert cache.get('other') == (None, True)
+
+
+def test_entries_are_refreshed_early_near_expiry(app):
+    cache = DestinationCache(app)
+    cache.ttl = 60
+    cache.set('key', SECTIONS, 0.001)
+    assert not any(cache.get('key')[1] for _ in range(50))
+    # Generating took far longer than the entry has left to live: almost every lookup refreshes it
+    cache.set('slow', SECTIONS, 6000)
+    assert sum(cache.get('slow')[1] for _ in range(50)) > 40
+    cache.beta = 0
+    assert not any(cache.get('slow')[1] for _ in range(50))
+    assert cache.stats()['early_refreshes'] > 40
+
+
+def _strategy(calls):
+    def strategy(params, progress=None, priority=0, known=None):
+        calls.append(known)
+        return {name: f'generated {name}' for name in ITINERARY_SECTIONS if name not in (known or {})}
+    return strategy
+
+
+def test_cached_sections_are_not_generated_again(app, monkeypatch):
+    from pipeline import _generate_with_shared_sections
+    monkeypatch.setattr(destination_cache, 'beta', 0)
+    destination_cache.set(destination_key(PARAMS), SECTIONS, 1.0)
+    calls = []
+    data = _generate_with_shared_sections(_strategy(calls), PARAMS, None, 0)
+    assert calls == [SECTIONS]
+    assert data['hotel_recommendations'] == 'shared hotel_recommendations'
+    assert list(data) == list(ITINERARY_SECTIONS)
+
+
+def test_sections_of_another_budget_tier_are_not_used(app, monkeypatch):
+    from pipeline import _generate_with_shared_sections
+    destination_cache.set(destination_key(dict(PARAMS, budget=300)), SECTIONS, 1.0)
+    calls = []
+    data = _generate_with_shared_sections(_strategy(calls), dict(PARAMS, budget=30000), None, 0)
+    assert calls == [None]
+    assert data['hotel_recommendations'] == 'generated hotel_recommendations'
+    # This request generated and stored the sections for its own tier
+    assert destination_cache.get(destination_key(dict(PARAMS, budget=30000)))[0]['hotel_recommendations'] \
+        == 'generated hotel_recommendations'
+
+
+def test_request_does_not_wait_for_another_generating_the_sections(app):
+    from pipeline import _generate_with_shared_sections
+    key = destination_key(PARAMS)
+    assert acquire_lock(key, 'another process', 60)
+    try:
+        calls = []
+        started = time.monotonic()
+        _generate_with_shared_sections(_strategy(calls), PARAMS, None, 0)
+        assert time.monotonic() - started < 1
+        assert calls == [None]
+        # The lock holder stores the sections, not this request
+        assert destination_cache.get(key)[0] is None
+    finally:
+        release_lock(key, 'another process')
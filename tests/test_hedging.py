@@ -0,0 +1,142 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import generation
+from generation import ModelResponse, generate_with_retry, hedge_delay, stream_content
+from hedging import CallCancelled, LatencyTracker, hedged_call
+from llm import FakeBackend, _with_timeout, llm
+from retry import ModelsUnavailable, breakers
+from schema import section_schema
+
+
+def leg(result=None, error=None, after=0.0):
+    """A leg that settles its Future after a delay unless it is cancelled first."""
+    def start(cancel):
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            if cancel.wait(after):
+                future.set_exception(CallCancelled('leg'))
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        threading.Thread(target=run, daemon=True).start()
+        return future
+    return start
+
+
+def test_latencies_are_kept_per_model_and_kind():
+    tracker = LatencyTracker(window=10)
+    for n in range(20):
+        tracker.record('flash', 'sections', n / 10)
+    tracker.record('flash', 'full', 30.0)
+    assert tracker.percentile('flash', 'sections', 0.95) == 1.9
+    assert tracker.percentile('flash', 'full', 0.95) == 30.0
+    assert tracker.percentile('flash', 'full', 0.95, min_samples=2) is None
+    assert tracker.percentile('pro', 'sections', 0.5) is None
+
+
+def test_fast_primary_is_not_hedged():
+    backup_started = []
+    result, winner = hedged_call(leg('primary'), lambda cancel: backup_started.append(cancel) or Future(),
+                                 hedge_after=1.0, deadline=5, validate=lambda result: True)
+    assert (result, winner) == ('primary', 'primary')
+    assert backup_started == []
+
+
+def test_slow_primary_loses_to_the_backup_and_is_cancelled():
+    cancels = []
+
+    def start_primary(cancel):
+        cancels.append(cancel)
+        return leg('primary', after=5)(cancel)
+
+    started = time.monotonic()
+    result, winner = hedged_call(start_primary, leg('backup'), hedge_after=0.05, deadline=5,
+                                 validate=lambda result: True)
+    assert (result, winner) == ('backup', 'backup')
+    assert cancels[0].is_set()
+    assert time.monotonic() - started < 1
+
+
+def test_invalid_backup_falls_back_to_the_primary():
+    result, winner = hedged_call(leg('primary', after=0.2), leg('garbage'), hedge_after=0.05, deadline=5,
+                                 validate=lambda result: result != 'garbage')
+    assert (result, winner) == ('primary', 'primary')
+
+
+def test_primary_error_is_raised_when_no_leg_succeeds():
+    with pytest.raises(ValueError):
+        hedged_call(leg(error=ValueError('primary')), None, hedge_after=0.01, deadline=1, validate=bool)
+    with pytest.raises(ModelsUnavailable):
+        hedged_call(leg('late', after=5), None, hedge_after=0.01, deadline=0.1, validate=bool)
+
+
+def test_hedge_delay_uses_the_latencies_of_the_same_kind(app, monkeypatch):
+    tracker = LatencyTracker()
+    monkeypatch.setattr(generation, 'latency', tracker)
+    monkeypatch.setitem(app.config, 'GEMINI_HEDGE_MIN_SAMPLES', 5)
+    for _ in range(10):
+        tracker.record('flash', 'sections:hotels', 8.0)
+    assert hedge_delay('flash', 'sections:hotels') == 8.0
+    assert hedge_delay('flash', 'full') == app.config['GEMINI_HEDGE_DEFAULT_DELAY']
+
+
+def test_timeout_is_set_on_the_request_config():
+    assert _with_timeout(None, None) is None
+    assert _with_timeout(None, 2.5).http_options.timeout == 2500
+    config = generation.content_config(section_schema(['important_notes']), 100)
+    timed = _with_timeout(config, 0.0001)
+    assert timed.http_options.timeout == 1
+    assert timed.response_schema == config.response_schema and timed.max_output_tokens == 100
+    assert config.http_options is None
+
+
+class StalledBackend(FakeBackend):
+    """Fake backend that records when each call ended."""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.ended = []
+
+    def generate(self, *args, **kwargs):
+        try:
+            return super().generate(*args, **kwargs)
+        finally:
+            self.ended.append(time.monotonic())
+
+
+def test_stalled_attempt_ends_at_the_deadline(app, monkeypatch):
+    backend = StalledBackend(latency='fixed:30')
+    monkeypatch.setattr(llm, 'backend', backend)
+    monkeypatch.setitem(app.config, 'GEMINI_HEDGING', False)
+    monkeypatch.setitem(app.config, 'GEMINI_DEADLINE', 0.3)
+    monkeypatch.setattr(breakers, '_breakers', {})
+    started = time.monotonic()
+    with pytest.raises(ModelsUnavailable):
+        generate_with_retry('Number of days: 1')
+    for _ in range(50):
+        if backend.ended:
+            break
+        time.sleep(0.02)
+    # The attempt itself gave up, not only the caller waiting for it
+    assert backend.ended and backend.ended[0] - started < 1
+
+
+def test_stream_that_stalls_between_chunks_times_out(app, monkeypatch):
+    def stream(model_name, prompt, config=None, usage=None, timeout=None):
+        yield '{"a": '
+        time.sleep(0.2)
+        yield '1}'
+
+    monkeypatch.setattr(llm, 'stream', stream)
+    with pytest.raises(TimeoutError):
+        stream_content('flash', 'prompt', timeout=0.1)
+    assert stream_content('flash', 'prompt', timeout=1).text == '{"a": 1}'
+    assert isinstance(stream_content('flash', 'prompt'), ModelResponse)
@@ -0,0 +1,72 @@
+import json
+
+from budget import apply_budget
+from itinerary_store import backfill, compress_itineraries, delete_rows, itinerary_rows, load_itinerary, save_rows
+from llm import fake_response
+from models import db, Trip, TripDay, TripNote, TripOverview
+
+
+def itinerary(days):
+    # As saved: the budget figures come from the budget engine
+    return apply_budget(json.loads(fake_response(f'Number of days: {days}')), 300, days, 'Relaxed')
+
+
+def test_rows_rebuild_the_document(app, make_trip):
+    data = itinerary(3)
+    trip = make_trip(itinerary=data)
+    save_rows(db.session, trip.id, data)
+    db.session.commit()
+    assert load_itinerary(trip.id) == data
+
+
+def test_odd_shapes_are_stored_as_far_as_they_go():
+    rows = itinerary_rows(1, {
+        'trip_summary': 'not an object',
+        'daily_plan': [{'day': 'Day 1', 'activities': 'Temples'}, 'junk'],
+        'daily_budget_plan': [{'estimated_spend': '$1,200.50', 'category_breakdown': {'food': 40}}],
+        'important_notes': ['a', 2],
+    })
+    assert rows[TripOverview][0]['destination'] is None
+    day = rows[TripDay][0]
+    assert (day['label'], day['activities'], day['spend_cents'], day['budget_label']) == ('Day 1', 'Temples', 120050,
+                                                                                          'Day 1')
+    assert [(note['kind'], note['text']) for note in rows[TripNote]] == [('note', 'a'), ('note', '2')]
+
+
+def test_trip_without_rows_has_no_document(app, make_trip):
+    trip = make_trip()
+    assert load_itinerary(trip.id) is None
+    save_rows(db.session, trip.id, {'trip_summary': {'destination': 'Kyoto'}})
+    delete_rows(trip.id)
+    db.session.commit()
+    assert load_itinerary(trip.id) is None
+
+
+def test_backfill_writes_rows_for_trips_saved_before_the_tables(app, make_trip):
+    data = itinerary(2)
+    trips = [make_trip(itinerary=data, minutes=n) for n in range(5)]
+    broken = make_trip(minutes=5)
+    db.session.execute(db.text("UPDATE trip SET itinerary = 'not json' WHERE id = :id"), {'id': broken.id})
+    db.session.commit()
+    progress = []
+    assert backfill(db.session, batch_size=2, log=progress.append) == 6
+    assert len(progress) == 3
+    assert all(load_itinerary(trip.id) == data for trip in trips)
+    assert load_itinerary(broken.id)['trip_summary'] == {}
+    # Trips that have rows are left alone
+    assert backfill(db.session) == 0
+
+
+def test_compress_rewrites_plain_text_itineraries(app, make_trip):
+    trips = [make_trip(itinerary={'daily_plan': {'Day 1': f'Temples {n}'}}, minutes=n) for n in range(3)]
+    for trip in trips[:2]:
+        db.session.execute(db.text("UPDATE trip SET itinerary = :text WHERE id = :id"),
+                           {'text': json.dumps({'daily_plan': {'Day 1': 'Temples'}}, indent=2), 'id': trip.id})
+    db.session.execute(db.text("UPDATE trip SET itinerary = 'not json' WHERE id = :id"), {'id': trips[2].id})
+    db.session.commit()
+    assert compress_itineraries(db.session, batch_size=2) == 3
+    assert db.session.execute(db.text('SELECT DISTINCT typeof(itinerary) FROM trip')).scalars().all() == ['blob']
+    db.session.expire_all()
+    assert db.session.get(Trip, trips[0].id).itinerary == '{"daily_plan":{"Day 1":"Temples"}}'
+    assert db.session.get(Trip, trips[2].id).itinerary == 'not json'
+    assert compress_itineraries(db.session) == 0
@@ -0,0 +1,120 @@
+import json
+import time
+from datetime import date, datetime, timedelta
+
+import jobs
+from jobs import JobProgress, JobWorkerPool, enqueue_job, queue_position
+from llm import fake_response
+from models import db, GenerationJob, GenerationJobEvent, Trip
+
+PARAMS = {'destination': 'Kyoto', 'start_date': date(2030, 4, 1), 'end_date': date(2030, 4, 3), 'travelers': 2,
+          'budget': 1500, 'mood': 'Cultural', 'preferences': ''}
+
+
+def job(status='queued', minutes=0, **fields):
+    row = GenerationJob(id=f'{status}{minutes}', status=status, params='{}',
+                        created_at=datetime(2030, 1, 1) + timedelta(minutes=minutes), **fields)
+    db.session.add(row)
+    db.session.commit()
+    return row
+
+
+def status(job_id):
+    return db.session.query(GenerationJob.status).filter_by(id=job_id).scalar()
+
+
+def test_jobs_are_claimed_oldest_first_and_once(app):
+    newer, older = job(minutes=1), job(minutes=0)
+    assert queue_position(newer) == 2
+    pool = JobWorkerPool()
+    claimed = pool.claim('w1')
+    assert claimed.id == older.id and claimed.worker == 'w1' and claimed.attempts == 1
+    assert queue_position(claimed) == 0
+    assert pool.claim('w2').id == newer.id
+    assert pool.claim('w3') is None
+
+
+def test_expired_leases_are_requeued_until_the_last_attempt(app):
+    long_ago = datetime.utcnow() - timedelta(hours=1)
+    retried = job('running', 0, worker='w1', attempts=1, started_at=long_ago)
+    exhausted = job('running', 1, worker='w1', attempts=2, started_at=long_ago)
+    live = job('running', 2, worker='w2', attempts=1, started_at=datetime.utcnow())
+    JobWorkerPool().requeue_expired()
+    assert status(retried.id) == 'queued'
+    assert status(exhausted.id) == 'failed'
+    assert status(live.id) == 'running'
+
+
+def test_a_running_job_keeps_its_lease(app, monkeypatch):
+    data = json.loads(fake_response('Number of days: 3'))
+    seen = []
+
+    def generate(params, progress=None):
+        time.sleep(1)
+        other = JobWorkerPool()  # another worker looking for abandoned jobs
+        other.lease = 0.4
+        other.requeue_expired()
+        seen.append(status(queued.id))
+        return data
+
+    monkeypatch.setattr(jobs, 'generate_itinerary_data', generate)
+    queued = enqueue_job(PARAMS)
+    pool = JobWorkerPool()
+    pool.lease = 0.4
+    pool.process(pool.claim('w1'))
+    assert seen == ['running']
+    assert status(queued.id) == 'done'
+    assert db.session.get(Trip, db.session.get(GenerationJob, queued.id).trip_id).destination == 'Kyoto'
+
+
+def test_finished_jobs_are_pruned_with_their_events(app):
+    old = datetime.utcnow() - timedelta(days=8)
+    expired = job('done', 0, finished_at=old)
+    recent = job('failed', 1, finished_at=datetime.utcnow())
+    waiting = job('queued', 2)
+    for row in (expired, recent):
+        db.session.add(GenerationJobEvent(job_id=row.id, kind='section', name='trip_summary', value='{}'))
+    db.session.commit()
+    assert JobWorkerPool().prune_finished() == 1
+    assert {row.id for row in GenerationJob.query} == {recent.id, waiting.id}
+    assert [row.job_id for row in GenerationJobEvent.query] == [recent.id]
+
+
+def events(job_id):
+    return [(row.kind, row.name, row.item_key) for row in
+            GenerationJobEvent.query.filter_by(job_id=job_id).order_by(GenerationJobEvent.id)]
+
+
+def test_progress_sends_sections_and_items_as_they_stream(app):
+    queued = job()
+    progress = JobProgress(queued.id)
+    progress.reset()
+    progress.feed('{"trip_summary": {"destination": "Kyoto"}, "daily_plan": [{"day": "Day 1"}, ')
+    progress.feed('{"day": "Day 2"}]}')
+    assert events(queued.id) == [('section', 'trip_summary', None), ('item', 'daily_plan', '0'),
+                                 ('item', 'daily_plan', '1')]
+
+
+def test_a_new_attempt_resets_the_preview_but_keeps_pinned_sections(app):
+    queued = job()
+    progress = JobProgress(queued.id)
+    progress.pin('trending_places', [{'place': 'Gion'}])
+    progress.reset()
+    progress.feed('{"trip_summary": {}')
+    progress.reset()
+    progress.reset()  # nothing new was sent since the last reset
+    assert events(queued.id) == [('item', 'trending_places', '0'), ('section', 'trip_summary', None),
+                                 ('reset', None, None), ('item', 'trending_places', '0')]
+
+
+def test_a_reopened_stream_continues_after_the_last_event(client):
+    finished = job('done')
+    progress = JobProgress(finished.id)
+    for name in ('trip_summary', 'important_notes'):
+        progress.publish(name, {})
+    first = GenerationJobEvent.query.filter_by(job_id=finished.id, name='trip_summary').one()
+    for url, headers in ((f'/jobs/{finished.id}/events?last_event_id={first.id}', {}),
+                         (f'/jobs/{finished.id}/events', {'Last-Event-ID': str(first.id)})):
+        body = client.get(url, headers=headers).get_data(as_text=True)
+        assert 'important_notes' in body and 'trip_summary' not in body
+        assert body.rstrip().endswith('data: {"trip_id": null}')
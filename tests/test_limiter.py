@@ -0,0 +1,138 @@
+import threading
+import time
+
+import pytest
+
+from limiter import AdmissionController, AdmissionTimeout, TokenBucket
+
+
+class QuotaError(Exception):
+    code = 429
+
+
+@pytest.fixture
+def controller():
+    controller = AdmissionController()
+    controller.bucket = TokenBucket(60000, 1000)
+    return controller
+
+
+def test_limit_halves_on_throttling_down_to_the_minimum(controller):
+    for expected in (4, 2, 1, 1):
+        with pytest.raises(QuotaError):
+            with controller.acquire('flash'):
+                raise QuotaError()
+        assert controller.limit == expected
+    assert controller.stats()['throttled'] == 4
+
+
+def test_limit_grows_by_one_per_limits_worth_of_successes(controller):
+    controller.limit = 4.0
+    for _ in range(4):
+        with controller.acquire('flash'):
+            pass
+    assert 4.9 < controller.limit < 5.0
+    controller.limit = 15.99
+    with controller.acquire('flash'):
+        pass
+    assert controller.limit == controller.max_limit
+
+
+def test_other_errors_leave_the_limit_alone(controller):
+    with pytest.raises(ValueError):
+        with controller.acquire('flash'):
+            raise ValueError()
+    assert controller.limit == 8.0
+    assert controller.stats()['in_flight'] == 0
+
+
+def test_calls_over_the_limit_wait_and_time_out(controller):
+    controller.limit = 1.0
+    with controller.acquire('flash'):
+        with pytest.raises(AdmissionTimeout):
+            controller.acquire('pro', timeout=0.05)
+    assert controller.stats()['rejected'] == 1
+    with controller.acquire('pro', timeout=0.05):
+        pass
+
+
+def test_a_full_model_does_not_hold_back_others(controller):
+    controller.model_concurrency = 1
+    with controller.acquire('flash'):
+        with pytest.raises(AdmissionTimeout):
+            controller.acquire('flash', timeout=0.05)
+        with controller.acquire('pro', timeout=0.05):
+            assert controller.stats()['in_flight_by_model'] == {'flash': 1, 'pro': 1}
+
+
+def test_token_bucket_allows_a_burst_then_waits():
+    bucket = TokenBucket(60, 2)
+    for _ in range(2):
+        assert bucket.wait_time() == 0
+        bucket.take()
+    assert 0.9 < bucket.wait_time() <= 1.0
+
+
+def test_a_burst_of_throttled_calls_halves_the_limit_once(controller):
+    permits = [controller.acquire('flash') for _ in range(4)]
+    for permit in permits:
+        permit.__exit__(QuotaError, QuotaError(), None)
+    assert controller.limit == 4.0
+    assert controller.stats()['throttled'] == 4
+    # A call sent at the new limit that is throttled again halves it again
+    with pytest.raises(QuotaError):
+        with controller.acquire('flash'):
+            raise QuotaError()
+    assert controller.limit == 2.0
+
+
+def test_zero_rpm_means_no_rate_limit():
+    bucket = TokenBucket(0, 0)
+    for _ in range(100):
+        assert bucket.wait_time() == 0
+        bucket.take()
+
+
+def test_batch_attempts_do_not_hold_up_interactive_ones(app, monkeypatch):
+    from generation import generate_with_retry
+    from limiter import PRIORITY_BATCH, PRIORITY_INTERACTIVE, admission
+    from llm import FakeBackend, llm
+    from retry import breakers
+
+    class Recording(FakeBackend):
+        def __init__(self):
+            super().__init__(latency='fixed:0.01')
+            self.prompts = []
+
+        def generate(self, model_name, prompt, *args, **kwargs):
+            self.prompts.append(prompt)
+            return super().generate(model_name, prompt, *args, **kwargs)
+
+    backend = Recording()
+    monkeypatch.setattr(llm, 'backend', backend)
+    monkeypatch.setattr(breakers, '_breakers', {})
+    monkeypatch.setattr(admission, 'bucket', TokenBucket(0, 1))
+    monkeypatch.setattr(admission, 'limit', 1.0)
+    monkeypatch.setattr(admission, 'max_limit', 1)
+    monkeypatch.setitem(app.config, 'GEMINI_HEDGING', False)
+
+    def run(prompt, priority):
+        with app.app_context():
+            generate_with_retry(prompt, priority=priority)
+
+    held = admission.acquire('other')
+    threads = [threading.Thread(target=run, args=(f'Number of days: 1 batch {n}', PRIORITY_BATCH))
+               for n in range(20)]
+    for thread in threads:
+        thread.start()
+    while admission.stats()['waiting'] < 4:
+        time.sleep(0.01)
+    interactive = threading.Thread(target=run, args=('Number of days: 1 interactive', PRIORITY_INTERACTIVE))
+    interactive.start()
+    while admission.stats()['waiting'] < 5:
+        time.sleep(0.01)
+    held.__exit__(None, None, None)
+    for thread in threads + [interactive]:
+        thread.join(timeout=10)
+    assert len(backend.prompts) == 21
+    assert backend.prompts[0] == 'Number of days: 1 interactive'
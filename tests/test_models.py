@@ -0,0 +1,25 @@
+import json
+
+from sqlalchemy import LargeBinary, type_coerce
+
+from models import db, Trip
+
+
+def test_itinerary_is_stored_compressed(app, make_trip):
+    document = {'daily_plan': {f'Day {n}': 'Temples and tea ' * 20 for n in range(1, 8)}}
+    trip = make_trip(itinerary=document)
+    raw = db.session.execute(db.select(type_coerce(Trip.itinerary, LargeBinary))
+                             .where(Trip.id == trip.id)).scalar()
+    assert raw[0] == 1  # ENCODING_ZLIB
+    assert len(raw) < len(json.dumps(document))
+    db.session.expire_all()
+    assert json.loads(db.session.get(Trip, trip.id).itinerary) == document
+
+
+def test_legacy_plain_text_itineraries_still_read(app, make_trip):
+    trip = make_trip()
+    db.session.execute(db.text("UPDATE trip SET itinerary = :text WHERE id = :id"),
+                       {'text': '{"legacy": "ünïcode"}', 'id': trip.id})
+    db.session.commit()
+    db.session.expire_all()
+    assert json.loads(db.session.get(Trip, trip.id).itinerary) == {'legacy': 'ünïcode'}
@@ -0,0 +1,54 @@
+from parsing import IncrementalJSONParser, loads_lenient, salvage_json
+
+
+def test_sections_are_reported_as_they_complete():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"trip_summary": {"destination": "Ky') == []
+    assert parser.feed('oto"}, "notes": ["a"') == [('section', 'trip_summary', {'destination': 'Kyoto'})]
+    assert parser.feed(']}') == [('section', 'notes', ['a'])]
+    assert parser.done
+
+
+def test_expanded_members_report_each_item():
+    parser = IncrementalJSONParser(expand={'daily_plan'})
+    events = parser.feed('{"daily_plan": {"Day 1": "Temples", "Day 2": "Tea"}}')
+    assert events == [
+        ('item', 'daily_plan', 'Day 1', 'Temples'),
+        ('item', 'daily_plan', 'Day 2', 'Tea'),
+        ('section', 'daily_plan', {'Day 1': 'Temples', 'Day 2': 'Tea'}),
+    ]
+
+
+def test_text_around_the_object_is_skipped():
+    parser = IncrementalJSONParser()
+    assert parser.feed('```json\n{"a": 1, "b": true}\n```') == [('section', 'a', 1), ('section', 'b', True)]
+
+
+def test_escaped_quotes_and_brackets_inside_strings():
+    sections, partial = salvage_json('{"a": "say \\"hi\\" } ]", "b": 2}')
+    assert sections == {'a': 'say "hi" } ]', 'b': 2}
+    assert partial == {}
+
+
+def test_salvage_closes_a_cut_off_member_at_its_last_complete_value():
+    sections, partial = salvage_json('{"trip_summary": {"destination": "Kyoto"}, '
+                                     '"daily_plan": {"Day 1": "Temples", "Day 2": "Tea cere')
+    assert sections == {'trip_summary': {'destination': 'Kyoto'}}
+    assert partial == {'daily_plan': {'Day 1': 'Temples'}}
+
+
+def test_salvage_of_a_cut_off_list():
+    sections, partial = salvage_json('{"notes": ["a", "b", {"c": ')
+    assert sections == {}
+    assert partial == {'notes': ['a', 'b']}
+
+
+def test_salvage_tolerates_trailing_commas():
+    sections, partial = salvage_json('{"notes": ["a", "b",], "budget": {"total": 10,},}')
+    assert sections == {'notes': ['a', 'b'], 'budget': {'total': 10}}
+    assert partial == {}
+
+
+def test_loads_lenient():
+    assert loads_lenient('[1, 2,]') == [1, 2]
+    assert loads_lenient('{"a": ') is None
@@ -0,0 +1,84 @@
+from datetime import date
+
+import pytest
+
+import prewarm
+from budget import budget_tier
+from cache import destination_cache, make_destination_key
+from models import db, Trip
+from prewarm import Prewarmer, in_hours, parse_hours
+from retry import ModelsUnavailable
+from schema import DESTINATION_SECTIONS
+from singleflight import acquire_lock
+
+SECTIONS = {name: f'shared {name}' for name in DESTINATION_SECTIONS}
+
+
+def trips(destination, count, budget=1500):
+    for _ in range(count):
+        db.session.add(Trip(destination=destination, start_date=date(2030, 4, 1), end_date=date(2030, 4, 3),
+                            travelers=2, budget=budget, mood='Cultural', itinerary='{}'))
+    db.session.commit()
+
+
+def key(destination, budget=1500):
+    return make_destination_key(destination, 4, 'Cultural', budget_tier(budget, 3, 2))
+
+
+@pytest.fixture
+def prewarmer(app):
+    prewarmer = Prewarmer()
+    prewarmer.rpm = 0
+    return prewarmer
+
+
+def test_hours():
+    assert parse_hours('1-6') == (1, 6)
+    assert parse_hours('') is None
+    assert in_hours((1, 6), 1) and in_hours((1, 6), 5) and not in_hours((1, 6), 6)
+    assert in_hours((22, 4), 23) and in_hours((22, 4), 3) and not in_hours((22, 4), 12)
+    assert in_hours(None, 12)
+
+
+def test_popular_ranks_by_key_across_spellings_and_budgets(prewarmer):
+    trips('Kyoto', 2)
+    trips('kyoto ', 2, budget=1550)
+    trips('Oslo', 3)
+    trips('Kyoto', 1, budget=9000)
+    ranked = list(prewarmer.popular())
+    assert [k for k, _ in ranked] == [key('Kyoto'), key('Oslo'), key('Kyoto', 9000)]
+    assert ranked[0][1]['destination'] in ('Kyoto', 'kyoto ')
+    prewarmer.top = 1
+    assert len(list(prewarmer.popular())) == 1
+
+
+def test_run_stores_missing_sections_and_skips_warm_or_busy_ones(prewarmer, monkeypatch):
+    trips('Kyoto', 3)
+    trips('Oslo', 2)
+    trips('Lima', 1)
+    destination_cache.set(key('Oslo'), SECTIONS, 1.0)
+    assert acquire_lock(key('Lima'), 'another process', 60)
+    generated = []
+
+    def generate(params, priority):
+        generated.append(params['destination'])
+        return SECTIONS
+
+    monkeypatch.setattr(prewarm, 'generate_destination_sections', generate)
+    outcomes = prewarmer.run_once(ignore_hours=True)
+    assert (outcomes['stored'], outcomes['warm'], outcomes['busy']) == (1, 1, 1)
+    assert generated == ['Kyoto']
+    assert destination_cache.get(key('Kyoto'))[0] == SECTIONS
+    assert prewarmer.stats()['stored'] == 1
+
+
+def test_run_stops_when_the_models_are_unavailable(prewarmer, monkeypatch):
+    trips('Kyoto', 2)
+    trips('Oslo', 1)
+
+    def generate(params, priority):
+        raise ModelsUnavailable('quota')
+
+    monkeypatch.setattr(prewarm, 'generate_destination_sections', generate)
+    assert prewarmer.run_once(ignore_hours=True)['unavailable'] == 1
+    assert acquire_lock(key('Kyoto'), 'another process', 60)
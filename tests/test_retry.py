@@ -0,0 +1,136 @@
+import random
+
+import pytest
+
+from retry import CircuitBreaker, CircuitBreakerRegistry, ModelsUnavailable, RetryPolicy, run_with_retry
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class InlineScheduler:
+    """Runs scheduled calls at once, recording the delays asked for."""
+
+    def __init__(self):
+        self.delays = []
+
+    def call_later(self, delay, fn, *args):
+        self.delays.append(delay)
+        fn(*args)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker('flash', failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_lets_one_probe_through_after_the_cool_off():
+    breaker = CircuitBreaker('flash', failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+
+def test_released_probe_can_be_retried_without_closing():
+    breaker = CircuitBreaker('flash', failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+def test_backoff_is_full_jitter_under_the_cap():
+    random.seed(1)
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    for attempt in range(1, 6):
+        delays = [policy.backoff(attempt) for _ in range(200)]
+        cap = min(5.0, 2 ** attempt)
+        assert all(0 <= delay <= cap for delay in delays)
+        assert max(delays) > cap * 0.8 and min(delays) < cap * 0.2
+
+
+def test_retries_then_falls_back_to_the_next_model():
+    calls = []
+
+    def call(model):
+        calls.append(model)
+        if model == 'pro':
+            raise ApiError(503)
+        return f'answer from {model}'
+
+    breakers = CircuitBreakerRegistry()
+    scheduler = InlineScheduler()
+    future = run_with_retry(call, ['pro', 'flash'], RetryPolicy(max_attempts=3), breakers, scheduler)
+    assert future.result(timeout=1) == 'answer from flash'
+    assert calls == ['pro', 'pro', 'pro', 'flash']
+    assert breakers.get('pro').failures == 3
+    # Backoff before the second and third attempt, none before switching model
+    assert scheduler.delays[0] == 0 and scheduler.delays[-1] == 0
+    assert all(0 <= delay <= 4 for delay in scheduler.delays)
+
+
+def test_gives_up_when_the_deadline_would_pass():
+    def call(model):
+        raise ApiError(503)
+
+    policy = RetryPolicy(max_attempts=5, deadline=0.5)
+    policy.backoff = lambda attempt: 1.0
+    scheduler = InlineScheduler()
+    future = run_with_retry(call, ['flash'], policy, CircuitBreakerRegistry(), scheduler)
+    with pytest.raises(ModelsUnavailable):
+        future.result(timeout=1)
+    assert scheduler.delays == [0]
+
+
+def test_open_breakers_are_skipped():
+    breakers = CircuitBreakerRegistry()
+    breakers.get('pro', failure_threshold=1).record_failure()
+    future = run_with_retry(lambda model: model, ['pro', 'flash'], RetryPolicy(), breakers, InlineScheduler())
+    assert future.result(timeout=1) == 'flash'
+
+
+def test_bad_requests_are_not_retried_and_do_not_trip_the_breaker():
+    calls = []
+
+    def call(model):
+        calls.append(model)
+        raise ApiError(400)
+
+    breakers = CircuitBreakerRegistry()
+    future = run_with_retry(call, ['flash'], RetryPolicy(), breakers, InlineScheduler())
+    with pytest.raises(ApiError):
+        future.result(timeout=1)
+    assert calls == ['flash']
+    assert breakers.get('flash').state == CircuitBreaker.CLOSED
+
+
+def test_local_failures_give_back_the_half_open_probe():
+    breakers = CircuitBreakerRegistry()
+    breaker = breakers.get('flash', failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    def call(model):
+        raise RuntimeError('no upstream call')
+
+    future = run_with_retry(call, ['flash'], RetryPolicy(), breakers, InlineScheduler(),
+                            breaker_options={'failure_threshold': 1, 'reset_timeout': 0})
+    with pytest.raises(RuntimeError):
+        future.result(timeout=1)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
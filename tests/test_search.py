@@ -0,0 +1,70 @@
+import json
+from datetime import date
+
+from llm import fake_response
+from models import db, Trip
+from pipeline import save_trip
+from search import create_search_index, search_terms, search_trips
+
+
+def test_search_terms_drop_stop_words_and_quote_the_rest():
+    assert search_terms('The Kyoto trip with a ryokan, kyoto!') == ['"kyoto"', '"ryokan"']
+    assert search_terms('NEAR(a b) OR "x*"') == ['"near"', '"b"', '"x"']
+    assert search_terms('the and of') == []
+
+
+def test_trips_with_all_the_words_rank_by_weighted_column(app, make_trip):
+    in_preferences = make_trip('Lisbon', preferences='kyoto food')
+    destination = make_trip('Kyoto', preferences='food')
+    make_trip('Kyoto', preferences='hiking')
+    trips, more = search_trips('kyoto food', 1, 10)
+    assert [trip.id for trip in trips] == [destination.id, in_preferences.id]
+    assert not more
+
+
+def test_falls_back_to_any_of_the_words(app, make_trip):
+    kyoto = make_trip('Kyoto')
+    make_trip('Oslo')
+    trips, _ = search_trips('kyoto ramen', 1, 10)
+    assert [trip.id for trip in trips] == [kyoto.id]
+
+
+def test_stemming_and_paging(app, make_trip):
+    for n in range(3):
+        make_trip('Kyoto', preferences='temples', minutes=n)
+    first, more = search_trips('temple', 1, 2)
+    second, more_after = search_trips('temple', 2, 2)
+    assert len(first) == 2 and more
+    assert len(second) == 1 and not more_after
+    assert {trip.id for trip in first}.isdisjoint(trip.id for trip in second)
+
+
+def test_api_search(client, make_trip):
+    make_trip('Kyoto')
+    page = client.get('/api/search?q=kyoto').get_json()
+    assert [trip['destination'] for trip in page['trips']] == ['Kyoto']
+    assert page['next'] is None
+    assert client.get('/api/search?q=the').get_json()['trips'] == []
+
+
+def drop_search_index():
+    db.session.execute(db.text('DROP TABLE trip_search'))
+    db.session.commit()
+
+
+def test_startup_creates_a_missing_search_index(app, make_trip):
+    drop_search_index()
+    create_search_index(db.engine)
+    create_search_index(db.engine)  # already there
+    kyoto = make_trip('Kyoto')
+    assert search_trips('kyoto', 1, 10)[0] == [kyoto]
+
+
+def test_a_trip_that_fails_to_index_is_still_saved(app, caplog):
+    drop_search_index()
+    params = {'destination': 'Kyoto', 'start_date': date(2030, 4, 1), 'end_date': date(2030, 4, 3),
+              'travelers': 2, 'budget': 1500, 'mood': 'Cultural', 'preferences': ''}
+    trip = save_trip(params, json.loads(fake_response('Number of days: 3')))
+    db.session.expire_all()
+    assert db.session.get(Trip, trip.id).destination == 'Kyoto'
+    assert f'could not index trip {trip.id}' in caplog.text
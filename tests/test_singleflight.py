@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import pipeline
+from budget import parse_money
+from llm import fake_response
+from models import db, GenerationLock
+from singleflight import SingleFlight, acquire_lock, keep_lock, release_lock, renew_lock
+
+
+def run_concurrently(flight, fn, callers):
+    started = threading.Event()
+    release = threading.Event()
+    results, errors = [], []
+
+    def leader():
+        started.set()
+        release.wait(5)
+        return fn()
+
+    def call(work):
+        try:
+            results.append(flight.do('key', work))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call, args=(leader,))]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=call, args=(fn,)) for _ in range(callers - 1)]
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+    results, errors = run_concurrently(SingleFlight(), lambda: calls.append(1) or 'result', 4)
+    assert calls == [1] and not errors
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert {result for result, _ in results} == {'result'}
+
+
+def test_concurrent_callers_share_the_error():
+    def fail():
+        raise ValueError('boom')
+
+    results, errors = run_concurrently(SingleFlight(), fail, 3)
+    assert not results and len(errors) == 3
+    assert all(str(e) == 'boom' for e in errors)
+
+
+def test_lock_is_exclusive_until_released(app):
+    assert acquire_lock('key', 'a', 60)
+    assert not acquire_lock('key', 'b', 60)
+    release_lock('key', 'b')  # not the holder: nothing happens
+    assert not acquire_lock('key', 'b', 60)
+    release_lock('key', 'a')
+    assert acquire_lock('key', 'b', 60)
+
+
+def test_expired_lock_is_taken_over(app):
+    db.session.add(GenerationLock(key='key', owner='dead', expires_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+    assert acquire_lock('key', 'b', 60)
+    assert not renew_lock('key', 'dead', 60)
+    assert db.session.get(GenerationLock, 'key').owner == 'b'
+
+
+def test_holder_keeps_the_lock_past_its_ttl(app):
+    assert acquire_lock('key', 'a', 0.3)
+    with keep_lock('key', 'a', 0.3):
+        time.sleep(0.8)
+        assert not acquire_lock('key', 'b', 0.3)
+    time.sleep(0.4)
+    assert acquire_lock('key', 'b', 0.3)
+
+
+def test_leader_and_followers_personalize_their_own_copy(app, monkeypatch):
+    data = json.loads(fake_response('Number of days: 3'))
+    calls = []
+
+    def generate(params, cache_key, progress, priority):
+        calls.append(params['budget'])
+        time.sleep(0.3)
+        return data
+
+    monkeypatch.setattr(pipeline, '_generate_coalesced', generate)
+    base = {'destination': 'Kyoto', 'start_date': date(2030, 4, 1), 'end_date': date(2030, 4, 3), 'travelers': 2,
+            'mood': 'Cultural', 'preferences': ''}
+    budgets = [1000, 1010, 1020, 1030]
+    results = {}
+
+    def request(budget):
+        with app.app_context():
+            results[budget] = pipeline.generate_itinerary_data(dict(base, budget=budget))
+
+    threads = [threading.Thread(target=request, args=(budget,)) for budget in budgets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    for budget in budgets:
+        plan = results[budget]['daily_budget_plan']
+        assert sum(parse_money(day['estimated_spend']) for day in plan) == budget * 100
+        assert results[budget] is not data
+    assert data == json.loads(fake_response('Number of days: 3'))
@@ -0,0 +1,123 @@
+import json
+from datetime import date
+
+import pytest
+
+import strategies
+from generation import ModelResponse
+from retry import ModelsUnavailable
+from schema import ITINERARY_SECTIONS
+from strategies import IncompleteResponse, _generate_full, _parse, _repair
+
+PARAMS = {'destination': 'Kyoto', 'start_date': None, 'end_date': None, 'travelers': 2, 'budget': 1500,
+          'mood': 'Cultural', 'preferences': ''}
+
+
+class Progress:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, name, value):
+        self.published.append((name, value))
+
+
+def test_complete_response_parses():
+    assert _parse(ModelResponse('```json\n{"trip_summary": {"destination": "Kyoto"}}\n```'), False,
+                  required=['trip_summary']) == {'trip_summary': {'destination': 'Kyoto'}}
+
+
+def test_cut_off_response_keeps_the_complete_sections():
+    text = '{"trip_summary": {"destination": "Kyoto"}, "daily_plan": {"Day 1": "Temples", "Day 2": "Te'
+    with pytest.raises(IncompleteResponse) as raised:
+        _parse(ModelResponse(text), False, required=['trip_summary', 'daily_plan', 'important_notes'])
+    assert raised.value.salvaged == {'trip_summary': {'destination': 'Kyoto'}}
+    assert raised.value.partial == {'daily_plan': {'Day 1': 'Temples'}}
+    assert raised.value.missing == ['daily_plan', 'important_notes']
+
+
+def test_response_cut_off_after_the_required_sections_is_used():
+    text = '{"trip_summary": {"destination": "Kyoto"}, "important_notes": ["Cash"], "extra": ['
+    assert _parse(ModelResponse(text), False, required=['trip_summary', 'important_notes']) == {
+        'trip_summary': {'destination': 'Kyoto'}, 'important_notes': ['Cash']}
+
+
+def test_structured_daily_plan_is_converted_when_salvaged():
+    text = '{"daily_plan": [{"day": "Day 1", "activities": "Temples"}], "trip_summary": {"dest'
+    with pytest.raises(IncompleteResponse) as raised:
+        _parse(ModelResponse(text), True, required=['daily_plan', 'trip_summary'])
+    assert raised.value.salvaged == {'daily_plan': {'Day 1': 'Temples'}}
+    assert raised.value.missing == ['trip_summary']
+
+
+def _incomplete(salvaged, partial, missing):
+    error = json.JSONDecodeError('cut off', '', 0)
+    return IncompleteResponse(error, salvaged, partial, missing)
+
+
+def test_repair_asks_only_for_the_missing_sections(monkeypatch):
+    requested = []
+
+    def generate_section_group(params, sections, priority):
+        requested.append(sections)
+        return {name: f'repaired {name}' for name in sections}
+
+    monkeypatch.setattr(strategies, '_generate_section_group', generate_section_group)
+    progress = Progress()
+    data = _repair(PARAMS, _incomplete({'trip_summary': {'destination': 'Kyoto'}}, {},
+                                       ['daily_plan', 'important_notes']), progress, 0)
+    assert requested == [['important_notes'], ['daily_plan']]
+    assert list(data) == [name for name in ITINERARY_SECTIONS if name in data]
+    assert data['daily_plan'] == 'repaired daily_plan'
+    assert sorted(progress.published) == [('daily_plan', 'repaired daily_plan'),
+                                          ('important_notes', 'repaired important_notes')]
+
+
+def test_repair_of_a_day_range_regenerates_that_range(monkeypatch):
+    ranges = []
+
+    def generate_day_range(params, plan_days, priority):
+        ranges.append(plan_days)
+        return {'daily_plan': {'Day 3': 'Hike'}, 'daily_budget_plan': []}
+
+    monkeypatch.setattr(strategies, '_generate_day_range', generate_day_range)
+    data = _repair(PARAMS, _incomplete({'trip_summary': {}}, {}, ['daily_plan']), None, 0, plan_days=(3, 4))
+    assert ranges == [(3, 4)]
+    assert data == {'trip_summary': {}, 'daily_plan': {'Day 3': 'Hike'}}
+
+
+def test_failed_repair_falls_back_to_the_partial_sections(monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise ModelsUnavailable()
+
+    monkeypatch.setattr(strategies, '_generate_section_group', unavailable)
+    data = _repair(PARAMS, _incomplete({'trip_summary': {}}, {'daily_plan': {'Day 1': 'Temples'}}, ['daily_plan']),
+                   None, 0)
+    assert data == {'trip_summary': {}, 'daily_plan': {'Day 1': 'Temples'}}
+    with pytest.raises(ModelsUnavailable):
+        _repair(PARAMS, _incomplete({'trip_summary': {}}, {}, ['daily_plan']), None, 0)
+
+
+def test_cut_off_itinerary_is_repaired_instead_of_regenerated(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'GEMINI_STRUCTURED_OUTPUT', False)
+    full = {name: f'{name} text' for name in ITINERARY_SECTIONS}
+    cut = json.dumps(full)
+    cut = cut[:cut.index('"important_notes"') + 25]
+    prompts = []
+
+    def generate_with_retry(prompt, **kwargs):
+        prompts.append(prompt)
+        if len(prompts) == 1:
+            return ModelResponse(cut)
+        return ModelResponse(json.dumps({'important_notes': 'notes', 'daily_budget_plan': 'plan',
+                                         'budget_tracking': 'tracking'}))
+
+    monkeypatch.setattr(strategies, 'generate_with_retry', generate_with_retry)
+    params = dict(PARAMS, start_date=date(2030, 4, 1), end_date=date(2030, 4, 2))
+    data = _generate_full(params, None, 0)
+    # The cut-off section and the ones after it: the non-daily ones in one prompt, the daily ones in another
+    assert len(prompts) == 3
+    assert 'Only write these sections: important_notes, budget_tracking.' in prompts[1]
+    assert 'Only write these sections: daily_budget_plan.' in prompts[2]
+    assert data['trip_summary'] == 'trip_summary text'
+    assert data['important_notes'] == 'notes'
+    assert list(data) == list(ITINERARY_SECTIONS)
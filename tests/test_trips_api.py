@@ -0,0 +1,50 @@
+def test_pages_follow_the_cursor_newest_first(client, make_trip):
+    ids = [make_trip(f'City {n}', minutes=n).id for n in range(5)]
+    # Two trips saved in the same instant are ordered by id
+    ids.append(make_trip('Twin', minutes=4).id)
+
+    seen = []
+    url = '/api/trips?limit=2'
+    while url:
+        page = client.get(url).get_json()
+        assert len(page['trips']) <= 2
+        seen += [trip['id'] for trip in page['trips']]
+        url = page['next']
+    assert seen == [ids[5], ids[4], ids[3], ids[2], ids[1], ids[0]]
+
+
+def test_last_page_has_no_next_cursor(client, make_trip):
+    make_trip()
+    page = client.get('/api/trips?limit=2').get_json()
+    assert [trip['destination'] for trip in page['trips']] == ['Kyoto']
+    assert page['next_cursor'] is None and page['next'] is None
+
+
+def test_trips_come_without_their_itinerary(client, make_trip):
+    make_trip(itinerary={'trip_summary': {'destination': 'Kyoto'}, 'daily_plan': {'Day 1': 'Temples'}})
+    trip = client.get('/api/trips').get_json()['trips'][0]
+    assert 'itinerary' not in trip and 'preferences' not in trip
+    assert trip['start_date'] == '2030-04-01'
+
+
+def test_page_size_is_clamped(client, make_trip):
+    for n in range(3):
+        make_trip(minutes=n)
+    assert len(client.get('/api/trips?limit=0').get_json()['trips']) == 1
+    assert len(client.get('/api/trips?limit=1000').get_json()['trips']) == 3
+
+
+def test_bad_cursor_is_a_bad_request(client):
+    assert client.get('/api/trips?cursor=yesterday').status_code == 400
+    assert client.get('/api/trips?cursor=2030-01-01T00:00:00_x').status_code == 400
+
+
+def test_trips_page_links_to_the_next_page(app, client, make_trip, monkeypatch):
+    monkeypatch.setitem(app.config, 'TRIPS_PAGE_SIZE', 2)
+    for n in range(3):
+        make_trip(f'City {n}', minutes=n)
+    page = client.get('/trips').get_data(as_text=True)
+    assert 'City 2' in page and 'City 1' in page and 'City 0' not in page
+    next_page = client.get('/api/trips?limit=2').get_json()['next_cursor']
+    assert f'href="/trips?cursor={next_page}"' in page
+    assert 'City 0' in client.get(f'/trips?cursor={next_page}').get_data(as_text=True)
@@ -0,0 +1,135 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from flask import current_app, g, has_request_context, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+TOKEN_HEADER = 'X-Server-Timing-Token'
+
+_local = threading.local()
+
+
+class Timings:
+    """Named stage durations for one request or generation job."""
+
+    def __init__(self):
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, desc=None):
+        with self._lock:
+            self.stages.append((name, seconds * 1000, desc))
+
+    @contextmanager
+    def stage(self, name, desc=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started, desc)
+
+    def to_list(self):
+        with self._lock:
+            return [{'name': name, 'dur': round(ms, 1), 'desc': desc} for name, ms, desc in self.stages]
+
+    def header(self):
+        return format_header(self.to_list())
+
+
+def format_header(stages):
+    """Server-Timing header value for a list of {name, dur, desc} stages."""
+    parts = []
+    for stage in stages:
+        part = stage['name']
+        if stage.get('desc'):
+            part += ';desc="{}"'.format(str(stage['desc']).replace('"', "'"))
+        parts.append(f"{part};dur={stage['dur']:.1f}")
+    return ', '.join(parts)
+
+
+def current():
+    """Timings being collected for this request or job, or None."""
+    if has_request_context():
+        return g.get('server_timing')
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def bind(timings):
+    """Collect stages from this thread into timings (used by job and executor threads)."""
+    previous = getattr(_local, 'timings', None)
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+def stage(name, desc=None):
+    """Time a block as a Server-Timing stage; a no-op unless timing is on for this request."""
+    timings = current()
+    if timings is None:
+        return nullcontext()
+    return timings.stage(name, desc)
+
+
+class ServerTiming:
+    """Adds a Server-Timing header with the stages recorded during a request.
+
+    Timing is on for every request with SERVER_TIMING, or for requests that
+    carry a valid signed token in the X-Server-Timing-Token header.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.token_max_age = 3600
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SERVER_TIMING', self.enabled)
+        self.token_max_age = app.config.get('SERVER_TIMING_TOKEN_MAX_AGE', self.token_max_age)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.extensions['server_timing'] = self
+
+    def _serializer(self):
+        secret = current_app.config.get('SERVER_TIMING_SECRET') or current_app.config['SECRET_KEY']
+        return URLSafeTimedSerializer(secret, salt='server-timing')
+
+    def token(self):
+        """A signed token that turns timing on for requests sending it in X-Server-Timing-Token."""
+        return self._serializer().dumps('on')
+
+    def requested(self):
+        """True if timing is on for the current request."""
+        if self.enabled:
+            return True
+        token = request.headers.get(TOKEN_HEADER)
+        if not token:
+            return False
+        try:
+            self._serializer().loads(token, max_age=self.token_max_age)
+        except BadSignature:
+            return False
+        return True
+
+    def _start(self):
+        if self.requested():
+            g.server_timing = Timings()
+            g.server_timing_started = time.perf_counter()
+
+    def _finish(self, response):
+        timings = g.get('server_timing')
+        if timings is not None:
+            timings.add('total', time.perf_counter() - g.server_timing_started)
+            header = timings.header()
+            if response.headers.get('Server-Timing'):
+                # Stages recorded elsewhere, e.g. by the job that generated the trip
+                header = f"{response.headers['Server-Timing']}, {header}"
+            response.headers['Server-Timing'] = header
+        return response
+
+
+server_timing = ServerTiming()
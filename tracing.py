@@ -0,0 +1,290 @@
+import atexit
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_REQUEST_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+_local = threading.local()
+
+
+class Span:
+    """One timed operation of a trace; the trace id doubles as the request id."""
+
+    def __init__(self, name, trace_id=None, parent_id=None, kind=INTERNAL, attributes=None):
+        self.name = name
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self.set_attributes(attributes or {})
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_error(self, error):
+        self.error = f'{type(error).__name__}: {error}'
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    def carrier(self):
+        """What a job or another thread needs to continue this trace."""
+        return {'trace_id': self.trace_id, 'span_id': self.span_id}
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': [_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.error else {},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def current_span():
+    """The innermost open span of this thread, or the span of the current request."""
+    span = getattr(_local, 'span', None)
+    if span is None and has_request_context():
+        span = g.get('trace_span')
+    return span
+
+
+def request_id():
+    """Id of the request (trace) this code runs for, or None."""
+    span = current_span()
+    return span.trace_id if span is not None else None
+
+
+def carrier():
+    span = current_span()
+    return span.carrier() if span is not None else None
+
+
+@contextmanager
+def bind(span):
+    """Make span the parent of spans opened in this thread (used by executor threads)."""
+    previous = getattr(_local, 'span', None)
+    _local.span = span
+    try:
+        yield span
+    finally:
+        _local.span = previous
+
+
+@contextmanager
+def span(name, parent=None, kind=INTERNAL, **attributes):
+    """Time a block as a child span of parent (a Span or carrier), by default the current span."""
+    if parent is None:
+        parent = current_span()
+    if isinstance(parent, Span):
+        parent = parent.carrier()
+    opened = Span(name, parent and parent['trace_id'], parent and parent['span_id'], kind, attributes)
+    try:
+        with bind(opened):
+            yield opened
+    except BaseException as e:
+        opened.record_error(e)
+        raise
+    finally:
+        opened.end()
+        tracer.export(opened)
+
+
+class BatchExporter:
+    """Queue finished spans and send them in OTLP JSON batches from a background thread."""
+
+    def __init__(self, service_name='wandermate', batch_size=256, interval=1.0, max_queue=10000):
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, span):
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            # Never slow down a request for its spans
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            spans = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(spans) < self.batch_size:
+                try:
+                    spans.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._export(spans)
+
+    def flush(self):
+        """Send everything queued so far from the calling thread."""
+        spans = []
+        while True:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if spans:
+            self._export(spans)
+
+    def _export(self, spans):
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', self.service_name),
+                                        _attribute('process.pid', os.getpid())]},
+            'scopeSpans': [{'scope': {'name': 'wandermate'}, 'spans': [span.to_otlp() for span in spans]}],
+        }]}
+        try:
+            self.send(json.dumps(payload, separators=(',', ':')))
+        except Exception:
+            self.dropped += len(spans)
+
+    def send(self, body):
+        raise NotImplementedError
+
+
+class FileExporter(BatchExporter):
+    """Append each batch as one line of OTLP JSON, the format of the collector's file exporter."""
+
+    def __init__(self, path, **options):
+        super().__init__(**options)
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._write_lock = threading.Lock()
+
+    def send(self, body):
+        with self._write_lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(body + '\n')
+
+
+class OTLPExporter(BatchExporter):
+    """POST each batch to an OTLP/HTTP JSON endpoint such as a local collector."""
+
+    def __init__(self, endpoint, timeout=5.0, **options):
+        super().__init__(**options)
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def send(self, body):
+        req = urllib.request.Request(self.endpoint, data=body.encode('utf-8'), method='POST',
+                                     headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            response.read()
+
+
+def create_exporter(config):
+    kind = config.get('TRACE_EXPORTER', 'none')
+    service_name = config.get('TRACE_SERVICE_NAME', 'wandermate')
+    if kind == 'none':
+        return None
+    if kind == 'file':
+        return FileExporter(config.get('TRACE_FILE', 'instance/traces.jsonl'), service_name=service_name)
+    if kind == 'otlp':
+        return OTLPExporter(config.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces'),
+                            service_name=service_name)
+    raise ValueError(f'Unknown TRACE_EXPORTER: {kind!r}')
+
+
+class Tracer:
+    """Opens a span for every request and exports finished spans (TRACE_EXPORTER).
+
+    The trace id is the request id: it is taken from a valid incoming
+    X-Request-ID header or generated, returned in the X-Request-ID response
+    header and logged with each request. Spans are recorded even without an
+    exporter, so the request id is always available.
+    """
+
+    def __init__(self, app=None):
+        self.exporter = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.exporter = create_exporter(app.config)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        app.extensions['tracer'] = self
+
+    def export(self, span):
+        if self.exporter is not None:
+            self.exporter.submit(span)
+
+    def _start(self):
+        incoming = request.headers.get(REQUEST_ID_HEADER, '').lower()
+        rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g.trace_span = Span(f'{request.method} {rule}', incoming if _REQUEST_ID.match(incoming) else None,
+                            kind=SERVER, attributes={'http.request.method': request.method, 'http.route': rule})
+        g.trace_started = time.perf_counter()
+
+    def _finish(self, response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.set_attribute('http.response.status_code', response.status_code)
+            response.headers[REQUEST_ID_HEADER] = span.trace_id
+            current_app.logger.info('%s %s %s %.1fms request_id=%s', request.method, request.path,
+                                    response.status_code, (time.perf_counter() - g.trace_started) * 1000,
+                                    span.trace_id)
+        return response
+
+    def _teardown(self, error=None):
+        span = g.pop('trace_span', None)
+        if span is not None:
+            if error is not None:
+                span.record_error(error)
+            span.end()
+            self.export(span)
+
+
+tracer = Tracer()